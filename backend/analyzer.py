@@ -5,17 +5,38 @@ Downloads YouTube audio and converts to MIDI-like JSON using Spotify's basic-pit
 """
 
 import os
-import json
 import tempfile
 import logging
 import math
+import re
+import time
+import wave
+import threading
 from pathlib import Path
+from urllib.parse import urlparse, parse_qs
 from typing import Optional, Callable, List, Dict, Any, Tuple
-from collections import defaultdict
+from dataclasses import dataclass
+from contextlib import contextmanager
 import warnings
 
+import numpy as np
 import yt_dlp
 
+try:
+    from backend.serialization import write_json_atomic  # Docker 環境
+    from backend.note_extraction import extract_note_events, model_frames_to_time, POSTERIOR_DTYPE
+    from backend.audio_store import hash_file
+    from backend.instrumentation import (
+        StageTrace, tracing, stage, set_audio_duration, current_trace, add_skipped_seconds
+    )
+    from backend.segmenter import find_active_regions, skipped_seconds, copy_wav_segment
+except ImportError:
+    from serialization import write_json_atomic  # 本地開發
+    from note_extraction import extract_note_events, model_frames_to_time, POSTERIOR_DTYPE
+    from audio_store import hash_file
+    from instrumentation import StageTrace, tracing, stage, set_audio_duration, current_trace, add_skipped_seconds
+    from segmenter import find_active_regions, skipped_seconds, copy_wav_segment
+
 # 設定日誌
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -25,135 +46,377 @@ warnings.filterwarnings('ignore', category=FutureWarning)
 warnings.filterwarnings('ignore', category=UserWarning)
 
 
+# ============================================
+# 欄式音符表 (Structure of Arrays)
+# ============================================
+
+@dataclass
+class NoteTable:
+    """
+    以 NumPy 欄位儲存的音符表
+
+    每個音符只佔 26 bytes（dict 版本約 350 bytes），
+    所有清洗階段都以向量化方式處理整欄資料，
+    只有在序列化輸出時才轉回 dict 列表。
+
+    Attributes:
+        pitch: MIDI 音高 (uint8)
+        start: 開始時間(秒) (float64)
+        end: 結束時間(秒) (float64)
+        duration: 時長(秒) (float64)
+        velocity: 力度 1-127 (uint8)
+    """
+    pitch: np.ndarray
+    start: np.ndarray
+    end: np.ndarray
+    duration: np.ndarray
+    velocity: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.pitch)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(col.nbytes for col in (self.pitch, self.start, self.end, self.duration, self.velocity))
+
+    @classmethod
+    def empty(cls) -> 'NoteTable':
+        return cls(
+            pitch=np.empty(0, dtype=np.uint8),
+            start=np.empty(0, dtype=np.float64),
+            end=np.empty(0, dtype=np.float64),
+            duration=np.empty(0, dtype=np.float64),
+            velocity=np.empty(0, dtype=np.uint8),
+        )
+
+    @classmethod
+    def from_dicts(cls, notes: List[Dict[str, Any]]) -> 'NoteTable':
+        """由 notes.json 格式的 dict 列表建立音符表"""
+        count = len(notes)
+        return cls(
+            pitch=np.fromiter((n['pitch'] for n in notes), dtype=np.uint8, count=count),
+            start=np.fromiter((n['start_time'] for n in notes), dtype=np.float64, count=count),
+            end=np.fromiter((n['end_time'] for n in notes), dtype=np.float64, count=count),
+            duration=np.fromiter((n['duration'] for n in notes), dtype=np.float64, count=count),
+            velocity=np.fromiter((n['velocity'] for n in notes), dtype=np.uint8, count=count),
+        )
+
+    @classmethod
+    def concat(cls, tables: List['NoteTable']) -> 'NoteTable':
+        """串接多個音符表（例如分段推論的各段結果）"""
+        tables = [t for t in tables if len(t)]
+        if not tables:
+            return cls.empty()
+        return cls(
+            pitch=np.concatenate([t.pitch for t in tables]),
+            start=np.concatenate([t.start for t in tables]),
+            end=np.concatenate([t.end for t in tables]),
+            duration=np.concatenate([t.duration for t in tables]),
+            velocity=np.concatenate([t.velocity for t in tables]),
+        )
+
+    def take(self, index: np.ndarray) -> 'NoteTable':
+        """依索引或布林遮罩取出子表（會複製資料）"""
+        return NoteTable(
+            pitch=self.pitch[index],
+            start=self.start[index],
+            end=self.end[index],
+            duration=self.duration[index],
+            velocity=self.velocity[index],
+        )
+
+    def sorted_by_start(self) -> 'NoteTable':
+        """按開始時間穩定排序"""
+        return self.take(np.argsort(self.start, kind='stable'))
+
+    def total_duration(self) -> float:
+        """最後一個音符的結束時間"""
+        return float((self.start + self.duration).max()) if len(self) else 0.0
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        """轉回 notes.json 格式（僅在序列化時呼叫）"""
+        return [
+            {
+                "pitch": pitch,
+                "start_time": start,
+                "end_time": end,
+                "duration": duration,
+                "velocity": velocity,
+            }
+            for pitch, start, end, duration, velocity in zip(
+                self.pitch.tolist(),
+                self.start.tolist(),
+                self.end.tolist(),
+                self.duration.tolist(),
+                self.velocity.tolist(),
+            )
+        ]
+
+
+@dataclass
+class NoteEventTable:
+    """
+    basic-pitch 原始 note_events 的欄式表示（基礎過濾之前）
+
+    與後處理參數無關，可依音訊雜湊快取，調整參數時只需重跑階段 3-6。
+    """
+    start: np.ndarray      # float64 秒
+    end: np.ndarray        # float64 秒
+    pitch: np.ndarray      # int16 MIDI 音高
+    amplitude: np.ndarray  # float64 0-1
+
+    FIELDS = ('start', 'end', 'pitch', 'amplitude')
+
+    def __len__(self) -> int:
+        return len(self.start)
+
+    @classmethod
+    def empty(cls) -> 'NoteEventTable':
+        return cls.from_events([])
+
+    @classmethod
+    def from_events(cls, note_events: List[Tuple]) -> 'NoteEventTable':
+        """由 (start_time_s, end_time_s, pitch_midi, amplitude, [pitch_bends]) 列表建立"""
+        count = len(note_events)
+        return cls(
+            start=np.fromiter((n[0] for n in note_events), dtype=np.float64, count=count),
+            end=np.fromiter((n[1] for n in note_events), dtype=np.float64, count=count),
+            pitch=np.fromiter((n[2] for n in note_events), dtype=np.float64, count=count).astype(np.int16),
+            amplitude=np.fromiter((n[3] for n in note_events), dtype=np.float64, count=count),
+        )
+
+    @classmethod
+    def concat(cls, tables: List['NoteEventTable']) -> 'NoteEventTable':
+        if not tables:
+            return cls.empty()
+        return cls(**{name: np.concatenate([getattr(t, name) for t in tables]) for name in cls.FIELDS})
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]) -> 'NoteEventTable':
+        return cls(**{name: np.asarray(arrays[name]) for name in cls.FIELDS})
+
+
+def basic_filter_note_events(
+    note_events: List[Tuple],
+    min_duration: float = 0.04,
+    min_velocity: int = 10
+) -> NoteTable:
+    """
+    基礎過濾 - 將 basic-pitch 的 note_events 轉為音符表
+
+    Args:
+        note_events: (start_time_s, end_time_s, pitch_midi, amplitude, [pitch_bends])
+        min_duration: 最小時長(秒)，去除碎音雜訊
+        min_velocity: 最小力度，去除背景雜訊
+
+    Returns:
+        過濾後的音符表（時間已四捨五入到毫秒）
+    """
+    return basic_filter_event_table(NoteEventTable.from_events(note_events), min_duration, min_velocity)
+
+
+def basic_filter_event_table(
+    events: NoteEventTable,
+    min_duration: float = 0.04,
+    min_velocity: int = 10
+) -> NoteTable:
+    """
+    基礎過濾 - 將原始 note_events 表轉為音符表
+
+    一次性向量化處理：鋼琴範圍 (A0=21 到 C8=108)、最小時長、最小力度。
+
+    Returns:
+        過濾後的音符表（時間已四捨五入到毫秒）
+    """
+    if len(events) == 0:
+        return NoteTable.empty()
+
+    start = events.start
+    end = events.end
+    pitch = events.pitch.astype(np.int64)
+    velocity = (events.amplitude * 127).astype(np.int64)  # 正規化到 0-127
+    duration = end - start
+
+    keep = (
+        (pitch >= 21) & (pitch <= 108)
+        & (duration >= min_duration)
+        & (velocity >= min_velocity)
+    )
+
+    return NoteTable(
+        pitch=pitch[keep].astype(np.uint8),
+        start=np.round(start[keep], 3),
+        end=np.round(end[keep], 3),
+        duration=np.round(duration[keep], 3),
+        velocity=np.clip(velocity[keep], 1, 127).astype(np.uint8),
+    )
+
+
 # ============================================
 # 專業級音符清洗與優化函數
 # ============================================
 
-def apply_velocity_curve(velocity: int, curve_type: str = 'piano') -> int:
+def apply_velocity_curve_array(velocities: np.ndarray, curve_type: str = 'piano') -> np.ndarray:
     """
-    力度曲線重映射 - 模擬真實鋼琴的物理特性
-    
-    AI 給的力度通常太平均（集中在 60-80 範圍），
-    這會讓彈奏聽起來很死板。透過 S-Curve 映射可以：
-    1. 增強輕柔音符的表現力（更輕）
-    2. 強調重擊音符的衝擊感（更強）
-    3. 保持中間力度的自然過渡
-    
+    力度曲線重映射（整欄向量化版本）
+
     Args:
-        velocity: 原始力度 (1-127)
+        velocities: 原始力度陣列 (1-127)
         curve_type: 曲線類型 ('piano', 'linear', 'soft', 'hard')
-    
+
     Returns:
-        優化後的力度 (1-127)
+        優化後的力度陣列 (uint8, 1-127)
     """
     # 正規化到 0-1
-    v = max(0, min(127, velocity)) / 127.0
-    
+    v = np.clip(np.asarray(velocities, dtype=np.float64), 0, 127) / 127.0
+
     if curve_type == 'piano':
         # S-Curve: 增強動態對比度
-        # 使用 tanh 函數模擬鋼琴觸感
-        # 將中心點稍微下移，讓輕柔的部分更明顯
-        v_mapped = (math.tanh((v - 0.5) * 3) + 1) / 2
+        v_mapped = (np.tanh((v - 0.5) * 3) + 1) / 2
         # 微調：保留一些原始力度特徵
         v_mapped = v_mapped * 0.7 + v * 0.3
-        
     elif curve_type == 'soft':
         # 對數曲線：更柔和的動態
-        v_mapped = math.log1p(v * (math.e - 1)) / math.log(math.e)
-        
+        v_mapped = np.log1p(v * (math.e - 1)) / math.log(math.e)
     elif curve_type == 'hard':
         # 指數曲線：更強烈的動態對比
         v_mapped = v ** 0.5
-        
     else:  # linear
         v_mapped = v
+
+    # 轉回 1-127 範圍（與 int() 相同的截斷）
+    return np.clip(np.trunc(v_mapped * 127), 1, 127).astype(np.uint8)
+
+
+def apply_velocity_curve(velocity: int, curve_type: str = 'piano') -> int:
+    """
+    力度曲線重映射 - 模擬真實鋼琴的物理特性
+    
+    AI 給的力度通常太平均（集中在 60-80 範圍），
+    這會讓彈奏聽起來很死板。透過 S-Curve 映射可以：
+    1. 增強輕柔音符的表現力（更輕）
+    2. 強調重擊音符的衝擊感（更強）
+    3. 保持中間力度的自然過渡
+    
+    Args:
+        velocity: 原始力度 (1-127)
+        curve_type: 曲線類型 ('piano', 'linear', 'soft', 'hard')
     
-    # 轉回 1-127 範圍
-    return max(1, min(127, int(v_mapped * 127)))
+    Returns:
+        優化後的力度 (1-127)
+    """
+    return int(apply_velocity_curve_array(np.array([velocity]), curve_type)[0])
 
 
-def refine_notes(
-    raw_notes: List[Dict[str, Any]],
+# refine_note_table：間隔與 min_gap 相差小於此值 (秒) 時改以逐一比較判斷
+BOUNDARY_TOLERANCE = 1e-3
+
+
+def refine_note_table(
+    table: NoteTable,
     min_gap: float = 0.05,
     max_duration: float = 3.0,
-    apply_velocity_optimization: bool = True
-) -> List[Dict[str, Any]]:
+    apply_velocity_optimization: bool = True,
+    velocity_curve: str = 'piano'
+) -> NoteTable:
     """
-    對音符進行專業級邏輯清洗
+    對音符表進行專業級邏輯清洗（向量化版本，規則同 refine_notes）
     
-    解決 AI 誤判產生的問題：
-    1. 碎音合併 (De-jittering)
-    2. 最大長度限制 (Sustain Pedal Fix)
-    3. 力度曲線優化 (Velocity Mapping)
-    4. 單音軌邏輯校正 (Monophonic Constraint)
+    同音高的音符按時間排序後，以分段累積最大結束時間判斷是否合併：
+    與目前片段最晚結束時間的間隔小於 min_gap 即併入該片段。
+    refine_notes 合併後以四捨五入到毫秒的長度推算結束時間，間隔與 min_gap 相差不到 1ms 時
+    結果可能不同（毫秒量化的輸入常剛好落在邊界上），這些音高改以逐一比較的方式計算，輸出與其相同。
+    輸出的結束時間一律為 start + duration（合併或截斷後的值），不沿用片段第一個音符的 end。
+    min_gap 須為正數。
     
     Args:
-        raw_notes: 初步過濾後的音符列表
+        table: 初步過濾後的音符表
         min_gap: 最小間隔閾值(秒)，小於此值的連續音符會被合併
-        max_duration: 最大音符長度(秒)，超過此值會被截斷（防止踏板延音問題）
+        max_duration: 最大音符長度(秒)，超過此值會被截斷
         apply_velocity_optimization: 是否應用力度曲線優化
+        velocity_curve: 力度曲線類型 ('piano', 'linear', 'soft', 'hard')
     
     Returns:
-        清洗後的音符列表
+        清洗後的音符表（按開始時間排序）
     """
-    if not raw_notes:
-        return []
-    
-    # 1. 按音高(pitch)分組
-    notes_by_pitch: Dict[int, List[Dict]] = defaultdict(list)
-    for note in raw_notes:
-        notes_by_pitch[note['pitch']].append(note)
-    
-    refined: List[Dict[str, Any]] = []
-    merge_count = 0
-    truncate_count = 0
+    n = len(table)
+    if n == 0:
+        return NoteTable.empty()
     
-    for pitch, pitch_group in notes_by_pitch.items():
-        # 按開始時間排序
-        pitch_group.sort(key=lambda x: x['start_time'])
-        
-        if not pitch_group:
-            continue
-        
-        # 初始化當前音符
-        current = pitch_group[0].copy()
-        
-        for i in range(1, len(pitch_group)):
-            next_note = pitch_group[i]
-            
-            # 計算間隔：下一個開始時間 - 當前結束時間
-            current_end = current['start_time'] + current['duration']
-            gap = next_note['start_time'] - current_end
-            
-            if gap < min_gap:
-                # 合併音符：延長當前音符
-                merge_count += 1
-                next_end = next_note['start_time'] + next_note['duration']
-                new_end = max(current_end, next_end)
-                current['duration'] = round(new_end - current['start_time'], 3)
-                # 力度取最大值，模擬重擊感
-                current['velocity'] = max(current['velocity'], next_note['velocity'])
+    # 1. 按音高分組：組別順序為音高首次出現的順序，組內按開始時間穩定排序
+    unique_pitches, first_index, inverse = np.unique(
+        table.pitch, return_index=True, return_inverse=True
+    )
+    group_rank = np.argsort(np.argsort(first_index, kind='stable'), kind='stable')[inverse]
+    order = np.lexsort((table.start, group_rank))
+    t = table.take(order)
+    rank = group_rank[order]
+    note_end = t.start + t.duration
+    
+    # 組內累積最大結束時間（音高最多 88 組）
+    running_end = np.empty(n, dtype=np.float64)
+    bounds = np.flatnonzero(np.r_[True, rank[1:] != rank[:-1], True])
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        np.maximum.accumulate(note_end[lo:hi], out=running_end[lo:hi])
+    
+    # 新片段：每組第一個音符，或與前面最晚結束時間的間隔 >= min_gap
+    new_segment = np.ones(n, dtype=bool)
+    same_group = rank[1:] == rank[:-1]
+    gap = t.start[1:] - running_end[:-1]
+    new_segment[1:] = ~same_group | (gap >= min_gap)
+    
+    # 間隔落在 min_gap 邊界附近的位置：依 refine_notes 的規則 (合併後的結束時間 = 起點 + 四捨五入到毫秒的長度)
+    # 依序重新判斷；其餘位置不論以哪種結束時間計算結果都相同
+    near_boundary = np.flatnonzero(same_group & (np.abs(gap - min_gap) < BOUNDARY_TOLERANCE)) + 1
+    if len(near_boundary):
+        new_segment[near_boundary] = False
+        last_head = np.maximum.accumulate(np.where(new_segment, np.arange(n), 0))
+        resolved_head = -1
+        for i in near_boundary.tolist():
+            prev = i - 1
+            head = max(int(last_head[prev]), resolved_head if resolved_head <= prev else -1)
+            if head == prev:
+                current_end = float(t.start[prev]) + float(t.duration[prev])
             else:
-                # 保存當前音符，開始新音符
-                refined.append(current)
-                current = next_note.copy()
-        
-        # 保存最後一個音符
-        refined.append(current)
+                head_start = float(t.start[head])
+                current_end = head_start + round(float(running_end[prev]) - head_start, 3)
+            if float(t.start[i]) - current_end >= min_gap:
+                new_segment[i] = True
+                resolved_head = i
+    heads = np.flatnonzero(new_segment)
+    merge_count = n - len(heads)
+    
+    segment_end = np.maximum.reduceat(note_end, heads)
+    segment_size = np.diff(np.r_[heads, n])
+    duration = np.where(
+        segment_size > 1,
+        np.round(segment_end - t.start[heads], 3),
+        t.duration[heads],
+    )
+    velocity = np.maximum.reduceat(t.velocity, heads)  # 力度取最大值，模擬重擊感
     
     # 2. 應用最大長度限制（解決踏板延音問題）
-    for note in refined:
-        if note['duration'] > max_duration:
-            note['duration'] = max_duration
-            truncate_count += 1
+    too_long = duration > max_duration
+    truncate_count = int(too_long.sum())
+    duration[too_long] = max_duration
     
     # 3. 應用力度曲線優化
     if apply_velocity_optimization:
-        for note in refined:
-            note['velocity'] = apply_velocity_curve(note['velocity'], 'piano')
+        velocity = apply_velocity_curve_array(velocity, velocity_curve)
+    
+    refined = NoteTable(
+        pitch=t.pitch[heads],
+        start=t.start[heads],
+        end=np.round(t.start[heads] + duration, 3),  # 合併或截斷後的結束時間，與 duration 一致
+        duration=duration,
+        velocity=velocity.astype(np.uint8),
+    )
     
     # 4. 按開始時間排序
-    refined.sort(key=lambda x: x['start_time'])
+    refined = refined.sorted_by_start()
     
     if merge_count > 0:
         logger.info(f"📍[Refine] 合併了 {merge_count} 個碎音")
@@ -163,10 +426,76 @@ def refine_notes(
     return refined
 
 
-def preprocess_audio_with_ffmpeg(input_path: Path, output_dir: Path) -> Path:
+def refine_notes(
+    raw_notes: List[Dict[str, Any]],
+    min_gap: float = 0.05,
+    max_duration: float = 3.0,
+    apply_velocity_optimization: bool = True
+) -> List[Dict[str, Any]]:
+    """
+    對音符進行專業級邏輯清洗
+    
+    解決 AI 誤判產生的問題：
+    1. 碎音合併 (De-jittering)
+    2. 最大長度限制 (Sustain Pedal Fix)
+    3. 力度曲線優化 (Velocity Mapping)
+    4. 單音軌邏輯校正 (Monophonic Constraint)
+    
+    Args:
+        raw_notes: 初步過濾後的音符列表
+        min_gap: 最小間隔閾值(秒)，小於此值的連續音符會被合併
+        max_duration: 最大音符長度(秒)，超過此值會被截斷（防止踏板延音問題）
+        apply_velocity_optimization: 是否應用力度曲線優化
+    
+    Returns:
+        清洗後的音符列表
+    """
+    if not raw_notes:
+        return []
+    return refine_note_table(
+        NoteTable.from_dicts(raw_notes),
+        min_gap=min_gap,
+        max_duration=max_duration,
+        apply_velocity_optimization=apply_velocity_optimization
+    ).to_dicts()
+
+
+# basic-pitch 模型的輸入取樣率 (basic_pitch.constants.AUDIO_SAMPLE_RATE)
+MODEL_SAMPLE_RATE = 22050
+
+# FFmpeg 濾波鏈：
+# - highpass: 30Hz 高通濾波，移除極低頻噪音
+# - compand: 壓縮器，平衡動態範圍
+# - loudnorm: 音量正規化
+PREPROCESS_FILTER_CHAIN = (
+    "highpass=f=30,"
+    "compand=attacks=0.1:decays=0.3:points=-80/-80|-30/-15|0/0:soft-knee=6,"
+    "loudnorm=I=-16:TP=-1.5:LRA=11"
+)
+
+# 預處理逾時隨音訊長度調整：至少 60 秒，每秒音訊再給 0.5 秒
+PREPROCESS_MIN_TIMEOUT = 60.0
+PREPROCESS_TIMEOUT_PER_SECOND = 0.5
+# 每次從 FFmpeg 管線讀取的大小 (約 24 秒的 22.05kHz 16-bit 單聲道)
+PREPROCESS_READ_BYTES = 1 << 20
+# FFmpeg stderr 只保留最後這麼多位元組（失敗時寫入日誌）
+PREPROCESS_STDERR_TAIL_BYTES = 4096
+
+
+def preprocess_audio_with_ffmpeg(
+    input_path: Path,
+    output_dir: Path,
+    apply_filters: bool = True,
+    progress_callback: Optional[Callable[[float], None]] = None
+) -> Path:
     """
     使用 FFmpeg 對音訊進行預處理，提升 AI 分析準確度
     
+    下載的原始串流 (opus/m4a) 只經過這一次 FFmpeg：解碼、濾波並直接輸出
+    模型取樣率的單聲道 PCM，basic-pitch 讀取時不需要再重新取樣。
+    PCM 由 FFmpeg 的 stdout 管線分塊讀入並寫成模型輸入的 WAV，
+    逾時依音訊長度計算，長音訊不會因為固定的 60 秒上限而退回未處理的音訊。
+    
     處理內容：
     1. 高通濾波 (High-pass Filter): 移除 30Hz 以下的極低頻噪音
     2. 壓縮器 (Compressor): 平衡動態範圍，讓 AI 更容易識別輕柔音符
@@ -175,6 +504,8 @@ def preprocess_audio_with_ffmpeg(input_path: Path, output_dir: Path) -> Path:
     Args:
         input_path: 原始音訊路徑
         output_dir: 輸出目錄
+        apply_filters: False 時只解碼與重新取樣，不套用濾波鏈
+        progress_callback: 以 0-1 回報已處理的比例（需能取得音訊長度）
     
     Returns:
         預處理後的音訊路徑
@@ -189,45 +520,170 @@ def preprocess_audio_with_ffmpeg(input_path: Path, output_dir: Path) -> Path:
     
     output_path = output_dir / f"{input_path.stem}_processed.wav"
     
-    # FFmpeg 濾波鏈：
-    # - highpass: 30Hz 高通濾波，移除極低頻噪音
-    # - compand: 壓縮器，平衡動態範圍
-    # - loudnorm: 音量正規化
-    filter_chain = (
-        "highpass=f=30,"
-        "compand=attacks=0.1:decays=0.3:points=-80/-80|-30/-15|0/0:soft-knee=6,"
-        "loudnorm=I=-16:TP=-1.5:LRA=11"
-    )
-    
-    cmd = [
-        'ffmpeg', '-y', '-i', str(input_path),
-        '-af', filter_chain,
-        '-ar', '44100',  # 確保採樣率
-        '-ac', '1',       # 轉換為單聲道（更乾淨）
-        str(output_path)
+    duration = probe_audio_duration(input_path)
+    set_audio_duration(duration)
+    timeout = PREPROCESS_MIN_TIMEOUT + (duration or MAX_VIDEO_SECONDS) * PREPROCESS_TIMEOUT_PER_SECOND
+    expected_bytes = int(duration * MODEL_SAMPLE_RATE) * 2 if duration else 0
+    
+    cmd = ['ffmpeg', '-v', 'error', '-i', str(input_path), '-vn']
+    if apply_filters:
+        cmd += ['-af', PREPROCESS_FILTER_CHAIN]
+    cmd += [
+        '-ar', str(MODEL_SAMPLE_RATE),  # 直接輸出模型取樣率
+        '-ac', '1',                      # 轉換為單聲道（更乾淨）
+        '-f', 's16le', '-'               # 原始 PCM 輸出到管線
     ]
     
+    tmp_path = process = killer = stderr_reader = None
+    timed_out = threading.Event()
+    stderr_tail = bytearray()
+    
+    def kill_on_timeout():
+        # 逾時直接結束 FFmpeg，讀取端隨即收到 EOF
+        timed_out.set()
+        process.kill()
+    
+    def drain_stderr():
+        # 持續讀走 stderr，避免管線寫滿時 FFmpeg 阻塞；只保留最後一段供錯誤訊息使用
+        for line in iter(process.stderr.readline, b''):
+            stderr_tail.extend(line)
+            del stderr_tail[:-PREPROCESS_STDERR_TAIL_BYTES]
+    
+    t0 = time.perf_counter()
+    written = 0
     try:
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            timeout=60
-        )
+        fd, tmp_path = tempfile.mkstemp(dir=output_dir, prefix='.tmp-', suffix='.wav')
+        os.close(fd)
+        # 無法啟動 FFmpeg (例如檔案描述元用盡) 時同樣改用未處理的音訊
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        killer = threading.Timer(timeout, kill_on_timeout)
+        killer.start()
+        stderr_reader = threading.Thread(target=drain_stderr, daemon=True)
+        stderr_reader.start()
         
-        if result.returncode == 0 and output_path.exists():
-            logger.info(f"📍[Preprocess] 音訊預處理完成: {output_path.name}")
+        with wave.open(tmp_path, 'wb') as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(MODEL_SAMPLE_RATE)
+            while True:
+                chunk = process.stdout.read(PREPROCESS_READ_BYTES)
+                if not chunk:
+                    break
+                wav.writeframes(chunk)
+                written += len(chunk)
+                if progress_callback and expected_bytes:
+                    progress_callback(min(1.0, written / expected_bytes))
+        returncode = process.wait()
+        stderr_reader.join()
+        
+        if returncode == 0 and written > 0:
+            os.replace(tmp_path, output_path)
+            logger.info(f"📍[Preprocess] 音訊預處理完成: {output_path.name} "
+                        f"({written / 2 / MODEL_SAMPLE_RATE:.1f}s 音訊, {time.perf_counter() - t0:.1f}s)")
             return output_path
+        if timed_out.is_set():
+            logger.error(f"📍[Preprocess] FFmpeg 處理超時 ({timeout:.0f}s)，改用未處理的音訊")
         else:
-            logger.warning(f"📍[Preprocess] FFmpeg 處理失敗: {result.stderr[:200]}")
-            return input_path
-            
-    except subprocess.TimeoutExpired:
-        logger.warning("📍[Preprocess] FFmpeg 處理超時")
+            stderr = bytes(stderr_tail).decode('utf-8', errors='replace').strip()
+            logger.error(f"📍[Preprocess] FFmpeg 處理失敗，改用未處理的音訊: {stderr[-200:]}")
         return input_path
     except Exception as e:
-        logger.warning(f"📍[Preprocess] 預處理失敗: {e}")
+        logger.error(f"📍[Preprocess] 預處理失敗，改用未處理的音訊: {e}")
         return input_path
+    finally:
+        if killer is not None:
+            killer.cancel()
+        if process is not None:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            # FFmpeg 已結束，stderr 讀到 EOF 後讀取執行緒隨即結束，再關閉兩條管線
+            if stderr_reader is not None:
+                stderr_reader.join()
+            process.stdout.close()
+            process.stderr.close()
+        if tmp_path is not None:
+            Path(tmp_path).unlink(missing_ok=True)
+
+
+def adaptive_windows(start: np.ndarray, window_size: float) -> Tuple[List[int], List[int]]:
+    """
+    自適應門檻的時間窗：由第一個音符起依序跳躍，彼此不重疊
+    
+    窗口的位置取決於起點，從不同的音符開始切分時，之後的窗口可能一直錯開。
+    
+    Args:
+        start: 已排序的開始時間
+        window_size: 時間窗口大小(秒)
+    
+    Returns:
+        (各窗口第一個音符的位置, 各窗口的結束位置)
+    """
+    window_stop = np.searchsorted(start, start + window_size, side='left').tolist()
+    heads: List[int] = []
+    stops: List[int] = []
+    i = 0
+    while i < len(start):
+        j = window_stop[i]
+        if j > i:
+            heads.append(i)
+            stops.append(j)
+            i = j
+        else:
+            i += 1
+    return heads, stops
+
+
+def adaptive_filter_table(
+    table: NoteTable,
+    window_size: float = 0.1,
+    chord_threshold: int = 4
+) -> NoteTable:
+    """
+    自適應門檻過濾（向量化版本，規則同 adaptive_filter_notes）
+    
+    Args:
+        table: 音符表
+        window_size: 時間窗口大小(秒)
+        chord_threshold: 判定為和弦的最小音符數
+    
+    Returns:
+        過濾後的音符表（按開始時間排序）
+    """
+    n = len(table)
+    if n == 0:
+        return NoteTable.empty()
+    
+    # 按開始時間排序
+    t = table.sorted_by_start()
+    heads, stops = adaptive_windows(t.start, window_size)
+    
+    # 依窗口內音符數決定力度門檻：和弦 8 / 雙音三音 12 / 單音旋律 18
+    # （不屬於任何窗口的音符門檻為 128，即全部過濾）
+    heads_arr = np.array(heads, dtype=np.int64)
+    stops_arr = np.array(stops, dtype=np.int64)
+    counts = stops_arr - heads_arr
+    floors = np.where(counts >= chord_threshold, 8, np.where(counts >= 2, 12, 18)) - 128
+    delta = np.zeros(n + 1, dtype=np.int64)
+    np.add.at(delta, heads_arr, floors)
+    np.add.at(delta, stops_arr, -floors)
+    local_min_velocity = 128 + np.cumsum(delta[:-1])
+    
+    keep = np.flatnonzero(t.velocity >= local_min_velocity)
+    
+    # 去除完全相同的重複音符（保留第一個）
+    if len(keep) > 1:
+        kept = t.take(keep)
+        order = np.lexsort((kept.velocity, kept.duration, kept.end, kept.pitch, kept.start))
+        same = np.ones(len(keep) - 1, dtype=bool)
+        for col in (kept.start, kept.pitch, kept.end, kept.duration, kept.velocity):
+            same &= col[order[1:]] == col[order[:-1]]
+        if same.any():
+            duplicate = np.zeros(len(keep), dtype=bool)
+            duplicate[order[1:][same]] = True
+            keep = keep[~duplicate]
+    
+    return t.take(keep)
 
 
 def adaptive_filter_notes(
@@ -251,46 +707,68 @@ def adaptive_filter_notes(
     """
     if not notes:
         return []
+    return adaptive_filter_table(
+        NoteTable.from_dicts(notes),
+        window_size=window_size,
+        chord_threshold=chord_threshold
+    ).to_dicts()
+
+
+def filter_harmonics_table(
+    table: NoteTable,
+    harmonic_threshold: float = 0.4
+) -> NoteTable:
+    """
+    泛音過濾（向量化版本，規則同 filter_harmonics）
     
-    # 按開始時間排序
-    sorted_notes = sorted(notes, key=lambda x: x['start_time'])
+    音符按開始時間排序後，依序比較相隔 1, 2, 3... 個位置的音符對，
+    直到沒有任何一對落在 TIME_TOLERANCE 內為止。
+    迭代次數等於最大起音群的大小，每次迭代為整欄運算。
     
-    # 分析每個時間窗口的音符密度
-    result = []
-    i = 0
+    Args:
+        table: 音符表
+        harmonic_threshold: 泛音判定閾值 (0-1)
     
-    while i < len(sorted_notes):
-        current_time = sorted_notes[i]['start_time']
-        window_end = current_time + window_size
-        
-        # 找出這個窗口內的所有音符
-        window_notes = []
-        j = i
-        while j < len(sorted_notes) and sorted_notes[j]['start_time'] < window_end:
-            window_notes.append(sorted_notes[j])
-            j += 1
-        
-        note_count = len(window_notes)
-        
-        if note_count >= chord_threshold:
-            # 和弦區塊：降低力度門檻以捕捉細節
-            local_min_velocity = 8
-        elif note_count >= 2:
-            # 雙音/三音：中等門檻
-            local_min_velocity = 12
-        else:
-            # 單音旋律：提高門檻避免雜訊
-            local_min_velocity = 18
-        
-        # 應用過濾
-        for note in window_notes:
-            if note['velocity'] >= local_min_velocity:
-                if note not in result:
-                    result.append(note)
-        
-        i = j if j > i else i + 1
+    Returns:
+        過濾後的音符表（按開始時間排序）
+    """
+    n = len(table)
+    if n == 0:
+        return NoteTable.empty()
     
-    return result
+    # 按開始時間分組（允許 20ms 誤差）
+    TIME_TOLERANCE = 0.02
+    # 常見泛音關係：八度(12), 五度(7), 雙八度(24), 八度+五度(19)
+    HARMONIC_INTERVALS = np.array([12, 24, 7, 19])
+    
+    t = table.sorted_by_start()
+    pitch = t.pitch.astype(np.int16)
+    velocity = t.velocity.astype(np.int16)
+    floor_velocity = np.maximum(velocity, 1)
+    
+    # 標記要移除的音符
+    to_remove = np.zeros(n, dtype=bool)
+    
+    offset = 1
+    while offset < n:
+        close = np.flatnonzero(t.start[offset:] - t.start[:-offset] <= TIME_TOLERANCE)
+        if len(close) == 0:
+            break
+        i = close
+        j = close + offset
+        pitch_diff = pitch[j] - pitch[i]
+        # j 是 i 的泛音，或 i 是 j 的泛音；高音力度明顯較弱才移除
+        j_is_harmonic = np.isin(pitch_diff, HARMONIC_INTERVALS) & (velocity[j] / floor_velocity[i] < harmonic_threshold)
+        i_is_harmonic = np.isin(-pitch_diff, HARMONIC_INTERVALS) & (velocity[i] / floor_velocity[j] < harmonic_threshold)
+        to_remove[j[j_is_harmonic]] = True
+        to_remove[i[i_is_harmonic]] = True
+        offset += 1
+    
+    removed = int(to_remove.sum())
+    if removed:
+        logger.info(f"📍[Harmonic] 移除了 {removed} 個可能的泛音")
+    
+    return t.take(~to_remove)
 
 
 def filter_harmonics(
@@ -312,72 +790,192 @@ def filter_harmonics(
     """
     if not notes:
         return []
-    
-    # 按開始時間分組（允許 20ms 誤差）
-    TIME_TOLERANCE = 0.02
-    sorted_notes = sorted(notes, key=lambda x: x['start_time'])
-    
-    # 標記要移除的音符
-    to_remove = set()
-    
-    for i, note in enumerate(sorted_notes):
-        base_pitch = note['pitch']
-        base_velocity = note['velocity']
-        base_time = note['start_time']
-        
-        # 檢查同時間段的其他音符
-        for j, other in enumerate(sorted_notes):
-            if i == j or j in to_remove:
-                continue
-            
-            # 時間是否接近
-            if abs(other['start_time'] - base_time) > TIME_TOLERANCE:
-                continue
-            
-            other_pitch = other['pitch']
-            other_velocity = other['velocity']
-            
-            # 檢查是否為泛音關係 (八度 = 12 個半音)
-            pitch_diff = other_pitch - base_pitch
-            
-            # 常見泛音關係：八度(12), 五度(7), 雙八度(24)
-            if pitch_diff in [12, 24, 7, 19]:
-                # 如果高音力度明顯較弱，可能是泛音
-                velocity_ratio = other_velocity / max(base_velocity, 1)
-                
-                if velocity_ratio < harmonic_threshold:
-                    to_remove.add(j)
-                    logger.debug(f"📍[Harmonic] 移除可能泛音: {other_pitch} (基音 {base_pitch}, 力度比 {velocity_ratio:.2f})")
-    
-    result = [note for i, note in enumerate(sorted_notes) if i not in to_remove]
-    
-    if to_remove:
-        logger.info(f"📍[Harmonic] 移除了 {len(to_remove)} 個可能的泛音")
-    
-    return result
+    return filter_harmonics_table(
+        NoteTable.from_dicts(notes),
+        harmonic_threshold=harmonic_threshold
+    ).to_dicts()
 
 
-def download_audio(
-    youtube_url: str,
-    output_dir: Path,
-    progress_callback: Optional[Callable[[str, float], None]] = None
-) -> Tuple[Path, str]:
+# 可下載的影片長度上限(秒)
+MAX_VIDEO_SECONDS = int(os.environ.get("MAX_VIDEO_SECONDS", "3600"))
+
+
+# 推論前略過靜音 / 非樂音片段 (口白、掌聲、結尾靜音)
+SKIP_SILENCE = os.environ.get("SKIP_SILENCE", "1") != "0"
+
+
+# 結果格式或清洗流程改變時遞增，讓舊的快取結果失效
+PIPELINE_VERSION = 1
+
+
+def get_analysis_params(chord_mode: bool = True, enable_preprocessing: bool = True,
+                        skip_silence: bool = SKIP_SILENCE) -> Dict[str, Any]:
     """
-    使用 yt-dlp 下載 YouTube 音訊為 MP3 格式
+    取得影響分析結果的參數組合（同時作為結果快取的 key）
     
     Args:
-        youtube_url: YouTube 網址
-        output_dir: 輸出目錄
-        progress_callback: 進度回調 (stage, percent)
+        chord_mode: 是否啟用和弦模式（降低 onset/frame 閾值）
+        enable_preprocessing: 是否啟用 FFmpeg 預處理
+        skip_silence: 是否只推論偵測到樂音的片段
     
     Returns:
-        (音訊檔案路徑, 影片標題)
+        參數字典
     """
-    output_dir.mkdir(parents=True, exist_ok=True)
-    output_template = str(output_dir / "%(id)s.%(ext)s")
-    
-    def progress_hook(d):
-        if d['status'] == 'downloading':
+    # chord_mode: 降低閾值以捕捉更多和弦細節
+    if chord_mode:
+        onset_thresh = 0.4    # 預設 ~0.5, 降低以捕捉和弦
+        frame_thresh = 0.25   # 預設 ~0.3, 降低讓長音不易斷掉
+        min_note_len = 50     # 最小音符長度 (ms)
+    else:
+        onset_thresh = 0.5
+        frame_thresh = 0.3
+        min_note_len = 80
+    
+    return {
+        "pipeline_version": PIPELINE_VERSION,
+        "chord_mode": chord_mode,
+        "enable_preprocessing": enable_preprocessing,
+        "skip_silence": skip_silence,
+        "onset_threshold": onset_thresh,
+        "frame_threshold": frame_thresh,
+        "min_note_length_ms": min_note_len,
+    }
+
+
+THRESHOLD_PARAMS = ('onset_threshold', 'frame_threshold', 'min_note_length_ms')
+
+
+def rethreshold_params(params: Dict[str, Any], **overrides) -> Dict[str, Any]:
+    """
+    以新的 onset/frame 門檻與最小音符長度取代推論參數
+    
+    Raises:
+        ValueError: 未知的參數或不合法的值
+    """
+    unknown = set(overrides) - set(THRESHOLD_PARAMS)
+    if unknown:
+        raise ValueError(f"未知的門檻參數: {', '.join(sorted(unknown))}")
+    params = dict(params, **{key: value for key, value in overrides.items() if value is not None})
+    
+    for key in ('onset_threshold', 'frame_threshold'):
+        if not 0 < params[key] < 1:
+            raise ValueError(f"{key} 必須介於 0 與 1 之間")
+    if params['min_note_length_ms'] < 0:
+        raise ValueError("min_note_length_ms 不可為負數")
+    return params
+
+
+def posterior_params(params: Dict[str, Any]) -> Dict[str, Any]:
+    """後驗機率只取決於音訊、預處理與略過的片段，與門檻無關（後驗機率快取的 key）"""
+    return {
+        "pipeline_version": params['pipeline_version'],
+        "enable_preprocessing": params['enable_preprocessing'],
+        "skip_silence": params['skip_silence'],
+    }
+
+
+VIDEO_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{11}$')
+
+
+def extract_video_id(youtube_url: str) -> Optional[str]:
+    """
+    從 YouTube 網址解析影片 ID（不發出任何網路請求）
+    
+    支援 youtu.be 短網址、watch?v=、shorts/、embed/、live/、v/
+    以及 m./music./www. 等子網域；無法辨識時返回 None。
+    
+    Args:
+        youtube_url: YouTube 網址或 11 碼影片 ID
+    
+    Returns:
+        11 碼影片 ID 或 None
+    """
+    candidate = youtube_url.strip()
+    if VIDEO_ID_PATTERN.match(candidate):
+        return candidate
+    
+    if '://' not in candidate:
+        candidate = 'https://' + candidate
+    parsed = urlparse(candidate)
+    host = (parsed.hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    
+    video_id = None
+    if host == 'youtu.be':
+        video_id = parsed.path.lstrip('/').split('/')[0]
+    elif host in ('youtube.com', 'm.youtube.com', 'music.youtube.com', 'youtube-nocookie.com'):
+        segments = [s for s in parsed.path.split('/') if s]
+        if segments and segments[0] == 'watch':
+            video_id = (parse_qs(parsed.query).get('v') or [None])[0]
+        elif len(segments) >= 2 and segments[0] in ('shorts', 'embed', 'live', 'v'):
+            video_id = segments[1]
+    
+    if video_id and VIDEO_ID_PATTERN.match(video_id):
+        return video_id
+    return None
+
+
+def canonical_youtube_url(video_id: str) -> str:
+    """影片 ID 對應的標準網址（去除 t=、si= 等追蹤參數）"""
+    return f"https://www.youtube.com/watch?v={video_id}"
+
+
+def download_audio(
+    youtube_url: str,
+    output_dir: Path,
+    progress_callback: Optional[Callable[[str, float], None]] = None,
+    audio_store=None,
+    pin: bool = False
+) -> Tuple[Path, str]:
+    """
+    使用 yt-dlp 下載 YouTube 原始音訊串流 (opus/m4a)
+    
+    不再轉檔為 MP3：轉檔是一次多餘的有損編碼，
+    解碼與重新取樣統一在 preprocess_audio_with_ffmpeg 一次完成。
+    
+    Args:
+        youtube_url: YouTube 網址
+        output_dir: 輸出目錄 (有 audio_store 時不使用)
+        progress_callback: 進度回調 (stage, percent)
+        audio_store: AudioStore；已下載過的影片直接沿用，新下載的檔案存入其中
+        pin: 返回的音訊已在存放區中標記為使用中（呼叫端負責 unpin），取得與標記之間不會被淘汰
+    
+    Returns:
+        (音訊檔案路徑, 影片標題)
+    """
+    with stage('download'):
+        if audio_store is None:
+            return _download_to(youtube_url, Path(output_dir), progress_callback)
+        
+        video_id = extract_video_id(youtube_url)
+        stored = audio_store.lookup(video_id, pin=pin) if video_id else None
+        if stored is not None:
+            try:
+                if progress_callback:
+                    progress_callback('downloading', 100)
+            except BaseException:
+                if pin:
+                    audio_store.unpin(stored[0])
+                raise
+            return stored
+        
+        with audio_store.staging() as staging_dir:
+            downloaded, video_title = _download_to(youtube_url, staging_dir, progress_callback)
+            return audio_store.add(video_id or downloaded.stem, downloaded, video_title, pin=pin), video_title
+
+
+def _download_to(
+    youtube_url: str,
+    output_dir: Path,
+    progress_callback: Optional[Callable[[str, float], None]] = None
+) -> Tuple[Path, str]:
+    """以 yt-dlp 下載到 output_dir/<影片 ID>.<副檔名>"""
+    output_dir.mkdir(parents=True, exist_ok=True)
+    output_template = str(output_dir / "%(id)s.%(ext)s")
+    
+    def progress_hook(d):
+        if d['status'] == 'downloading':
             if progress_callback:
                 # 解析進度百分比
                 percent = d.get('_percent_str', '0%').strip().replace('%', '')
@@ -392,16 +990,11 @@ def download_audio(
     ydl_opts = {
         'format': 'bestaudio/best',
         'outtmpl': output_template,
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': '320',  # 提升至 320kbps 以獲得更好的高頻解析
-        }],
         'progress_hooks': [progress_hook],
         'quiet': True,
         'no_warnings': True,
-        # 避免下載過長的影片 (限制 10 分鐘)
-        'match_filter': yt_dlp.utils.match_filter_func("duration < 600"),
+        # 避免下載過長的影片 (長音訊以分段推論處理，記憶體不再是限制)
+        'match_filter': yt_dlp.utils.match_filter_func(f"duration < {MAX_VIDEO_SECONDS}"),
     }
     
     try:
@@ -410,8 +1003,9 @@ def download_audio(
             video_id = info.get('id', 'audio')
             video_title = info.get('title', 'Unknown')
             
-            # 找到下載的 MP3 檔案
-            audio_path = output_dir / f"{video_id}.mp3"
+            # 找到下載的音訊檔案 (副檔名依來源串流而定)
+            downloads = info.get('requested_downloads') or [{}]
+            audio_path = Path(downloads[0].get('filepath') or ydl.prepare_filename(info))
             
             if not audio_path.exists():
                 raise FileNotFoundError(f"下載完成但找不到音訊檔案: {audio_path}")
@@ -424,210 +1018,1141 @@ def download_audio(
         raise RuntimeError(f"YouTube 下載失敗: {str(e)}")
 
 
+def list_playlist_video_ids(playlist_url: str, limit: int) -> List[str]:
+    """
+    列出 YouTube 播放清單中的影片 ID（只讀取清單，不下載任何音訊）
+    
+    Args:
+        playlist_url: 播放清單網址
+        limit: 最多返回的影片數
+    
+    Returns:
+        影片 ID 列表（依播放清單順序）
+    """
+    ydl_opts = {
+        'extract_flat': 'in_playlist',
+        'playlistend': limit,
+        'quiet': True,
+        'no_warnings': True,
+    }
+    
+    try:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(playlist_url, download=False)
+    except yt_dlp.utils.DownloadError as e:
+        logger.error(f"📍[Analyzer] 讀取播放清單失敗: {e}")
+        raise RuntimeError(f"讀取播放清單失敗: {str(e)}")
+    
+    video_ids = []
+    for entry in info.get('entries') or []:
+        video_id = (entry or {}).get('id')
+        if video_id and VIDEO_ID_PATTERN.match(video_id):
+            video_ids.append(video_id)
+    logger.info(f"📍[Analyzer] 播放清單共 {len(video_ids)} 部影片")
+    return video_ids[:limit]
+
+
+# ============================================
+# 分段推論（長音訊，記憶體用量固定）
+# ============================================
+
+# 超過此長度的音訊改以分段方式推論
+CHUNK_SECONDS = 60.0
+# 每段前後多解碼的秒數：左側提供模型上下文，右側讓跨段的長音能完整結束
+# (需大於 refine_notes 的 max_duration)
+CHUNK_OVERLAP_SECONDS = 4.0
+
+
+def probe_audio_duration(audio_path: Path) -> Optional[float]:
+    """
+    使用 ffprobe 取得音訊長度(秒)，失敗時返回 None
+    """
+    import subprocess
+    import shutil
+    
+    if not shutil.which('ffprobe'):
+        return None
+    
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-show_entries', 'format=duration',
+        '-of', 'default=noprint_wrappers=1:nokey=1',
+        str(audio_path)
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+        return float(result.stdout.strip())
+    except (subprocess.TimeoutExpired, ValueError):
+        return None
+
+
+def decode_audio_segment(input_path: Path, start: float, duration: float, output_path: Path,
+                         sample_rate: int = MODEL_SAMPLE_RATE) -> Path:
+    """
+    只解碼 [start, start + duration) 範圍為單聲道 WAV（basic-pitch 的取樣率）
+    
+    輸入已是該取樣率的單聲道 16-bit WAV (預處理後的音訊) 時直接複製取樣，不啟動 FFmpeg。
+    
+    Raises:
+        RuntimeError: FFmpeg 解碼失敗
+    """
+    import subprocess
+    
+    if copy_wav_segment(input_path, start, duration, output_path, sample_rate):
+        return output_path
+    
+    cmd = [
+        'ffmpeg', '-y', '-v', 'error',
+        '-ss', f'{start:.3f}', '-t', f'{duration:.3f}',
+        '-i', str(input_path),
+        '-ac', '1', '-ar', str(sample_rate),
+        str(output_path)
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True, timeout=max(60, duration))
+    if result.returncode != 0 or not output_path.exists():
+        raise RuntimeError(f"音訊分段解碼失敗 ({start:.1f}s): {result.stderr[:200]}")
+    return output_path
+
+
+def iter_chunked_note_events(
+    audio_path: Path,
+    duration: float,
+    params: Dict[str, Any],
+    chunk_seconds: float = CHUNK_SECONDS,
+    overlap_seconds: float = CHUNK_OVERLAP_SECONDS,
+    posterior_writer=None,
+    regions: Optional[List[Tuple[float, float]]] = None
+):
+    """
+    分段推論：逐段解碼、推論並產出 note_events
+    
+    每段負責 [k * chunk_seconds, (k + 1) * chunk_seconds) 內起音的音符，
+    實際解碼範圍前後各多 overlap_seconds。同一個音符只會由起音所在的段落產出，
+    因此段與段之間不會重複；模型輸出在每段結束後即釋放，峰值記憶體與總長度無關。
+    
+    指定 regions 時只推論這些範圍：每個範圍各自分段，解碼範圍不超出範圍邊界，
+    範圍之外的音訊不送進模型。
+    
+    Args:
+        audio_path: 音訊路徑
+        duration: 音訊總長度(秒)
+        params: get_analysis_params() 的結果
+        chunk_seconds: 每段負責的長度(秒)
+        overlap_seconds: 前後重疊(秒)
+        posterior_writer: PosteriorgramWriter；附加每段負責範圍內的後驗機率
+        regions: 要推論的 [(起點秒數, 終點秒數)]，依時間排序且互不重疊；None 表示整段
+    
+    Yields:
+        (段落起點秒數, 段落終點秒數, 以原始音訊時間為準的 NoteEventTable)
+    """
+    predict, model = load_predict()
+    windows = plan_chunks(duration, chunk_seconds, overlap_seconds, regions)
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for k, window in enumerate(windows):
+            owned_start, owned_end, decode_start, decode_end = window
+            events, model_output = transcribe_chunk(
+                predict, model, audio_path, Path(tmp_dir) / f"chunk_{k}.wav", window, params
+            )
+            if posterior_writer is not None:
+                append_posteriors(posterior_writer, model_output, decode_start, owned_start, owned_end)
+            
+            logger.info(f"📍[Analyzer] 分段 {k + 1}/{len(windows)}: {decode_start:.0f}-{decode_end:.0f}s, {len(events)} 個音符")
+            yield owned_start, min(owned_end, duration), events
+
+
+def plan_chunks(
+    duration: float,
+    chunk_seconds: float,
+    overlap_seconds: float = CHUNK_OVERLAP_SECONDS,
+    regions: Optional[List[Tuple[float, float]]] = None
+) -> List[Tuple[float, float, float, float]]:
+    """
+    將推論範圍切成每段最長 chunk_seconds 的段落
+    
+    最後一段負責到音訊結尾 (負責終點為 inf)；解碼範圍前後各多 overlap_seconds，但不超出所屬範圍。
+    
+    Returns:
+        [(負責起點, 負責終點, 解碼起點, 解碼終點)]
+    """
+    windows = []
+    for region_start, region_end in (regions if regions is not None else [(0.0, duration)]):
+        count = max(1, math.ceil((region_end - region_start) / chunk_seconds))
+        for k in range(count):
+            owned_start = region_start + k * chunk_seconds
+            owned_end = region_start + (k + 1) * chunk_seconds if k < count - 1 else region_end
+            decode_start = max(region_start, owned_start - overlap_seconds)
+            decode_end = min(region_end, duration, owned_start + chunk_seconds + overlap_seconds)
+            windows.append((owned_start, owned_end, decode_start, decode_end))
+    if windows:
+        windows[-1] = (windows[-1][0], math.inf) + windows[-1][2:]
+    return windows
+
+
+def transcribe_chunk(
+    predict: Callable,
+    model,
+    audio_path: Path,
+    chunk_path: Path,
+    window: Tuple[float, float, float, float],
+    params: Dict[str, Any]
+) -> Tuple[NoteEventTable, Dict[str, np.ndarray]]:
+    """
+    解碼並推論一段 (plan_chunks 的一個段落)
+    
+    Returns:
+        (以原始音訊時間為準、起音落在負責範圍內的 note_events, 模型輸出)
+    """
+    owned_start, owned_end, decode_start, decode_end = window
+    with stage('decode'):
+        decode_audio_segment(audio_path, decode_start, decode_end - decode_start, chunk_path)
+    with stage('predict') as span:
+        model_output, _, chunk_events = predict(
+            str(chunk_path),
+            model_or_model_path=model,
+            onset_threshold=params['onset_threshold'],
+            frame_threshold=params['frame_threshold'],
+            minimum_note_length=params['min_note_length_ms'],
+        )
+        chunk_path.unlink(missing_ok=True)
+        
+        # 換算回原始音訊時間，只保留起音落在本段負責範圍內的音符
+        events = NoteEventTable.from_events(chunk_events)
+        events.start += decode_start
+        events.end += decode_start
+        owned = (events.start >= owned_start) & (events.start < owned_end)
+        events = NoteEventTable(**{name: col[owned] for name, col in events.to_arrays().items()})
+        span.notes_out = len(events)
+    return events, model_output
+
+
+# 相鄰兩段在邊界兩側各自偵測到同一個起音時，起音相差在此秒數內視為同一個音符
+BOUNDARY_MERGE_SECONDS = 0.05
+
+
+def drop_boundary_duplicates(previous: NoteEventTable, events: NoteEventTable, boundary: float) -> NoteEventTable:
+    """
+    移除與前一段重複的邊界音符：同音高、起音與前一段邊界前的音符相差不到 BOUNDARY_MERGE_SECONDS 時
+    一律保留前一段的音符（規則固定，與各段完成的先後無關）
+    """
+    near = np.flatnonzero(events.start < boundary + BOUNDARY_MERGE_SECONDS)
+    before = previous.start >= boundary - BOUNDARY_MERGE_SECONDS
+    if not len(near) or not before.any():
+        return events
+    prev_pitch = previous.pitch[before]
+    prev_start = previous.start[before]
+    duplicate = np.zeros(len(events), dtype=bool)
+    for i in near:
+        duplicate[i] = np.any(
+            (prev_pitch == events.pitch[i]) & (np.abs(prev_start - events.start[i]) <= BOUNDARY_MERGE_SECONDS)
+        )
+    if not duplicate.any():
+        return events
+    return NoteEventTable(**{name: col[~duplicate] for name, col in events.to_arrays().items()})
+
+
+def owned_posteriors(model_output: Dict[str, np.ndarray], offset: float = 0.0, owned_start: float = 0.0,
+                     owned_end: float = math.inf) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    predict 輸出中負責範圍內的 (時間, onset, frame) 後驗機率 (換算為原始音訊時間)；
+    模型輸出沒有後驗機率時返回 None
+    """
+    if 'note' not in model_output or 'onset' not in model_output:
+        return None
+    frames = model_output['note']
+    times = offset + model_frames_to_time(len(frames))
+    owned = (times >= owned_start) & (times < owned_end)
+    return times[owned], model_output['onset'][owned].astype(POSTERIOR_DTYPE), frames[owned].astype(POSTERIOR_DTYPE)
+
+
+def append_posteriors(posterior_writer, model_output: Dict[str, np.ndarray], offset: float = 0.0,
+                      owned_start: float = 0.0, owned_end: float = math.inf):
+    """將 predict 的 onset/frame 後驗機率 (換算為原始音訊時間) 附加到 PosteriorgramWriter"""
+    if 'note' not in model_output or 'onset' not in model_output:
+        return
+    with stage('posterior_write'):
+        posterior_writer.append(*owned_posteriors(model_output, offset, owned_start, owned_end))
+
+
+# ============================================
+# 單首歌曲平行轉錄（多行程）
+# ============================================
+
+# 平行轉錄一首歌的行程數 (每個行程各自載入一份模型)；1 表示不平行
+PARALLEL_WORKERS = max(1, int(os.environ.get("PARALLEL_TRANSCRIBE_WORKERS", "1")))
+# 平行轉錄時每段至少此秒數（每段前後各多解碼 CHUNK_OVERLAP_SECONDS，段落太短時重疊的成本過高）
+MIN_PARALLEL_SEGMENT_SECONDS = 15.0
+
+_transcribe_pool = None
+_transcribe_pool_workers = 0
+_transcribe_pool_lock = threading.Lock()
+
+
+def parallel_chunk_seconds(active_seconds: float, chunk_seconds: float, workers: int) -> float:
+    """平行轉錄的段落長度：段數為 workers 的倍數 (每個行程分到的量相同)，且每段不超過 chunk_seconds"""
+    rounds = max(1, math.ceil(active_seconds / (workers * chunk_seconds)))
+    return max(MIN_PARALLEL_SEGMENT_SECONDS, active_seconds / (rounds * workers))
+
+
+def _init_transcribe_worker(load_model: bool):
+    """平行轉錄行程啟動時執行一次：預先載入並暖機模型"""
+    if not load_model:
+        return
+    try:
+        warm_up_model()
+    except Exception as e:
+        # 載入失敗時讓第一個段落回報實際錯誤
+        logger.error(f"📍[Analyzer] 平行轉錄行程模型載入失敗: {e}")
+
+
+def get_transcribe_pool(workers: int):
+    """
+    本行程的平行轉錄行程池（延遲建立、之後重複使用；行程數改變或行程池損壞時重建）
+    
+    TensorFlow 不是 fork-safe，一律使用 spawn。
+    """
+    global _transcribe_pool, _transcribe_pool_workers
+    import multiprocessing
+    import multiprocessing.util
+    from concurrent.futures import ProcessPoolExecutor
+    
+    with _transcribe_pool_lock:
+        if _transcribe_pool is not None and (
+            _transcribe_pool_workers != workers or getattr(_transcribe_pool, '_broken', False)
+        ):
+            _transcribe_pool.shutdown(wait=False, cancel_futures=True)
+            _transcribe_pool = None
+        if _transcribe_pool is None:
+            logger.info(f"📍[Analyzer] 建立平行轉錄行程池 ({workers} 個行程)")
+            _transcribe_pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_transcribe_worker,
+                initargs=(_predict_override is None,)
+            )
+            _transcribe_pool_workers = workers
+            # 在推論行程中建立時：行程結束前 multiprocessing 會等待所有子行程，
+            # 須先關閉行程池讓子行程離開 (atexit 在 multiprocessing 子行程中不會執行)；
+            # 優先度高於佇列的關閉 (10)，否則結束訊號送不出去
+            multiprocessing.util.Finalize(None, shutdown_transcribe_pool, kwargs={'wait': True}, exitpriority=100)
+        return _transcribe_pool
+
+
+def shutdown_transcribe_pool(wait: bool = False):
+    """結束平行轉錄行程池（wait=True 時等待子行程離開）"""
+    global _transcribe_pool
+    with _transcribe_pool_lock:
+        if _transcribe_pool is not None:
+            _transcribe_pool.shutdown(wait=wait, cancel_futures=True)
+            _transcribe_pool = None
+
+
+def _transcribe_segment(
+    audio_path: str,
+    window: Tuple[float, float, float, float],
+    params: Dict[str, Any],
+    predict_override: Optional[Callable],
+    with_posteriors: bool
+):
+    """
+    平行轉錄行程執行的單一段落（參數與返回值都需可 pickle）
+    
+    Returns:
+        (note_events 欄位, 負責範圍內的後驗機率或 None, 各階段量測)
+    """
+    predict, model = (predict_override, None) if predict_override is not None else load_predict()
+    trace = StageTrace()
+    with tracing(trace), tempfile.TemporaryDirectory() as tmp_dir:
+        events, model_output = transcribe_chunk(
+            predict, model, Path(audio_path), Path(tmp_dir) / "segment.wav", window, params
+        )
+    posteriors = owned_posteriors(model_output, window[2], window[0], window[1]) if with_posteriors else None
+    return events.to_arrays(), posteriors, trace.stages
+
+
+def iter_parallel_note_events(
+    audio_path: Path,
+    duration: float,
+    params: Dict[str, Any],
+    chunk_seconds: float,
+    workers: int,
+    overlap_seconds: float = CHUNK_OVERLAP_SECONDS,
+    posterior_writer=None,
+    regions: Optional[List[Tuple[float, float]]] = None
+):
+    """
+    平行分段推論：段落的切法與 iter_chunked_note_events 相同，但交給 workers 個行程同時推論
+    
+    依段落順序產出（與完成先後無關），結果與同樣切法的逐段推論相同；
+    同時送出的段落最多 2 * workers 個，已完成但尚未輪到的段落不會無限累積。
+    各行程的 decode / predict 耗時併入目前的量測 (為各行程的耗時總和)。
+    
+    Yields:
+        (段落起點秒數, 段落終點秒數, 以原始音訊時間為準的 NoteEventTable)
+    """
+    from collections import deque
+    
+    windows = plan_chunks(duration, chunk_seconds, overlap_seconds, regions)
+    pool = get_transcribe_pool(workers)
+    trace = current_trace()
+    pending = deque()
+    submitted = 0
+    
+    def submit_next():
+        nonlocal submitted
+        pending.append(pool.submit(
+            _transcribe_segment, str(audio_path), windows[submitted], params,
+            _predict_override, posterior_writer is not None
+        ))
+        submitted += 1
+    
+    try:
+        while submitted < len(windows) and len(pending) < 2 * workers:
+            submit_next()
+        for k, (owned_start, owned_end, decode_start, decode_end) in enumerate(windows):
+            arrays, posteriors, stages = pending.popleft().result()
+            if submitted < len(windows):
+                submit_next()
+            if trace is not None:
+                trace.absorb({'stages': stages})
+            events = NoteEventTable.from_arrays(arrays)
+            if posterior_writer is not None and posteriors is not None:
+                with stage('posterior_write'):
+                    posterior_writer.append(*posteriors)
+            
+            logger.info(f"📍[Analyzer] 平行分段 {k + 1}/{len(windows)}: {decode_start:.0f}-{decode_end:.0f}s, {len(events)} 個音符")
+            yield owned_start, min(owned_end, duration), events
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def events_from_posteriors(posteriors: np.ndarray, params: Dict[str, Any]) -> NoteEventTable:
+    """以快取的後驗機率和 params 中的門檻重新擷取 note_events（不推論）"""
+    with stage('extract') as span:
+        events = NoteEventTable.from_arrays(extract_note_events(
+            posteriors['onset'], posteriors['frame'], posteriors['time'],
+            onset_threshold=params['onset_threshold'],
+            frame_threshold=params['frame_threshold'],
+            min_note_length_ms=params['min_note_length_ms'],
+        ))
+        span.notes_out = len(events)
+    return events
+
+
+# ============================================
+# basic-pitch 模型管理（每個行程只載入一次）
+# ============================================
+
+_model = None
+_model_lock = threading.Lock()
+_model_load_seconds: Optional[float] = None
+_model_warm = False
+# 取代 basic-pitch predict 的實作 (離線基準測試的假轉錄器)；None 時使用 basic-pitch
+_predict_override: Optional[Callable] = None
+
+
+@contextmanager
+def override_predict(predict_fn: Callable):
+    """
+    在此範圍內以 predict_fn 取代 basic-pitch 的 predict，不載入模型
+    
+    predict_fn 的參數與返回值需與 basic_pitch.inference.predict 相同：
+    (音訊路徑, model_or_model_path, onset_threshold, frame_threshold, minimum_note_length)
+    → (model_output, midi_data, note_events)
+    """
+    global _predict_override
+    previous, _predict_override = _predict_override, predict_fn
+    try:
+        yield
+    finally:
+        _predict_override = previous
+
+
+def load_predict() -> Tuple[Callable, Any]:
+    """(predict 函式, 模型)；未被 override_predict 取代時延遲導入 basic-pitch 並載入模型"""
+    if _predict_override is not None:
+        return _predict_override, None
+    from basic_pitch.inference import predict
+    return predict, get_basic_pitch_model()
+
+
+def get_basic_pitch_model():
+    """
+    取得本行程共用的 basic-pitch 模型
+    
+    第一次呼叫時載入 ICASSP 2022 模型 (TensorFlow / ONNX / CoreML 依安裝而定)，
+    之後的任務直接重用，不再重新初始化。
+    """
+    global _model, _model_load_seconds
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                from basic_pitch.inference import Model
+                from basic_pitch import ICASSP_2022_MODEL_PATH
+                
+                t0 = time.perf_counter()
+                _model = Model(ICASSP_2022_MODEL_PATH)
+                _model_load_seconds = time.perf_counter() - t0
+                logger.info(f"📍[Model] basic-pitch 模型載入完成 ({_model_load_seconds:.2f}s)")
+    return _model
+
+
+def warm_up_model() -> Dict[str, Any]:
+    """
+    載入模型並以一秒靜音跑一次推論，讓首個真實任務不必承擔圖形建構成本
+    
+    Returns:
+        model_status()
+    """
+    global _model_warm
+    from basic_pitch.inference import predict
+    
+    model = get_basic_pitch_model()
+    if not _model_warm:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            silence_path = Path(tmp_dir) / "warmup.wav"
+            with wave.open(str(silence_path), 'wb') as wav:
+                wav.setnchannels(1)
+                wav.setsampwidth(2)
+                wav.setframerate(MODEL_SAMPLE_RATE)
+                wav.writeframes(b'\x00\x00' * MODEL_SAMPLE_RATE)
+            t0 = time.perf_counter()
+            predict(str(silence_path), model_or_model_path=model)
+            logger.info(f"📍[Model] 模型暖機完成 ({time.perf_counter() - t0:.2f}s)")
+        _model_warm = True
+    return model_status()
+
+
+def model_status() -> Dict[str, Any]:
+    """本行程的模型狀態"""
+    return {
+        "loaded": _model is not None,
+        "warm": _model_warm,
+        "load_seconds": round(_model_load_seconds, 3) if _model_load_seconds is not None else None,
+        "pid": os.getpid(),
+    }
+
+
+def reset_model():
+    """釋放已載入的模型（僅供基準測試量測冷啟動）"""
+    global _model, _model_load_seconds, _model_warm
+    with _model_lock:
+        _model = None
+        _model_load_seconds = None
+        _model_warm = False
+
+
+# ============================================
+# 後處理參數（階段 3-6，不影響推論）
+# ============================================
+
+POSTPROCESS_DEFAULTS: Dict[str, Any] = {
+    "min_duration": 0.04,        # 押低至 40ms (和弦模式)
+    "min_velocity": 10,          # 押低以捕捉被遮蔽的音符
+    "merge_threshold": 0.03,     # 同一音高在 30ms 內重複觸發視為重疊
+    "harmonic_threshold": 0.35,  # 泛音力度比例門檻
+    "max_duration": 3.0,         # 最大音符長度(秒)，解決踏板延音
+    "velocity_curve": "piano",   # 力度曲線
+}
+VELOCITY_CURVES = ('piano', 'linear', 'soft', 'hard')
+
+
+def get_postprocess_params(chord_mode: bool = True, **overrides) -> Dict[str, Any]:
+    """
+    後處理 (階段 3-6) 參數；adaptive_filter 預設跟隨和弦模式
+    
+    Raises:
+        ValueError: 未知的參數或不合法的值
+    """
+    params = dict(POSTPROCESS_DEFAULTS, adaptive_filter=chord_mode)
+    unknown = set(overrides) - set(params)
+    if unknown:
+        raise ValueError(f"未知的後處理參數: {', '.join(sorted(unknown))}")
+    params.update({key: value for key, value in overrides.items() if value is not None})
+    
+    if params['velocity_curve'] not in VELOCITY_CURVES:
+        raise ValueError(f"velocity_curve 必須是 {', '.join(VELOCITY_CURVES)} 之一")
+    if params['merge_threshold'] <= 0:
+        raise ValueError("merge_threshold 必須大於 0")
+    if params['max_duration'] <= 0:
+        raise ValueError("max_duration 必須大於 0")
+    return params
+
+
+# 分段推論時，已處理範圍最後這段時間內的音符可能還會與下一段合併，暫不定案
+PARTIAL_SAFETY_SECONDS = 5.0
+# 自適應門檻過濾的時間窗口大小(秒)
+ADAPTIVE_WINDOW_SECONDS = 0.1
+
+
+def emit_partial_notes(
+    chunk_tables: List[NoteTable],
+    emitted_until: float,
+    context_start: float,
+    chunk_end: float,
+    audio_duration: float,
+    post_params: Dict[str, Any],
+    partial_callback: Callable[[float, float, List[Dict[str, Any]]], None]
+) -> Tuple[float, float]:
+    """
+    清洗目前已推論的音符，回報 [emitted_until, 定案點) 範圍內的音符
+    
+    只重新清洗定案點附近的尾段，因此每段的成本與總長度無關。
+    尾段從 context_start 開始：這是整首清洗時自適應門檻的某個窗口起點
+    (約在 emitted_until 之前 PARTIAL_SAFETY_SECONDS)，由上一次呼叫依相同的窗口切分求出，
+    尾段的窗口因此與整首清洗對齊。只要同音高的碎音合併鏈或單一音符不長於 PARTIAL_SAFETY_SECONDS，
+    回報的音符與整首清洗的結果相同。
+    
+    Args:
+        context_start: 尾段起點；第一次呼叫傳入 0
+    
+    Returns:
+        (新的已回報時間點, 下一次呼叫的尾段起點)
+    """
+    is_last = chunk_end >= audio_duration
+    cutoff = audio_duration if is_last else chunk_end - PARTIAL_SAFETY_SECONDS
+    if cutoff <= emitted_until:
+        return emitted_until, context_start
+    
+    tail = NoteTable.concat([t.take(t.start >= context_start) for t in chunk_tables]).sorted_by_start()
+    cleaned = clean_note_table(tail, post_params)
+    in_range = cleaned.start >= emitted_until
+    if not is_last:
+        in_range &= cleaned.start < cutoff
+    
+    partial_callback(round(emitted_until, 3), round(cutoff, 3), cleaned.take(in_range).to_dicts())
+    
+    # 下一次的尾段起點：cutoff 之前 PARTIAL_SAFETY_SECONDS 以內最後一個窗口的起點
+    # (chunk_end 之前的音符都已推論完，這段的窗口切分與整首相同)
+    heads = np.array(adaptive_windows(tail.start, ADAPTIVE_WINDOW_SECONDS)[0], dtype=np.int64)
+    candidates = tail.start[heads][tail.start[heads] <= cutoff - PARTIAL_SAFETY_SECONDS]
+    if len(candidates):
+        context_start = max(context_start, float(candidates[-1]))
+    return cutoff, context_start
+
+
+def clean_note_table(
+    notes: NoteTable,
+    post_params: Dict[str, Any],
+    progress_callback: Optional[Callable[[str, float], None]] = None
+) -> NoteTable:
+    """
+    音符清洗階段 4-6（基礎過濾之後）
+    
+    Args:
+        notes: 基礎過濾後的音符表
+        post_params: get_postprocess_params() 的結果
+        progress_callback: 進度回調
+    
+    Returns:
+        清洗後的音符表（按開始時間排序）
+    """
+    # ============================================
+    # 階段 4: 自適應門檻過濾 (和弦模式)
+    # ============================================
+    if post_params['adaptive_filter']:
+        with stage('adaptive_filter', notes_in=len(notes)) as span:
+            notes = adaptive_filter_table(
+                notes,
+                window_size=ADAPTIVE_WINDOW_SECONDS,
+                chord_threshold=4
+            )
+            span.notes_out = len(notes)
+    
+    if progress_callback:
+        progress_callback('analyzing', 70)
+    
+    # ============================================
+    # 階段 5: 泛音過濾
+    # ============================================
+    with stage('harmonic_filter', notes_in=len(notes)) as span:
+        notes = filter_harmonics_table(notes, harmonic_threshold=post_params['harmonic_threshold'])
+        span.notes_out = len(notes)
+    
+    if progress_callback:
+        progress_callback('analyzing', 75)
+    
+    # ============================================
+    # 階段 6: 專業級音符清洗 (碎音合併 + 力度曲線)
+    # ============================================
+    with stage('refine', notes_in=len(notes)) as span:
+        notes = refine_note_table(
+            notes,
+            min_gap=post_params['merge_threshold'],
+            max_duration=post_params['max_duration'],
+            apply_velocity_optimization=True,
+            velocity_curve=post_params['velocity_curve']
+        )
+        span.notes_out = len(notes)
+    return notes
+
+
+def postprocess_note_events(
+    events: NoteEventTable,
+    post_params: Dict[str, Any],
+    progress_callback: Optional[Callable[[str, float], None]] = None
+) -> NoteTable:
+    """階段 3-6：基礎過濾 + 清洗"""
+    with stage('basic_filter', notes_in=len(events)) as span:
+        notes = basic_filter_event_table(
+            events,
+            min_duration=post_params['min_duration'],
+            min_velocity=post_params['min_velocity']
+        )
+        span.notes_out = len(notes)
+    return clean_note_table(notes, post_params, progress_callback)
+
+
+def hash_audio_file(audio_path: Path) -> str:
+    """音訊檔內容雜湊（中間產物快取的 key，與音訊存放區的檔名相同）"""
+    return hash_file(audio_path)
+
+
+def build_result(
+    notes: NoteTable,
+    original_count: int,
+    inference_chunks: int,
+    source_name: str,
+    params: Dict[str, Any],
+    post_params: Dict[str, Any],
+    inference_seconds_saved: float = 0.0
+) -> Dict[str, Any]:
+    """
+    組成 notes.json 格式的結果
+    
+    Args:
+        notes: 清洗後的音符表
+        original_count: basic-pitch 原始音符數
+        inference_chunks: 推論分段數
+        source_name: 音訊檔名
+        params: get_analysis_params() 的結果
+        post_params: get_postprocess_params() 的結果
+        inference_seconds_saved: 因靜音 / 非樂音而未推論的秒數
+    """
+    # 計算總時長
+    total_duration = notes.total_duration()
+    
+    # 統計過濾信息
+    filtered_count = len(notes)
+    filter_rate = ((original_count - filtered_count) / original_count * 100) if original_count > 0 else 0
+    
+    logger.info(f"📍[Analyzer] 過濾統計: 原始 {original_count} → 過濾後 {filtered_count} ({filter_rate:.1f}% 被過濾)")
+    
+    return {
+        "metadata": {
+            "total_duration": round(total_duration, 3),
+            "note_count": filtered_count,
+            "source": source_name,
+            "analysis_method": "Spotify basic-pitch (ICASSP 2022) + Pro Pipeline",
+            "processing_pipeline": {
+                "stage_1_ffmpeg_preprocessing": params['enable_preprocessing'],
+                "stage_1_silence_skipping": params['skip_silence'],
+                "stage_2_chord_mode": params['chord_mode'],
+                "stage_3_basic_filter": True,
+                "stage_4_adaptive_threshold": post_params['adaptive_filter'],
+                "stage_5_harmonic_filter": True,
+                "stage_6_velocity_curve": True
+            },
+            "parameters": {
+                "onset_threshold": params['onset_threshold'],
+                "frame_threshold": params['frame_threshold'],
+                "min_note_length_ms": params['min_note_length_ms'],
+                "min_duration_ms": post_params['min_duration'] * 1000,
+                "min_velocity": post_params['min_velocity'],
+                "merge_threshold_ms": post_params['merge_threshold'] * 1000,
+                "harmonic_threshold": post_params['harmonic_threshold'],
+                "max_duration": post_params['max_duration'],
+                "velocity_curve": post_params['velocity_curve']
+            },
+            "statistics": {
+                "original_count": original_count,
+                "inference_chunks": inference_chunks,
+                "inference_seconds_saved": round(inference_seconds_saved, 3),
+                "final_count": filtered_count,
+                "filter_rate_percent": round(filter_rate, 1)
+            }
+        },
+        "notes": notes.to_dicts()
+    }
+
+
+def result_analysis_params(result: Dict[str, Any]) -> Dict[str, Any]:
+    """分析結果當初使用的推論參數（中間產物快取的 key）"""
+    pipeline = result['metadata']['processing_pipeline']
+    return get_analysis_params(
+        pipeline['stage_2_chord_mode'], pipeline['stage_1_ffmpeg_preprocessing'],
+        pipeline.get('stage_1_silence_skipping', False)
+    )
+
+
+def refine_from_events(
+    events: NoteEventTable,
+    result: Dict[str, Any],
+    post_params: Dict[str, Any],
+    params: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    以快取的原始 note_events 和新的後處理參數重跑階段 3-6（不下載、不推論）
+    
+    Args:
+        events: 中間產物快取中的原始 note_events，或由後驗機率重新擷取者
+        result: 原本的分析結果（沿用來源資訊）
+        post_params: 新的後處理參數
+        params: events 對應的推論參數，預設為原本結果的參數
+    
+    Returns:
+        新的分析結果字典
+    """
+    metadata = result['metadata']
+    params = params or result_analysis_params(result)
+    notes = postprocess_note_events(events, post_params)
+    refined = build_result(
+        notes, len(events), metadata['statistics'].get('inference_chunks', 1),
+        metadata.get('source', ''), params, post_params,
+        metadata['statistics'].get('inference_seconds_saved', 0.0)
+    )
+    for key in ('title', 'audio_file', 'video_id', 'audio_sha256'):
+        if key in metadata:
+            refined['metadata'][key] = metadata[key]
+    return refined
+
+
 def analyze_audio_with_basic_pitch(
     audio_path: Path,
     output_dir: Path,
     progress_callback: Optional[Callable[[str, float], None]] = None,
     enable_preprocessing: bool = True,
-    chord_mode: bool = True
-) -> Path:
+    chord_mode: bool = True,
+    chunk_seconds: Optional[float] = CHUNK_SECONDS,
+    partial_callback: Optional[Callable[[float, float, List[Dict[str, Any]]], None]] = None,
+    post_params: Optional[Dict[str, Any]] = None,
+    artifact_cache=None,
+    posterior_cache=None,
+    parallel_workers: int = PARALLEL_WORKERS
+) -> Dict[str, Any]:
     """
-    使用 Spotify basic-pitch 進行音訊分析並轉換為 notes.json
+    使用 Spotify basic-pitch 進行音訊分析並轉換為 notes.json 格式的結果
     
     basic-pitch 支援多音軌（和弦）檢測，效果遠優於單音檢測器。
+    長度超過 chunk_seconds 的音訊會分段推論，峰值記憶體不隨長度增加。
+    parallel_workers > 1 時將音訊切成前後重疊的段落，以多個行程同時推論後依段落順序合併，
+    延遲約隨行程數縮短（結果與整段推論僅在段落邊界附近有些微時間差異）。
     
     Args:
-        audio_path: MP3 音訊路徑
-        output_dir: JSON 輸出目錄
+        audio_path: 下載的原始音訊路徑
+        output_dir: 預處理音訊的輸出目錄
         progress_callback: 進度回調
         enable_preprocessing: 是否啟用 FFmpeg 預處理
         chord_mode: 是否啟用和弦模式（降低 onset/frame 閾值）
+        chunk_seconds: 分段長度(秒)，None 表示一律整段推論
+        partial_callback: 分段推論時，每完成一段即以 (起始秒, 結束秒, 音符列表)
+            回報該時間範圍內已定案的清洗後音符；最終結果以返回值為準
+        post_params: 後處理參數，預設為 get_postprocess_params(chord_mode)
+        artifact_cache: ArtifactCache；以音訊雜湊快取原始 note_events，
+            命中時跳過預處理與推論
+        posterior_cache: PosteriorgramCache；以音訊雜湊快取模型後驗機率，
+            只有門檻不同 (例如切換和弦模式) 時由後驗機率重新擷取音符，不推論
+        parallel_workers: 平行推論的行程數 (每個行程各自載入一份模型)，預設為 PARALLEL_TRANSCRIBE_WORKERS
     
     Returns:
-        notes.json 檔案路徑
+        分析結果字典 {"metadata", "notes"}（不寫檔，由呼叫端決定如何序列化）
     """
-    # 延遲導入以加快啟動速度
-    from basic_pitch.inference import predict
-    from basic_pitch import ICASSP_2022_MODEL_PATH
-    
     if progress_callback:
         progress_callback('analyzing', 5)
     
+    # 推論參數 (影響 note_events) 與後處理參數 (只影響階段 3-6) 分開
+    params = get_analysis_params(chord_mode, enable_preprocessing)
+    post_params = post_params or get_postprocess_params(chord_mode)
+    # 基準測試在外層開啟記憶體量測時沿用
+    outer = current_trace()
+    trace = StageTrace(memory=outer is not None and outer.memory)
+    with tracing(trace):
+        with stage('hash'):
+            audio_hash = hash_audio_file(audio_path)
+        
+        try:
+            events = None
+            if artifact_cache is not None:
+                with stage('cache_lookup'):
+                    arrays = artifact_cache.get(audio_hash, params)
+                if arrays is not None:
+                    events = NoteEventTable.from_arrays(arrays)
+                    inference_chunks = 0
+                    logger.info(f"📍[Analyzer] 使用快取的 note_events ({len(events)} 個)，跳過推論")
+            
+            else:
+                arrays = None
+            
+            if events is None and posterior_cache is not None:
+                with stage('cache_lookup'):
+                    posteriors = posterior_cache.get(audio_hash, posterior_params(params))
+                if posteriors is not None:
+                    events = events_from_posteriors(posteriors, params)
+                    inference_chunks = 0
+                    logger.info(f"📍[Analyzer] 由快取的後驗機率重新擷取 {len(events)} 個音符，跳過推論")
+            
+            if events is None:
+                events, inference_chunks = transcribe_with_posteriors(
+                    audio_path, output_dir, params, post_params, audio_hash, posterior_cache,
+                    progress_callback, chunk_seconds, partial_callback, parallel_workers
+                )
+            
+            if artifact_cache is not None and arrays is None:
+                try:
+                    with stage('cache_write'):
+                        artifact_cache.put(audio_hash, params, events.to_arrays())
+                except OSError as e:
+                    logger.warning(f"📍[Analyzer] 中間產物快取寫入失敗: {e}")
+            
+            if progress_callback:
+                progress_callback('analyzing', 60)
+            
+            # ============================================
+            # 階段 3-6: 基礎過濾 + 自適應門檻 + 泛音過濾 + 專業級清洗
+            # ============================================
+            notes = postprocess_note_events(events, post_params, progress_callback)
+            
+            if progress_callback:
+                progress_callback('analyzing', 85)
+            
+            with stage('build_result'):
+                output_data = build_result(
+                    notes, len(events), inference_chunks, str(audio_path.name), params, post_params,
+                    trace.inference_seconds_saved
+                )
+            output_data['metadata']['audio_sha256'] = audio_hash
+            
+            # 快取命中 (未經預處理) 時另外取得音訊長度
+            if trace.audio_duration is None:
+                set_audio_duration(probe_audio_duration(audio_path))
+            trace.sample_rss()
+            output_data['metadata']['instrumentation'] = trace.to_dict()
+            logger.info(f"📍[Analyzer] 階段耗時: {trace.summary()}")
+            
+            if progress_callback:
+                progress_callback('analyzing', 100)
+            
+            logger.info(f"📍[Analyzer] basic-pitch 分析完成: {len(notes)} 個音符, 總時長 {notes.total_duration():.2f}s")
+            return output_data
+            
+        except Exception as e:
+            logger.error(f"📍[Analyzer] basic-pitch 分析失敗: {e}")
+            raise RuntimeError(f"音訊分析失敗: {str(e)}")
+
+
+def transcribe_with_posteriors(
+    audio_path: Path,
+    output_dir: Path,
+    params: Dict[str, Any],
+    post_params: Dict[str, Any],
+    audio_hash: str,
+    posterior_cache=None,
+    progress_callback: Optional[Callable[[str, float], None]] = None,
+    chunk_seconds: Optional[float] = CHUNK_SECONDS,
+    partial_callback: Optional[Callable[[float, float, List[Dict[str, Any]]], None]] = None,
+    parallel_workers: int = 1
+) -> Tuple[NoteEventTable, int]:
+    """
+    推論並將後驗機率寫入 posterior_cache；快取寫入失敗不影響分析結果
+    
+    Returns:
+        (原始 note_events, 推論分段數)
+    """
+    posterior_writer = None
+    if posterior_cache is not None:
+        try:
+            posterior_writer = posterior_cache.writer(audio_hash, posterior_params(params))
+        except OSError as e:
+            logger.warning(f"📍[Analyzer] 後驗機率快取無法寫入: {e}")
+    
+    try:
+        result = transcribe_note_events(
+            audio_path, output_dir, params, post_params,
+            progress_callback, chunk_seconds, partial_callback, posterior_writer, parallel_workers
+        )
+        if posterior_writer is not None and posterior_writer.frames:
+            try:
+                posterior_writer.commit()
+            except OSError as e:
+                logger.warning(f"📍[Analyzer] 後驗機率快取寫入失敗: {e}")
+            posterior_writer = None
+        return result
+    finally:
+        if posterior_writer is not None:
+            posterior_writer.abort()
+
+
+def transcribe_note_events(
+    audio_path: Path,
+    output_dir: Path,
+    params: Dict[str, Any],
+    post_params: Dict[str, Any],
+    progress_callback: Optional[Callable[[str, float], None]] = None,
+    chunk_seconds: Optional[float] = CHUNK_SECONDS,
+    partial_callback: Optional[Callable[[float, float, List[Dict[str, Any]]], None]] = None,
+    posterior_writer=None,
+    parallel_workers: int = 1
+) -> Tuple[NoteEventTable, int]:
+    """
+    階段 1-2：預處理 + basic-pitch 推論
+    
+    posterior_writer 不為 None 時，同時附加模型的 onset/frame 後驗機率；
+    parallel_workers > 1 時以多個行程平行推論
+    
+    Returns:
+        (原始 note_events, 推論分段數)
+    """
     # ============================================
     # 階段 1: FFmpeg 音訊預處理 (選擇性)
     # ============================================
-    processed_audio = audio_path
-    if enable_preprocessing:
-        logger.info(f"📍[Analyzer] 開始音訊預處理...")
-        processed_audio = preprocess_audio_with_ffmpeg(audio_path, output_dir)
-        
+    # 未啟用預處理時仍需一次解碼，讓模型直接讀取 22.05kHz 單聲道 PCM
+    enable_preprocessing = params['enable_preprocessing']
+    logger.info(f"📍[Analyzer] 開始音訊預處理 (濾波: {enable_preprocessing})...")
+    with stage('preprocess'):
+        processed_audio = preprocess_audio_with_ffmpeg(
+            audio_path,
+            output_dir,
+            apply_filters=enable_preprocessing,
+            progress_callback=(lambda fraction: progress_callback('analyzing', 5 + 10 * fraction)) if progress_callback else None
+        )
+    
     if progress_callback:
         progress_callback('analyzing', 15)
     
+    # 預處理後的 WAV 只在推論期間需要，結束後立即刪除，不在磁碟上累積
+    try:
+        return _predict_note_events(
+            processed_audio, params, post_params, progress_callback,
+            chunk_seconds, partial_callback, posterior_writer, parallel_workers
+        )
+    finally:
+        if processed_audio != audio_path:
+            processed_audio.unlink(missing_ok=True)
+
+
+def _predict_note_events(
+    processed_audio: Path,
+    params: Dict[str, Any],
+    post_params: Dict[str, Any],
+    progress_callback: Optional[Callable[[str, float], None]],
+    chunk_seconds: Optional[float],
+    partial_callback: Optional[Callable[[float, float, List[Dict[str, Any]]], None]],
+    posterior_writer,
+    parallel_workers: int = 1
+) -> Tuple[NoteEventTable, int]:
+    """階段 2：basic-pitch 推論（長音訊分段或多行程平行，可略過靜音 / 非樂音片段）"""
     logger.info(f"📍[Analyzer] 使用 basic-pitch 分析: {processed_audio}")
+    logger.info(f"📍[Analyzer] 和弦模式: {params['chord_mode']}, "
+                f"onset={params['onset_threshold']}, frame={params['frame_threshold']}")
+    
+    segmented = select_inference_regions(processed_audio) if params['skip_silence'] else None
+    if segmented is not None:
+        regions, audio_duration = segmented
+        add_skipped_seconds(skipped_seconds(regions, audio_duration))
+    else:
+        regions = None
+        audio_duration = probe_audio_duration(processed_audio) if chunk_seconds or parallel_workers > 1 else None
+    
+    active_seconds = audio_duration or 0.0
+    if regions is not None:
+        active_seconds -= skipped_seconds(regions, audio_duration)
+    if parallel_workers > 1 and active_seconds and active_seconds >= 2 * MIN_PARALLEL_SEGMENT_SECONDS:
+        # 多行程平行：段落長度讓各行程分到相同的量
+        segment_seconds = parallel_chunk_seconds(active_seconds, chunk_seconds or math.inf, parallel_workers)
+        chunks = iter_parallel_note_events(
+            processed_audio, audio_duration, params, segment_seconds, parallel_workers,
+            posterior_writer=posterior_writer, regions=regions
+        )
+    elif regions is not None or (
+        chunk_seconds and audio_duration and audio_duration > chunk_seconds + CHUNK_OVERLAP_SECONDS
+    ):
+        # 長音訊 / 只推論活動範圍：逐段推論（chunk_seconds 為 None 且太短不平行時整段推論）
+        chunks = iter_chunked_note_events(
+            processed_audio, audio_duration, params, chunk_seconds=chunk_seconds or math.inf,
+            posterior_writer=posterior_writer, regions=regions
+        )
+    else:
+        chunks = None
+    
+    if chunks is not None:
+        # 每段的 note_events 立即轉為欄式表，模型輸出隨即釋放
+        chunk_events: List[NoteEventTable] = []
+        chunk_tables: List[NoteTable] = []
+        emitted_until = context_start = 0.0
+        for chunk_start, chunk_end, events in chunks:
+            if chunk_events:
+                events = drop_boundary_duplicates(chunk_events[-1], events, chunk_start)
+            chunk_events.append(events)
+            if partial_callback:
+                # 中途回報的清洗只計入 partial_notes，不重複計入各過濾階段
+                with stage('partial_notes'), tracing(None):
+                    chunk_tables.append(basic_filter_event_table(
+                        events,
+                        min_duration=post_params['min_duration'],
+                        min_velocity=post_params['min_velocity']
+                    ))
+                    emitted_until, context_start = emit_partial_notes(
+                        chunk_tables, emitted_until, context_start, chunk_end, audio_duration,
+                        post_params, partial_callback
+                    )
+            if progress_callback:
+                progress_callback('analyzing', 15 + 45 * min(1.0, chunk_end / audio_duration))
+        return NoteEventTable.concat(chunk_events), len(chunk_events)
     
-    try:
-        # ============================================
-        # 階段 2: 調整 basic-pitch 參數
-        # ============================================
-        # chord_mode: 降低閾值以捕捉更多和弦細節
-        if chord_mode:
-            onset_thresh = 0.4    # 預設 ~0.5, 降低以捕捉和弦
-            frame_thresh = 0.25   # 預設 ~0.3, 降低讓長音不易斷掉
-            min_note_len = 50     # 最小音符長度 (ms)
-        else:
-            onset_thresh = 0.5
-            frame_thresh = 0.3
-            min_note_len = 80
-        
-        logger.info(f"📍[Analyzer] 和弦模式: {chord_mode}, onset={onset_thresh}, frame={frame_thresh}")
-        
-        # 使用 predict 函數獲取原始數據
+    # 使用 predict 函數獲取原始數據 (延遲導入以加快啟動速度)
+    # note_events 是 (start_time_s, end_time_s, pitch_midi, amplitude, [pitch_bends])
+    predict, model = load_predict()
+    with stage('predict') as span:
         model_output, midi_data, note_events = predict(
             str(processed_audio),
-            model_or_model_path=ICASSP_2022_MODEL_PATH,
-            onset_threshold=onset_thresh,
-            frame_threshold=frame_thresh,
-            minimum_note_length=min_note_len,
+            model_or_model_path=model,
+            onset_threshold=params['onset_threshold'],
+            frame_threshold=params['frame_threshold'],
+            minimum_note_length=params['min_note_length_ms'],
         )
-        
-        if progress_callback:
-            progress_callback('analyzing', 50)
-        
-        # ============================================
-        # 階段 3: 基礎過濾 (範圍 + 時長 + 力度)
-        # ============================================
-        MIN_DURATION = 0.04    # 押低至 40ms (和弦模式)
-        MIN_VELOCITY = 10      # 押低以捕捉被遮蔽的音符
-        MERGE_THRESHOLD = 0.03 # 同一音高在 30ms 內重複觸發視為重疊
-        
-        # 將 note_events 轉換為我們需要的 JSON 格式
-        # note_events 是 (start_time_s, end_time_s, pitch_midi, velocity, [pitch_bends])
-        raw_notes: List[Dict[str, Any]] = []
-        
-        for note in note_events:
-            start_time = float(note[0])
-            end_time = float(note[1])
-            pitch = int(note[2])  # MIDI pitch (0-127, 60 = Middle C)
-            velocity = int(note[3] * 127)  # 正規化到 0-127
-            duration = end_time - start_time
-            
-            # 過濾 1: 鋼琴範圍 (A0=21 到 C8=108)
-            if pitch < 21 or pitch > 108:
-                continue
-            
-            # 過濾 2: 最小時長 (去除碎音雜訊)
-            if duration < MIN_DURATION:
-                continue
-            
-            # 過濾 3: 最小力度 (去除背景雜訊)
-            if velocity < MIN_VELOCITY:
-                continue
-            
-            raw_notes.append({
-                "pitch": pitch,
-                "start_time": round(start_time, 3),
-                "end_time": round(end_time, 3),
-                "duration": round(duration, 3),
-                "velocity": min(127, max(1, velocity))
-            })
-        
-        if progress_callback:
-            progress_callback('analyzing', 60)
-        
-        # ============================================
-        # 階段 4: 自適應門檻過濾 (和弦模式)
-        # ============================================
-        if chord_mode:
-            raw_notes = adaptive_filter_notes(
-                raw_notes,
-                window_size=0.1,
-                chord_threshold=4
-            )
-        
-        if progress_callback:
-            progress_callback('analyzing', 70)
-        
-        # ============================================
-        # 階段 5: 泛音過濾
-        # ============================================
-        raw_notes = filter_harmonics(raw_notes, harmonic_threshold=0.35)
-        
-        if progress_callback:
-            progress_callback('analyzing', 75)
-        
-        # ============================================
-        # 階段 6: 專業級音符清洗 (碎音合併 + 力度曲線)
-        notes_json = refine_notes(
-            raw_notes,
-            min_gap=MERGE_THRESHOLD,
-            apply_velocity_optimization=True
-        )
-        
-        if progress_callback:
-            progress_callback('analyzing', 85)
-        
-        # 計算總時長
-        total_duration = max(n['start_time'] + n['duration'] for n in notes_json) if notes_json else 0
-        
-        # 統計過濾信息
-        original_count = len(note_events)
-        filtered_count = len(notes_json)
-        filter_rate = ((original_count - filtered_count) / original_count * 100) if original_count > 0 else 0
-        
-        logger.info(f"📍[Analyzer] 過濾統計: 原始 {original_count} → 過濾後 {filtered_count} ({filter_rate:.1f}% 被過濾)")
-        
-        # 輸出 JSON
-        output_path = output_dir / "notes.json"
-        output_data = {
-            "metadata": {
-                "total_duration": round(total_duration, 3),
-                "note_count": len(notes_json),
-                "source": str(audio_path.name),
-                "analysis_method": "Spotify basic-pitch (ICASSP 2022) + Pro Pipeline",
-                "processing_pipeline": {
-                    "stage_1_ffmpeg_preprocessing": enable_preprocessing,
-                    "stage_2_chord_mode": chord_mode,
-                    "stage_3_basic_filter": True,
-                    "stage_4_adaptive_threshold": chord_mode,
-                    "stage_5_harmonic_filter": True,
-                    "stage_6_velocity_curve": True
-                },
-                "parameters": {
-                    "onset_threshold": onset_thresh,
-                    "frame_threshold": frame_thresh,
-                    "min_note_length_ms": min_note_len,
-                    "min_duration_ms": MIN_DURATION * 1000,
-                    "min_velocity": MIN_VELOCITY,
-                    "merge_threshold_ms": MERGE_THRESHOLD * 1000
-                },
-                "statistics": {
-                    "original_count": original_count,
-                    "final_count": filtered_count,
-                    "filter_rate_percent": round(filter_rate, 1)
-                }
-            },
-            "notes": notes_json
-        }
-        
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(output_data, f, ensure_ascii=False, indent=2)
-        
-        if progress_callback:
-            progress_callback('analyzing', 100)
-        
-        logger.info(f"📍[Analyzer] basic-pitch 分析完成: {len(notes_json)} 個音符, 總時長 {total_duration:.2f}s")
-        return output_path
-        
-    except Exception as e:
-        logger.error(f"📍[Analyzer] basic-pitch 分析失敗: {e}")
-        raise RuntimeError(f"音訊分析失敗: {str(e)}")
+        events = NoteEventTable.from_events(note_events)
+        span.notes_out = len(events)
+    
+    if progress_callback:
+        progress_callback('analyzing', 50)
+    
+    if posterior_writer is not None:
+        append_posteriors(posterior_writer, model_output)
+    
+    return events, 1
+
+
+# 略過的總長度少於此秒數時仍整段推論（分段的額外成本不值得）
+MIN_SKIP_SECONDS = 5.0
+
+
+def select_inference_regions(processed_audio: Path) -> Optional[Tuple[List[Tuple[float, float]], float]]:
+    """
+    偵測預處理後音訊中的靜音 / 非樂音片段，決定要送進模型的範圍
+    
+    Returns:
+        (活動範圍列表, 音訊總長度秒數)；無法偵測 (不是 PCM WAV) 或可略過的部分太短時返回 None
+    """
+    with stage('segment'):
+        detected = find_active_regions(processed_audio)
+    if detected is None:
+        return None
+    regions, duration = detected
+    skipped = skipped_seconds(regions, duration)
+    if skipped < MIN_SKIP_SECONDS:
+        return None
+    spans = ", ".join(f"{start:.1f}-{end:.1f}s" for start, end in regions[:8]) + (" ..." if len(regions) > 8 else "")
+    logger.info(f"📍[Analyzer] 略過靜音 / 非樂音 {skipped:.1f}s / {duration:.1f}s，推論範圍: {spans or '無'}")
+    return regions, duration
 
 
 def process_youtube(
     youtube_url: str,
     output_dir: Path,
-    progress_callback: Optional[Callable[[str, float], None]] = None
+    progress_callback: Optional[Callable[[str, float], None]] = None,
+    enable_preprocessing: bool = True,
+    chord_mode: bool = True
 ) -> Dict[str, Any]:
     """
     完整流程：下載 YouTube 音訊並分析為 JSON
@@ -636,30 +2161,56 @@ def process_youtube(
         youtube_url: YouTube 網址
         output_dir: 輸出目錄
         progress_callback: 進度回調
+        enable_preprocessing: 是否啟用 FFmpeg 預處理
+        chord_mode: 是否啟用和弦模式
     
     Returns:
-        包含分析結果的字典
+        包含分析結果的字典（同時寫入 output_dir/<影片 ID>.notes.json）
     """
     output_dir = Path(output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
     
     # 階段 1: 下載音訊
-    audio_path, video_title = download_audio(youtube_url, output_dir, progress_callback)
+    download_trace = StageTrace()
+    with tracing(download_trace):
+        audio_path, video_title = download_audio(youtube_url, output_dir, progress_callback)
     
     # 階段 2: 分析音訊 (使用 basic-pitch)
-    json_path = analyze_audio_with_basic_pitch(audio_path, output_dir, progress_callback)
+    result = analyze_audio_with_basic_pitch(
+        audio_path,
+        output_dir,
+        progress_callback,
+        enable_preprocessing=enable_preprocessing,
+        chord_mode=chord_mode
+    )
+    result = finalize_result(result, audio_path, video_title, download_trace=download_trace)
+    
+    # 每部影片各自的輸出檔，並發任務不會互相覆蓋；只序列化一次
+    write_json_atomic(output_dir / f"{audio_path.stem}.notes.json", result)
+    return result
+
+
+def finalize_result(result: Dict[str, Any], audio_path: Path, video_title: str,
+                    video_id: Optional[str] = None, download_trace: Optional[StageTrace] = None) -> Dict[str, Any]:
+    """
+    為分析結果補上來源資訊（標題、音訊檔、影片 ID）
     
-    # 讀取生成的 JSON
-    with open(json_path, 'r', encoding='utf-8') as f:
-        result = json.load(f)
+    Args:
+        result: analyze_audio_with_basic_pitch 返回的結果（原地修改）
+        audio_path: 下載的音訊路徑
+        video_title: 影片標題
+        video_id: 影片 ID（音訊存放區以內容雜湊命名，檔名不是影片 ID）
+        download_trace: 下載階段的量測，併入 metadata['instrumentation']
     
+    Returns:
+        包含分析結果的字典
+    """
     result['metadata']['title'] = video_title
     result['metadata']['audio_file'] = str(audio_path.name)
-    
-    # 重新保存帶標題的版本
-    with open(json_path, 'w', encoding='utf-8') as f:
-        json.dump(result, f, ensure_ascii=False, indent=2)
-    
+    result['metadata']['video_id'] = video_id or audio_path.stem
+    if download_trace is not None:
+        download_trace.absorb(result['metadata'].get('instrumentation'))
+        result['metadata']['instrumentation'] = download_trace.to_dict()
     return result
 
 
@@ -0,0 +1,162 @@
+"""
+中間產物磁碟快取
+以音訊內容雜湊 + 推論參數雜湊作為 key，保存 basic-pitch 的原始 note_events
+（欄式陣列，壓縮 .npz）。調整後處理參數時只需重跑階段 3-6，不需重新下載與推論。
+
+另以 PosteriorgramCache 保存模型的 onset/frame 後驗機率 (float16 .npy)，
+讀取時以 memmap 對應，調整 onset/frame 門檻時直接重新擷取音符。
+
+淘汰、原子寫入與跨 worker 鎖沿用 ResultCache。
+"""
+
+import os
+import shutil
+import zipfile
+import logging
+import tempfile
+from pathlib import Path
+from typing import Optional, Dict, Any
+
+import numpy as np
+
+try:
+    from backend.result_cache import ResultCache  # Docker 環境
+except ImportError:
+    from result_cache import ResultCache  # 本地開發
+
+logger = logging.getLogger(__name__)
+
+
+class ArtifactCache(ResultCache):
+    """
+    原始 note_events 快取：`<audio_hash>-<params_hash>.npz`
+
+    get/put 的值為欄名 → NumPy 陣列的字典（見 analyzer.NoteEventTable）。
+    """
+
+    SUFFIX = '.npz'
+
+    def get(self, audio_hash: str, params: Dict[str, Any]) -> Optional[Dict[str, np.ndarray]]:
+        """讀取快取的陣列；未命中時返回 None"""
+        path = self._path(audio_hash, params)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                arrays = {name: data[name] for name in data.files}
+            os.utime(path)  # 標記為最近使用
+        except (FileNotFoundError, ValueError, OSError, zipfile.BadZipFile):
+            self._count('misses')
+            return None
+
+        self._count('hits')
+        logger.info(f"📍[Artifacts] 命中: {path.name}")
+        return arrays
+
+    def put(self, audio_hash: str, params: Dict[str, Any], arrays: Dict[str, np.ndarray]):
+        """原子寫入壓縮陣列，並在超過容量上限時淘汰最舊的項目"""
+        path = self._path(audio_hash, params)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='.tmp-', suffix=self.SUFFIX)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez_compressed(f, **arrays)
+            os.replace(tmp_path, path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+        logger.info(f"📍[Artifacts] 已寫入: {path.name}")
+        self.evict()
+
+
+class PosteriorgramCache(ResultCache):
+    """
+    模型後驗機率快取：`<audio_hash>-<params_hash>.npy`
+
+    每一幀一筆紀錄 (time float64, onset float16[88], frame float16[88])，
+    每分鐘約 1.8 MB。get 以唯讀 memmap 返回，只有實際用到的頁面才會讀入記憶體。
+    """
+
+    SUFFIX = '.npy'
+    DTYPE = np.dtype([('time', '<f8'), ('onset', '<f2', (88,)), ('frame', '<f2', (88,))])
+
+    def get(self, audio_hash: str, params: Dict[str, Any]) -> Optional[np.ndarray]:
+        """讀取後驗機率 (結構化 memmap，欄位 time / onset / frame)；未命中時返回 None"""
+        path = self._path(audio_hash, params)
+        try:
+            posteriors = np.load(path, mmap_mode='r', allow_pickle=False)
+            os.utime(path)
+        except (FileNotFoundError, ValueError, OSError):
+            self._count('misses')
+            return None
+        if posteriors.dtype != self.DTYPE:
+            self._count('misses')
+            return None
+
+        self._count('hits')
+        logger.info(f"📍[Posteriors] 命中: {path.name} ({len(posteriors)} 幀)")
+        return posteriors
+
+    def writer(self, audio_hash: str, params: Dict[str, Any]) -> 'PosteriorgramWriter':
+        """分段推論時逐段附加後驗機率，全部完成後 commit"""
+        return PosteriorgramWriter(self, self._path(audio_hash, params))
+
+
+class PosteriorgramWriter:
+    """
+    逐段寫入後驗機率
+
+    幀數要到推論結束才知道，因此先將紀錄寫入暫存檔，commit 時補上 .npy 標頭
+    並原子換名；記憶體中只保留目前這一段。
+    """
+
+    def __init__(self, cache: PosteriorgramCache, path: Path):
+        self.cache = cache
+        self.path = path
+        self.frames = 0
+        fd, self._raw_path = tempfile.mkstemp(dir=cache.root, prefix='.tmp-', suffix='.raw')
+        self._raw = os.fdopen(fd, 'wb')
+
+    def append(self, times: np.ndarray, onsets: np.ndarray, frames: np.ndarray):
+        """附加一段後驗機率；磁碟寫入失敗時放棄快取，不中斷推論"""
+        if self._raw is None:
+            return
+        records = np.empty(len(times), dtype=self.cache.DTYPE)
+        records['time'] = times
+        records['onset'] = onsets
+        records['frame'] = frames
+        try:
+            self._raw.write(records.tobytes())
+        except OSError as e:
+            logger.warning(f"📍[Posteriors] 寫入失敗，放棄快取: {e}")
+            self.abort()
+            return
+        self.frames += len(records)
+
+    def commit(self):
+        """寫入 .npy 並在超過容量上限時淘汰最舊的項目"""
+        self._raw.close()
+        self._raw = None
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache.root, prefix='.tmp-', suffix=self.cache.SUFFIX)
+        try:
+            with os.fdopen(fd, 'wb') as f, open(self._raw_path, 'rb') as raw:
+                np.lib.format.write_array_header_1_0(f, {
+                    'descr': np.lib.format.dtype_to_descr(self.cache.DTYPE),
+                    'fortran_order': False,
+                    'shape': (self.frames,),
+                })
+                shutil.copyfileobj(raw, f, 1 << 20)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+        finally:
+            Path(self._raw_path).unlink(missing_ok=True)
+
+        logger.info(f"📍[Posteriors] 已寫入: {self.path.name} ({self.frames} 幀)")
+        self.cache.evict()
+
+    def abort(self):
+        if self._raw is not None:
+            self._raw.close()
+            self._raw = None
+        self.frames = 0
+        Path(self._raw_path).unlink(missing_ok=True)
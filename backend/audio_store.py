@@ -0,0 +1,239 @@
+"""
+下載音訊存放區
+以內容雜湊存放音訊 (blobs/<sha256><副檔名>)，並以影片 ID 索引 (ids/<video_id>.json，上傳的檔案以內容雜湊為 ID)：
+- 同一部影片再次分析時直接使用已下載的檔案，不重新下載
+- 內容相同的音訊只存一份
+- 總大小超過上限時淘汰最久未使用的檔案，超過保存期限未被使用的檔案一律刪除
+- 下載先寫到暫存目錄，完成後 os.replace 換名，其他 worker 永遠看不到寫到一半的檔案
+"""
+
+import os
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, Tuple
+
+try:
+    import fcntl  # POSIX 檔案鎖 (Docker / Railway)
+except ImportError:  # Windows 本地開發：單一 worker，不需要跨行程鎖
+    fcntl = None
+
+try:
+    from backend.serialization import loads, write_json_atomic  # Docker 環境
+except ImportError:
+    from serialization import loads, write_json_atomic  # 本地開發
+
+logger = logging.getLogger(__name__)
+
+
+def hash_file(path: Path) -> str:
+    """檔案內容雜湊（與 analyzer.hash_audio_file 相同：sha256 前 32 碼）"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()[:32]
+
+
+class AudioStore:
+    """
+    以 LRU + TTL 淘汰、總大小受限的音訊存放區
+
+    使用中 (pin) 的檔案不會被本行程淘汰；其他 worker 的淘汰依 mtime 排序，
+    剛取用的檔案 mtime 最新，會最後才被淘汰。
+    """
+
+    def __init__(self, root: Path, max_bytes: int, ttl_seconds: float = 0):
+        self.root = Path(root)
+        self.blobs = self.root / 'blobs'
+        self.ids = self.root / 'ids'
+        self.blobs.mkdir(parents=True, exist_ok=True)
+        self.ids.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.dedupes = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._pins: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _count(self, field: str, amount: int = 1):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + amount)
+
+    def lookup(self, video_id: str, pin: bool = False) -> Optional[Tuple[Path, str]]:
+        """
+        已下載的音訊
+
+        Args:
+            pin: 找到時同時標記為使用中，其他請求的淘汰不會刪除它（呼叫端負責 unpin）
+
+        Returns:
+            (音訊路徑, 影片標題)；未下載或已被淘汰時返回 None
+        """
+        pointer = self.ids / f"{video_id}.json"
+        path = None
+        try:
+            entry = loads(pointer.read_bytes())
+            path = self.blobs / entry['blob']
+            if pin:
+                self.pin(path)
+            os.utime(path)  # 標記為最近使用；標記後才確認檔案仍在，之後不會再被淘汰
+        except (FileNotFoundError, ValueError, KeyError):
+            if pin and path is not None:
+                self.unpin(path)
+            pointer.unlink(missing_ok=True)
+            self._count('misses')
+            return None
+
+        self._count('hits')
+        logger.info(f"📍[AudioStore] 命中: {video_id} → {path.name}")
+        return path, entry.get('title', 'Unknown')
+
+    @contextmanager
+    def staging(self):
+        """下載用的暫存目錄（與 blobs 同一個檔案系統，換名為原子操作）；結束時刪除"""
+        staging_dir = Path(tempfile.mkdtemp(dir=self.root, prefix='.tmp-'))
+        try:
+            yield staging_dir
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+    def add(self, video_id: str, downloaded: Path, title: str, content_hash: Optional[str] = None,
+            pin: bool = False) -> Path:
+        """
+        將下載完成的檔案移入存放區並建立影片 ID 索引
+
+        Args:
+            content_hash: 已算好的內容雜湊 (例如上傳時邊接收邊計算)，None 則重新讀檔計算
+            pin: 移入前即標記為使用中，其他請求的淘汰不會刪除它（呼叫端負責 unpin）
+
+        Returns:
+            存放區中的音訊路徑
+        """
+        content_hash = content_hash or hash_file(downloaded)
+        path = self.blobs / f"{content_hash}{downloaded.suffix}"
+        if pin:
+            self.pin(path)
+        try:
+            if path.exists():
+                os.utime(path)
+                downloaded.unlink(missing_ok=True)
+                self._count('dedupes')
+                logger.info(f"📍[AudioStore] 內容相同，沿用 {path.name}")
+            else:
+                os.replace(downloaded, path)
+
+            write_json_atomic(self.ids / f"{video_id}.json", {"blob": path.name, "title": title})
+            logger.info(f"📍[AudioStore] 已存入: {video_id} → {path.name}")
+            self.evict(keep=path)
+        except BaseException:
+            if pin:
+                self.unpin(path)
+            raise
+        return path
+
+    def pin(self, path: Path):
+        """標記為使用中（推論完成前不淘汰）"""
+        with self._lock:
+            self._pins[path.name] = self._pins.get(path.name, 0) + 1
+
+    def unpin(self, path: Path):
+        with self._lock:
+            remaining = self._pins.get(path.name, 0) - 1
+            if remaining > 0:
+                self._pins[path.name] = remaining
+            else:
+                self._pins.pop(path.name, None)
+
+    @contextmanager
+    def _exclusive(self):
+        """跨 worker 的淘汰鎖"""
+        if fcntl is None:
+            yield
+            return
+        with open(self.root / '.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _entries(self):
+        """(mtime, size, path)，檔案可能同時被其他 worker 刪除"""
+        entries = []
+        for path in self.blobs.iterdir():
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def evict(self, keep: Optional[Path] = None):
+        """刪除超過保存期限的檔案，再刪除最久未使用的檔案直到總大小不超過 max_bytes"""
+        deadline = time.time() - self.ttl_seconds if self.ttl_seconds > 0 else None
+
+        expired = evicted = 0
+        with self._exclusive():
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            for mtime, size, path in entries:
+                if keep is not None and path.name == keep.name:
+                    continue
+                if deadline is not None and mtime < deadline:
+                    kind = 'expired'
+                elif total > self.max_bytes:
+                    kind = 'evicted'
+                else:
+                    continue
+                # 檢查與刪除在同一個鎖內：pin 之後確認檔案仍在的呼叫端，不會在確認後才被刪除
+                with self._lock:
+                    if path.name in self._pins:
+                        continue
+                    path.unlink(missing_ok=True)
+                if kind == 'expired':
+                    expired += 1
+                else:
+                    evicted += 1
+                total -= size
+
+        if expired or evicted:
+            self._count('expirations', expired)
+            self._count('evictions', evicted)
+            self._remove_dangling_ids()
+            logger.info(f"📍[AudioStore] 淘汰了 {evicted} 個、過期刪除 {expired} 個音訊檔")
+
+    def _remove_dangling_ids(self):
+        """刪除指向已淘汰檔案的影片 ID 索引"""
+        for pointer in self.ids.glob('*.json'):
+            try:
+                blob = loads(pointer.read_bytes())['blob']
+            except (FileNotFoundError, ValueError, KeyError):
+                continue
+            if not (self.blobs / blob).exists():
+                pointer.unlink(missing_ok=True)
+
+    def stats(self) -> Dict[str, Any]:
+        entries = self._entries()
+        with self._lock:
+            pinned = len(self._pins)
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "dedupes": self.dedupes,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "entries": len(entries),
+            "pinned": pinned,
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+        }
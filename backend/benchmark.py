@@ -0,0 +1,1005 @@
+"""
+音符後處理效能基準測試
+以合成音符資料測量各清洗階段的耗時，並與舊版實作比對輸出是否一致。
+
+用法:
+    python benchmark.py                     # 預設 1k / 10k / 100k 音符
+    python benchmark.py --sizes 1000 10000  # 自訂規模
+    python benchmark.py --check             # 額外與舊版實作做差異比對
+    python benchmark.py --model             # 比較模型冷啟動與常駐時的單任務延遲 (需安裝 basic-pitch)
+    python benchmark.py --serialization     # 比較結果序列化耗時與大小 (預設 20k 音符)
+    python benchmark.py --audio-pipeline    # 比較舊版 MP3 轉檔流程與單次解碼的耗時與磁碟寫入 (需安裝 FFmpeg)
+    python benchmark.py --threshold-sweep --audio-seconds 180  # 由快取的後驗機率重新擷取音符的耗時
+    python benchmark.py --e2e --output bench.json           # 端對端：合成鋼琴音訊 + 假轉錄器 (離線)
+    python benchmark.py --e2e --real-model --e2e-seconds 60  # 同上，另外以真正的 basic-pitch 模型跑一次
+    python benchmark.py --e2e --baseline bench.json          # 與先前的結果比對，變慢超過容許倍數時失敗
+    python benchmark.py --e2e --lead-in 20                   # 前後加上掌聲 / 靜音，量測略過的推論秒數
+    python benchmark.py --parallel 1 2 4 --audio-seconds 600 # 單首歌曲平行轉錄的延遲隨行程數的變化
+
+任何模式加上 --output 都會把結果 (含執行環境) 寫成 JSON，可提交到版本庫供 review 比對。
+"""
+
+import os
+import sys
+import json
+import math
+import wave
+import zlib
+import random
+import time
+import shutil
+import platform
+import tempfile
+import argparse
+import subprocess
+import tracemalloc
+from pathlib import Path
+from contextlib import nullcontext
+from typing import List, Dict, Any, Callable, Optional, Tuple
+
+try:
+    from backend.analyzer import (  # Docker 環境
+        NoteTable, filter_harmonics, adaptive_filter_notes, refine_notes,
+        filter_harmonics_table, adaptive_filter_table, refine_note_table,
+        analyze_audio_with_basic_pitch, reset_model, preprocess_audio_with_ffmpeg, MODEL_SAMPLE_RATE,
+        PREPROCESS_FILTER_CHAIN, events_from_posteriors, get_analysis_params, rethreshold_params,
+        override_predict, warm_up_model, get_transcribe_pool, shutdown_transcribe_pool,
+    )
+    from backend import serialization
+    from backend.note_codec import encode_notes_binary, decode_notes_binary
+    from backend.artifact_cache import ArtifactCache, PosteriorgramCache
+    from backend.note_extraction import model_frames_to_time, AUDIO_SAMPLE_RATE, FFT_HOP, MIDI_OFFSET
+    from backend.instrumentation import StageTrace, tracing, stage
+except ImportError:
+    from analyzer import (  # 本地開發
+        NoteTable, filter_harmonics, adaptive_filter_notes, refine_notes,
+        filter_harmonics_table, adaptive_filter_table, refine_note_table,
+        analyze_audio_with_basic_pitch, reset_model, preprocess_audio_with_ffmpeg, MODEL_SAMPLE_RATE,
+        PREPROCESS_FILTER_CHAIN, events_from_posteriors, get_analysis_params, rethreshold_params,
+        override_predict, warm_up_model, get_transcribe_pool, shutdown_transcribe_pool,
+    )
+    import serialization
+    from note_codec import encode_notes_binary, decode_notes_binary
+    from artifact_cache import ArtifactCache, PosteriorgramCache
+    from note_extraction import model_frames_to_time, AUDIO_SAMPLE_RATE, FFT_HOP, MIDI_OFFSET
+    from instrumentation import StageTrace, tracing, stage
+
+
+# ============================================
+# 合成資料
+# ============================================
+
+def synthetic_notes(count: int, seed: int = 0, notes_per_second: float = 20.0) -> List[Dict[str, Any]]:
+    """
+    產生類似 basic-pitch 輸出的合成音符
+
+    混合和弦（同時起音 + 泛音）、快速音群與單音旋律，
+    時間與力度都量化到與 analyzer 相同的精度。
+
+    Args:
+        count: 音符數量
+        seed: 亂數種子
+        notes_per_second: 平均音符密度
+
+    Returns:
+        音符列表 (未排序)
+    """
+    rng = random.Random(seed)
+    notes: List[Dict[str, Any]] = []
+    t = 0.0
+    while len(notes) < count:
+        kind = rng.random()
+        if kind < 0.35:
+            # 和弦：根音 + 八度/五度泛音，起音時間有少量抖動
+            root = rng.randint(28, 72)
+            members = [root] + [root + iv for iv in rng.sample([4, 7, 12, 19, 24], rng.randint(1, 4))]
+            for pitch in members:
+                notes.append(_make_note(rng, pitch, t + rng.uniform(0, 0.025)))
+            t += rng.uniform(0.2, 0.6)
+        else:
+            notes.append(_make_note(rng, rng.randint(21, 108), t))
+            t += rng.expovariate(notes_per_second)
+    rng.shuffle(notes)
+    return notes[:count]
+
+
+def _make_note(rng: random.Random, pitch: int, start: float) -> Dict[str, Any]:
+    duration = rng.uniform(0.04, 2.5)
+    return {
+        "pitch": min(108, pitch),
+        "start_time": round(start, 3),
+        "end_time": round(start + duration, 3),
+        "duration": round(duration, 3),
+        "velocity": rng.randint(1, 127),
+    }
+
+
+def synthetic_boundary_notes(count: int, min_gap: float, seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    同音高連續音符的間隔集中在 min_gap 附近 (±2ms，多數剛好等於 min_gap) 的合成音符
+
+    時間量化到毫秒，用來檢查 refine_note_table 在合併邊界上與逐一比較的舊版一致；
+    synthetic_notes 的時間是連續分佈，幾乎不會剛好落在邊界上。
+    """
+    rng = random.Random(seed)
+    notes: List[Dict[str, Any]] = []
+    pitches = list(range(36, 84))
+    clock = {pitch: rng.randint(0, 2000) / 1000 for pitch in pitches}
+    while len(notes) < count:
+        pitch = rng.choice(pitches)
+        start = clock[pitch]
+        duration = rng.randint(40, 1500) / 1000
+        notes.append({
+            "pitch": pitch,
+            "start_time": start,
+            "end_time": round(start + duration, 3),
+            "duration": duration,
+            "velocity": rng.randint(1, 127),
+        })
+        offset = rng.choice([-0.002, -0.001, 0.0, 0.0, 0.0, 0.0, 0.001, 0.002, -0.5, 0.4])
+        clock[pitch] = max(start, round(start + duration + min_gap + offset, 3))
+    rng.shuffle(notes)
+    return notes
+
+
+def synthetic_wav(path: Path, seconds: float, sample_rate: int = 22050, seed: int = 0) -> Path:
+    """產生簡單的合成鋼琴音訊（衰減正弦波，每 0.25 秒一個音）"""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    total = int(seconds * sample_rate)
+    audio = np.zeros(total, dtype=np.float64)
+    note_len = int(1.0 * sample_rate)
+    t = np.arange(note_len) / sample_rate
+    envelope = np.exp(-3.0 * t)
+    for onset in range(0, total, int(0.25 * sample_rate)):
+        freq = 440.0 * 2 ** ((rng.integers(40, 80) - 69) / 12)
+        segment = np.sin(2 * np.pi * freq * t) * envelope
+        end = min(total, onset + note_len)
+        audio[onset:end] += segment[:end - onset]
+    audio /= max(1.0, np.abs(audio).max())
+    with wave.open(str(path), 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes((audio * 32767 * 0.8).astype('<i2').tobytes())
+    return path
+
+
+# 合成鋼琴音訊的織體，每 PIANO_TEXTURE_SECONDS 秒輪替一次
+PIANO_TEXTURES = ('chords', 'runs', 'pedal')
+PIANO_TEXTURE_SECONDS = 8.0
+MAJOR_SCALE_STEPS = (2, 2, 1, 2, 2, 2, 1)
+
+
+def piano_score(seconds: float, seed: int = 0) -> List[Tuple[float, int, float, float]]:
+    """
+    合成鋼琴音訊的樂譜
+
+    - chords: 每 0.5 秒一個 3-5 音的柱式和弦
+    - runs: 每秒 12 個音的快速大調音階，到音域邊界折返
+    - pedal: 踩住延音踏板的琶音，每個音延續 3 秒並彼此重疊
+
+    Returns:
+        [(起音秒數, MIDI 音高, 力度 0-1, 延續秒數)]
+    """
+    rng = random.Random(seed)
+    score = []
+    section = 0
+    section_start = 0.0
+    while section_start < seconds:
+        texture = PIANO_TEXTURES[section % len(PIANO_TEXTURES)]
+        section_end = min(seconds, section_start + PIANO_TEXTURE_SECONDS)
+        t = section_start
+        if texture == 'chords':
+            while t < section_end:
+                root = rng.randint(36, 72)
+                for interval in (0, 4, 7, 12, 16)[:rng.randint(3, 5)]:
+                    score.append((t, root + interval, rng.uniform(0.3, 0.8), 1.0))
+                t += 0.5
+        elif texture == 'runs':
+            pitch, direction, degree = rng.randint(48, 72), 1, 0
+            while t < section_end:
+                score.append((t, pitch, rng.uniform(0.2, 0.6), 0.3))
+                step = MAJOR_SCALE_STEPS[degree % 7] if direction > 0 else MAJOR_SCALE_STEPS[(degree - 1) % 7]
+                pitch += direction * step
+                degree += direction
+                if not 40 <= pitch <= 96:
+                    direction = -direction
+                t += 1 / 12
+        else:
+            arpeggio = (0, 7, 12, 16, 19, 24)
+            root = rng.randint(36, 60)
+            count = 0
+            while t < section_end:
+                score.append((t, root + arpeggio[count % len(arpeggio)], rng.uniform(0.2, 0.6), 3.0))
+                count += 1
+                if count % 12 == 0:
+                    root = rng.randint(36, 60)
+                t += 0.25
+        section += 1
+        section_start = section_end
+    return score
+
+
+def synthetic_piano_wav(path: Path, seconds: float, sample_rate: int = 22050, seed: int = 0,
+                        lead_in: float = 0.0) -> Path:
+    """
+    依 piano_score 合成接近鋼琴的音訊
+
+    每個音為 4 個帶輕微非諧和性 (inharmonicity) 的泛音，高次泛音衰減較快，
+    衰減時間隨延續長度 (踏板) 拉長。
+    lead_in > 0 時，樂曲前面加上 lead_in 秒的掌聲 (白噪音) 與靜音各半，後面再加 lead_in 秒的靜音
+    (總長度為 seconds + 2 * lead_in)。
+    """
+    import numpy as np
+
+    offset = int(lead_in * sample_rate)
+    total = int(seconds * sample_rate) + 2 * offset
+    audio = np.zeros(total, dtype=np.float32)
+    for onset, pitch, velocity, sustain in piano_score(seconds, seed):
+        start = offset + int(onset * sample_rate)
+        length = min(int(sustain * sample_rate), total - start)
+        if length <= 0:
+            continue
+        t = np.arange(length, dtype=np.float32) / sample_rate
+        f0 = 440.0 * 2 ** ((pitch - 69) / 12)
+        tone = np.zeros(length, dtype=np.float32)
+        for k in range(1, 5):
+            partial = k * f0 * math.sqrt(1 + 1e-4 * k * k)
+            if partial >= sample_rate / 2:
+                break
+            tone += np.sin(2 * np.pi * partial * t) * np.exp(-(2.0 + k) * t / sustain) / k
+        audio[start:start + length] += velocity * tone
+    if offset:
+        applause = np.random.default_rng(seed).standard_normal(offset // 2).astype(np.float32)
+        audio[:offset // 2] = 0.3 * applause
+    audio /= max(1.0, float(np.abs(audio).max()))
+    with wave.open(str(path), 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes((audio * 32767 * 0.8).astype('<i2').tobytes())
+    return path
+
+
+class StubTranscriber:
+    """
+    取代 basic-pitch predict 的假轉錄器 (搭配 analyzer.override_predict)
+
+    不執行模型，依輸入音訊的長度產生 notes_per_second 密度的 note_events：
+    約 30% 的音符帶一個較弱、同時起音的八度/十二度泛音 (泛音過濾)，
+    約 10% 的音符在中間被短暫切斷 (碎音合併)。
+    同時輸出對應的 onset/frame 後驗機率，後驗機率快取的寫入也會被量測。
+    同一個檔名與種子產生相同的結果。
+    model_cost > 0 時每秒音訊以忙碌迴圈佔用 model_cost 秒 CPU，模擬模型的計算量 (量測平行推論的擴展性)。
+    """
+
+    def __init__(self, notes_per_second: float = 20.0, seed: int = 0, model_cost: float = 0.0):
+        self.notes_per_second = notes_per_second
+        self.seed = seed
+        self.model_cost = model_cost
+
+    def __call__(self, audio_path, model_or_model_path=None, onset_threshold: float = 0.5,
+                 frame_threshold: float = 0.3, minimum_note_length: float = 127.7, **kwargs):
+        import numpy as np
+
+        with wave.open(str(audio_path), 'rb') as wav:
+            duration = wav.getnframes() / wav.getframerate()
+        rng = np.random.default_rng([self.seed, zlib.crc32(Path(audio_path).name.encode())])
+        deadline = time.process_time() + self.model_cost * duration
+        while time.process_time() < deadline:
+            pass
+
+        count = int(rng.poisson(self.notes_per_second * duration))
+        starts = rng.uniform(0, duration, count)
+        ends = np.minimum(duration, starts + np.clip(rng.exponential(0.4, count), 0.03, 4.0))
+        pitches = rng.integers(21, 97, count)
+        amplitudes = rng.uniform(0.15, 0.9, count)
+
+        events = []
+        for start, end, pitch, amplitude, kind in zip(starts, ends, pitches, amplitudes, rng.random(count)):
+            start, end, pitch, amplitude = float(start), float(end), int(pitch), float(amplitude)
+            if kind < 0.1 and end - start > 0.2:
+                cut = (start + end) / 2
+                events.append((start, cut - 0.01, pitch, amplitude, []))
+                events.append((cut + 0.01, end, pitch, amplitude, []))
+            else:
+                events.append((start, end, pitch, amplitude, []))
+            if kind > 0.7:
+                overtone = pitch + (12 if kind > 0.85 else 19)
+                if overtone <= 108:
+                    events.append((start, end, overtone, amplitude * 0.4, []))
+
+        return self._posteriors(events, duration), None, events
+
+    @staticmethod
+    def _posteriors(events: List[Tuple], duration: float) -> Dict[str, Any]:
+        """把 note_events 畫成模型輸出格式的 onset/frame 機率 (幀數, 88)"""
+        import numpy as np
+
+        n_frames = int(duration * AUDIO_SAMPLE_RATE / FFT_HOP) + 1
+        frames = np.zeros((n_frames, 88), dtype=np.float32)
+        onsets = np.zeros((n_frames, 88), dtype=np.float32)
+        frame_rate = AUDIO_SAMPLE_RATE / FFT_HOP
+        for start, end, pitch, amplitude, _ in events:
+            first, last = int(start * frame_rate), int(end * frame_rate)
+            column = pitch - MIDI_OFFSET
+            np.maximum(frames[first:last + 1, column], amplitude, out=frames[first:last + 1, column])
+            onsets[first, column] = max(onsets[first, column], amplitude)
+        return {"note": frames, "onset": onsets}
+
+
+# ============================================
+# 舊版參考實作 (O(n²))，僅供差異比對
+# ============================================
+
+def synthetic_posteriorgram(seconds: float, seed: int = 0):
+    """
+    產生類似 basic-pitch 輸出的 onset/frame 後驗機率 (幀數, 88)：
+    隨機音符為起音後指數衰減的 frame 機率，加上零星雜訊
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    n_frames = int(seconds * AUDIO_SAMPLE_RATE / FFT_HOP)
+    frames = np.zeros((n_frames, 88), dtype=np.float32)
+    onsets = np.zeros((n_frames, 88), dtype=np.float32)
+    for _ in range(n_frames // 8):
+        pitch, start = rng.integers(0, 88), rng.integers(0, n_frames)
+        length = min(int(rng.integers(3, 200)), n_frames - start)
+        decay = rng.uniform(0.2, 0.95) * np.exp(-np.arange(length) / (length * 2))
+        frames[start:start + length, pitch] = np.maximum(frames[start:start + length, pitch], decay)
+        onsets[start, pitch] = max(onsets[start, pitch], rng.uniform(0.1, 0.9))
+    noise = rng.uniform(0, 1, frames.shape) < 0.05
+    frames[noise] += rng.uniform(0, 0.3, int(noise.sum())).astype(np.float32)
+    return onsets, frames
+
+
+def reference_filter_harmonics(notes: List[Dict[str, Any]], harmonic_threshold: float = 0.4) -> List[Dict[str, Any]]:
+    if not notes:
+        return []
+    TIME_TOLERANCE = 0.02
+    sorted_notes = sorted(notes, key=lambda x: x['start_time'])
+    to_remove = set()
+    for i, note in enumerate(sorted_notes):
+        for j, other in enumerate(sorted_notes):
+            if i == j or j in to_remove:
+                continue
+            if abs(other['start_time'] - note['start_time']) > TIME_TOLERANCE:
+                continue
+            if other['pitch'] - note['pitch'] in [12, 24, 7, 19]:
+                if other['velocity'] / max(note['velocity'], 1) < harmonic_threshold:
+                    to_remove.add(j)
+    return [note for i, note in enumerate(sorted_notes) if i not in to_remove]
+
+
+def reference_adaptive_filter_notes(notes: List[Dict[str, Any]], window_size: float = 0.1,
+                                    chord_threshold: int = 4) -> List[Dict[str, Any]]:
+    if not notes:
+        return []
+    sorted_notes = sorted(notes, key=lambda x: x['start_time'])
+    result = []
+    i = 0
+    while i < len(sorted_notes):
+        window_end = sorted_notes[i]['start_time'] + window_size
+        window_notes = []
+        j = i
+        while j < len(sorted_notes) and sorted_notes[j]['start_time'] < window_end:
+            window_notes.append(sorted_notes[j])
+            j += 1
+        if len(window_notes) >= chord_threshold:
+            local_min_velocity = 8
+        elif len(window_notes) >= 2:
+            local_min_velocity = 12
+        else:
+            local_min_velocity = 18
+        for note in window_notes:
+            if note['velocity'] >= local_min_velocity and note not in result:
+                result.append(note)
+        i = j if j > i else i + 1
+    return result
+
+
+def reference_refine_notes(raw_notes: List[Dict[str, Any]], min_gap: float = 0.05,
+                           max_duration: float = 3.0) -> List[Dict[str, Any]]:
+    if not raw_notes:
+        return []
+    notes_by_pitch: Dict[int, List[Dict]] = {}
+    for note in raw_notes:
+        notes_by_pitch.setdefault(note['pitch'], []).append(note)
+    refined = []
+    for pitch_group in notes_by_pitch.values():
+        pitch_group.sort(key=lambda x: x['start_time'])
+        current = pitch_group[0].copy()
+        for next_note in pitch_group[1:]:
+            current_end = current['start_time'] + current['duration']
+            if next_note['start_time'] - current_end < min_gap:
+                next_end = next_note['start_time'] + next_note['duration']
+                current['duration'] = round(max(current_end, next_end) - current['start_time'], 3)
+                current['velocity'] = max(current['velocity'], next_note['velocity'])
+            else:
+                refined.append(current)
+                current = next_note.copy()
+        refined.append(current)
+    for note in refined:
+        note['duration'] = min(note['duration'], max_duration)
+        # 舊版沿用片段第一個音符的 end_time；新版改為與 duration 一致，比較時以此為準
+        note['end_time'] = round(note['start_time'] + note['duration'], 3)
+        v = max(0, min(127, note['velocity'])) / 127.0
+        v_mapped = (math.tanh((v - 0.5) * 3) + 1) / 2 * 0.7 + v * 0.3
+        note['velocity'] = max(1, min(127, int(v_mapped * 127)))
+    refined.sort(key=lambda x: x['start_time'])
+    return refined
+
+
+def reference_pipeline(notes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    notes = reference_adaptive_filter_notes(notes, window_size=0.1, chord_threshold=4)
+    notes = reference_filter_harmonics(notes, harmonic_threshold=0.35)
+    return reference_refine_notes(notes, min_gap=0.03)
+
+
+def table_pipeline(notes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    table = NoteTable.from_dicts(notes)
+    table = adaptive_filter_table(table, window_size=0.1, chord_threshold=4)
+    table = filter_harmonics_table(table, harmonic_threshold=0.35)
+    return refine_note_table(table, min_gap=0.03).to_dicts()
+
+
+def dict_bytes_per_note(notes: List[Dict[str, Any]]) -> float:
+    """dict 音符的平均記憶體用量（含 key 以外的數值物件）"""
+    if not notes:
+        return 0.0
+    total = sum(sys.getsizeof(n) + sum(sys.getsizeof(v) for v in n.values()) for n in notes)
+    return total / len(notes)
+
+
+# ============================================
+# 測量
+# ============================================
+
+STAGES: Dict[str, Dict[str, Callable]] = {
+    "adaptive_filter_notes": {
+        "current": lambda notes: adaptive_filter_notes(notes, window_size=0.1, chord_threshold=4),
+        "reference": lambda notes: reference_adaptive_filter_notes(notes, window_size=0.1, chord_threshold=4),
+    },
+    "filter_harmonics": {
+        "current": lambda notes: filter_harmonics(notes, harmonic_threshold=0.35),
+        "reference": lambda notes: reference_filter_harmonics(notes, harmonic_threshold=0.35),
+    },
+    "refine_notes": {
+        "current": lambda notes: refine_notes(notes, min_gap=0.03),
+        "reference": lambda notes: reference_refine_notes(notes, min_gap=0.03),
+    },
+    "pipeline": {
+        "current": table_pipeline,
+        "reference": reference_pipeline,
+    },
+}
+
+# 參考實作為 O(n²)，超過此規模不做比對
+REFERENCE_MAX_NOTES = 5000
+
+
+def time_call(fn: Callable, *args, repeat: int = 3) -> float:
+    """回傳多次執行中最短的耗時(秒)"""
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def run(sizes: List[int], check: bool = False, seed: int = 0) -> List[Dict[str, Any]]:
+    rows = []
+    for size in sizes:
+        notes = synthetic_notes(size, seed=seed)
+        table = NoteTable.from_dicts(notes)
+        print(f"[memory] n={size:>7}  dict {dict_bytes_per_note(notes):.0f} B/note"
+              f"  NoteTable {table.nbytes / max(size, 1):.0f} B/note")
+        for name, impls in STAGES.items():
+            elapsed = time_call(impls["current"], notes)
+            row = {
+                "stage": name,
+                "notes": size,
+                "seconds": round(elapsed, 4),
+                "notes_per_second": round(size / elapsed) if elapsed > 0 else None,
+            }
+            line = f"[{name}] n={size:>7}  {elapsed * 1000:9.2f} ms"
+            if check and size <= REFERENCE_MAX_NOTES:
+                row["reference_seconds"] = round(time_call(impls["reference"], notes, repeat=1), 4)
+                row["identical"] = impls["current"](notes) == impls["reference"](notes)
+                line += f"  (舊版 {row['reference_seconds'] * 1000:.2f} ms)  identical={row['identical']}"
+            rows.append(row)
+            print(line)
+        if check and size <= REFERENCE_MAX_NOTES:
+            # 間隔剛好落在 min_gap 邊界上的毫秒量化輸入
+            for min_gap in (0.03, 0.05):
+                boundary = synthetic_boundary_notes(size, min_gap, seed=seed)
+                identical = refine_notes(boundary, min_gap=min_gap) == reference_refine_notes(boundary, min_gap=min_gap)
+                rows.append({"stage": "refine_notes_boundary", "notes": size, "min_gap": min_gap,
+                             "identical": identical})
+                print(f"[refine_notes_boundary] n={size:>7}  min_gap={min_gap}  identical={identical}")
+    return rows
+
+
+def run_model_latency(seconds: float = 30.0, jobs: int = 3) -> List[Dict[str, Any]]:
+    """
+    比較單一任務延遲：每次重新載入模型 (冷) vs. 行程內常駐模型 (熱)
+    """
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_dir = Path(tmp)
+        audio = synthetic_wav(tmp_dir / "synthetic.wav", seconds)
+        for mode in ("cold", "warm"):
+            for i in range(jobs):
+                if mode == "cold":
+                    reset_model()
+                t0 = time.perf_counter()
+                analyze_audio_with_basic_pitch(audio, tmp_dir, enable_preprocessing=False)
+                elapsed = time.perf_counter() - t0
+                rows.append({"stage": f"model_{mode}", "audio_seconds": seconds, "seconds": round(elapsed, 3)})
+                print(f"[model_{mode}] job {i + 1}/{jobs}  audio={seconds:.0f}s  {elapsed:.2f} s")
+    return rows
+
+
+def reference_round_trip(result: Dict[str, Any], path: Path):
+    """舊版流程：縮排寫檔 → 讀回 → 補標題後再縮排寫檔一次"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    with open(path, 'r', encoding='utf-8') as f:
+        loaded = json.load(f)
+    loaded['metadata']['title'] = "benchmark"
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(loaded, f, ensure_ascii=False, indent=2)
+
+
+def run_serialization(count: int = 20000, seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    比較分析結果的序列化耗時與輸出大小
+
+    音符取自完整的 table 流程（含合併與截斷過的音符），並檢查二進位格式
+    解碼後與 JSON 音符在毫秒精度下一致（identical）。
+    """
+    notes = table_pipeline(synthetic_notes(count, seed=seed))
+    result = {
+        "metadata": {"title": "benchmark", "note_count": len(notes), "total_duration": notes[-1]["end_time"]},
+        "notes": notes,
+    }
+    encoders = {
+        "json_indent_round_trip": None,
+        "json_compact": lambda obj: json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8'),
+        "binary": encode_notes_binary,
+    }
+    if serialization.orjson is not None:
+        encoders["orjson"] = serialization.orjson.dumps
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "notes.json"
+        for name, encode in encoders.items():
+            if encode is None:
+                elapsed = time_call(reference_round_trip, result, path)
+                size = path.stat().st_size
+            else:
+                elapsed = time_call(lambda: path.write_bytes(encode(result)))
+                size = path.stat().st_size
+            rows.append({"stage": f"serialize_{name}", "notes": count, "seconds": round(elapsed, 4), "bytes": size})
+            print(f"[serialize] {name:<24} n={count}  {elapsed * 1000:8.2f} ms  {size / 1024:8.1f} KiB")
+
+    # 二進位往返：前端依 start_time + duration 播放，兩者都須與 JSON 相符
+    def quantize(ns):
+        return sorted((n["pitch"], round(n["start_time"] * 1000), round(n["duration"] * 1000), n["velocity"]) for n in ns)
+    decoded = decode_notes_binary(encode_notes_binary(result))
+    identical = quantize(decoded["notes"]) == quantize(notes)
+    rows.append({"stage": "binary_round_trip", "notes": len(notes), "identical": identical})
+    print(f"[serialize] binary_round_trip          n={len(notes)}  identical={identical}")
+    return rows
+
+
+def _ffmpeg(*args: str):
+    import subprocess
+    subprocess.run(['ffmpeg', '-y', '-v', 'error', *args], check=True, capture_output=True)
+
+
+def run_audio_pipeline(seconds: float = 180.0) -> List[Dict[str, Any]]:
+    """
+    比較音訊前處理流程的耗時與磁碟寫入量
+
+    - legacy: 原始串流 → 320kbps MP3 → 濾波 44.1kHz WAV → basic-pitch 重新取樣至 22.05kHz
+      (最後一步以 FFmpeg 輸出到管線近似 librosa 的重新取樣)
+    - single_pass: 原始串流 → 濾波並直接輸出 22.05kHz WAV
+    """
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_dir = Path(tmp)
+        # 模擬 YouTube 的原始音訊串流 (opus)
+        source = synthetic_wav(tmp_dir / "source.wav", seconds, sample_rate=48000)
+        native = tmp_dir / "native.webm"
+        _ffmpeg('-i', str(source), '-c:a', 'libopus', '-b:a', '128k', str(native))
+
+        legacy_dir = tmp_dir / "legacy"
+        legacy_dir.mkdir()
+        t0 = time.perf_counter()
+        mp3 = legacy_dir / "audio.mp3"
+        _ffmpeg('-i', str(native), '-c:a', 'libmp3lame', '-b:a', '320k', str(mp3))
+        wav44 = legacy_dir / "audio_processed.wav"
+        _ffmpeg('-i', str(mp3), '-af', PREPROCESS_FILTER_CHAIN, '-ar', '44100', '-ac', '1', str(wav44))
+        _ffmpeg('-i', str(wav44), '-ar', str(MODEL_SAMPLE_RATE), '-f', 's16le', '-')
+        legacy_seconds = time.perf_counter() - t0
+        legacy_bytes = sum(path.stat().st_size for path in legacy_dir.iterdir())
+
+        single_dir = tmp_dir / "single"
+        single_dir.mkdir()
+        t0 = time.perf_counter()
+        preprocess_audio_with_ffmpeg(native, single_dir)
+        single_seconds = time.perf_counter() - t0
+        single_bytes = sum(path.stat().st_size for path in single_dir.iterdir())
+
+        for name, elapsed, written in (("legacy", legacy_seconds, legacy_bytes),
+                                       ("single_pass", single_seconds, single_bytes)):
+            rows.append({"stage": f"audio_{name}", "audio_seconds": seconds,
+                         "seconds": round(elapsed, 3), "bytes_written": written})
+            print(f"[audio_{name}] audio={seconds:.0f}s  {elapsed:.2f} s  寫入 {written / 1024 / 1024:.1f} MiB")
+    return rows
+
+
+def run_threshold_sweep(seconds: float = 180.0, seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    由快取的後驗機率 (float16 memmap) 以不同門檻重新擷取音符
+
+    每個門檻組合都是完整的一次 note_events 擷取，不含模型推論。
+    """
+    onsets, frames = synthetic_posteriorgram(seconds, seed=seed)
+    base = get_analysis_params(True)
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = PosteriorgramCache(Path(tmp), 1 << 40)
+        writer = cache.writer("benchmark", base)
+        writer.append(model_frames_to_time(len(frames)), onsets, frames)
+        writer.commit()
+        posteriors = cache.get("benchmark", base)
+
+        for onset_threshold in (0.3, 0.4, 0.5, 0.6):
+            for frame_threshold in (0.2, 0.25, 0.3):
+                params = rethreshold_params(base, onset_threshold=onset_threshold, frame_threshold=frame_threshold)
+                t0 = time.perf_counter()
+                events = events_from_posteriors(posteriors, params)
+                elapsed = time.perf_counter() - t0
+                rows.append({"stage": "rethreshold", "audio_seconds": seconds, "onset_threshold": onset_threshold,
+                             "frame_threshold": frame_threshold, "events": len(events), "seconds": round(elapsed, 4)})
+                print(f"[rethreshold] audio={seconds:.0f}s onset={onset_threshold:.2f} frame={frame_threshold:.2f}  "
+                      f"{len(events):6d} 個音符  {elapsed * 1000:8.1f} ms")
+    return rows
+
+
+def _run_e2e_case(audio: Path, seconds: float, transcriber: str, density: Optional[float], repeat: int,
+                  seed: int, work_dir: Path) -> List[Dict[str, Any]]:
+    """
+    以 analyze_audio_with_basic_pitch 跑完整流程 repeat 次 (每次快取都未命中)，各階段取最短耗時；
+    最後再以 tracemalloc 跑一次記錄各階段的峰值配置量 (該次不計時)
+    """
+    predictor = override_predict(StubTranscriber(density, seed)) if transcriber == "stub" else nullcontext()
+    best: Dict[str, Dict[str, Any]] = {}
+    walls = []
+    peak_rss = None
+    with predictor:
+        for i in range(repeat + 1):
+            memory = i == repeat
+            run_dir = Path(tempfile.mkdtemp(dir=work_dir))
+            trace = StageTrace(memory=memory)
+            if memory:
+                tracemalloc.start()
+            try:
+                t0 = time.perf_counter()
+                with tracing(trace):
+                    result = analyze_audio_with_basic_pitch(
+                        audio, run_dir,
+                        artifact_cache=ArtifactCache(run_dir / "artifacts", 1 << 40),
+                        posterior_cache=PosteriorgramCache(run_dir / "posteriors", 1 << 40)
+                    )
+                    with stage("serialize", notes_in=len(result["notes"])) as span:
+                        body = serialization.dumps(result)
+                        span.notes_out = len(result["notes"])
+                wall = time.perf_counter() - t0
+            finally:
+                if memory:
+                    tracemalloc.stop()
+                shutil.rmtree(run_dir, ignore_errors=True)
+
+            instrumentation = result["metadata"]["instrumentation"]
+            peak_rss = instrumentation.get("peak_rss_bytes")
+            stages = {**instrumentation["stages"], **trace.stages}  # 分析各階段 + serialize
+            for name, entry in stages.items():
+                current = best.setdefault(name, dict(entry))
+                if memory:
+                    current["peak_alloc_bytes"] = entry.get("peak_alloc_bytes")
+                elif entry["seconds"] < current["seconds"]:
+                    current.update(entry)
+            if not memory:
+                walls.append(wall)
+
+    rows = []
+    case = {"suite": "e2e", "transcriber": transcriber, "density": density, "audio_seconds": seconds}
+    for name, entry in best.items():
+        notes = entry.get("notes_in", entry.get("notes_out"))
+        rows.append({
+            **case,
+            "stage": name,
+            "seconds": round(entry["seconds"], 4),
+            "calls": entry["calls"],
+            "notes_in": entry.get("notes_in"),
+            "notes_out": entry.get("notes_out"),
+            "notes_per_second": round(notes / entry["seconds"]) if notes and entry["seconds"] > 0 else None,
+            "realtime_factor": round(entry["seconds"] / seconds, 5),
+            "peak_alloc_bytes": entry.get("peak_alloc_bytes"),
+        })
+        if name == "serialize":
+            rows[-1]["bytes"] = len(body)
+    wall = min(walls)
+    rows.append({
+        **case,
+        "stage": "total",
+        "seconds": round(wall, 4),
+        "realtime_factor": round(wall / seconds, 5),
+        "audio_seconds_per_second": round(seconds / wall, 1),
+        "final_notes": len(result["notes"]),
+        "peak_rss_bytes": peak_rss,
+        "inference_seconds_saved": result["metadata"]["statistics"]["inference_seconds_saved"],
+    })
+
+    label = f"{transcriber}" + (f" {density:g} notes/s" if density is not None else "")
+    print(f"[e2e] audio={seconds:.0f}s  {label}  {wall:.2f} s ({seconds / wall:.0f}x 即時)  "
+          f"{len(result['notes'])} 個音符  峰值 RSS {(peak_rss or 0) / 1024 / 1024:.0f} MiB  "
+          f"略過推論 {rows[-1]['inference_seconds_saved']:.1f}s")
+    for row in rows[:-1]:
+        notes = f"{row['notes_in'] or '':>7} → {row['notes_out'] or '':<7}" if row["notes_out"] is not None else " " * 17
+        alloc = f"{row['peak_alloc_bytes'] / 1024 / 1024:8.2f} MiB" if row["peak_alloc_bytes"] is not None else ""
+        print(f"    {row['stage']:<16} {row['seconds'] * 1000:9.2f} ms  {notes}  {alloc}")
+    return rows
+
+
+def run_end_to_end(seconds_list: List[float], densities: List[float], real_model: bool = False,
+                   repeat: int = 3, seed: int = 0, lead_in: float = 0.0) -> List[Dict[str, Any]]:
+    """
+    端對端基準測試：合成鋼琴音訊 → analyze_audio_with_basic_pitch (含預處理、分段、快取寫入) → 序列化
+
+    預設以 StubTranscriber 取代模型，完全離線、不需要 basic-pitch/TensorFlow；
+    real_model 時另外以真正的模型跑一次 (先暖機，不計入模型載入時間)。
+    未安裝 FFmpeg 時預處理會被跳過 (與正式環境的流程不同)。
+    lead_in 為前後加上的掌聲 / 靜音秒數 (量測略過非樂音片段省下的推論時間)。
+    """
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        work_dir = Path(tmp)
+        cases: List[Tuple[str, Optional[float]]] = [("stub", density) for density in densities]
+        if real_model:
+            warm_up_model()
+            cases.append(("basic-pitch", None))
+        for seconds in seconds_list:
+            audio = synthetic_piano_wav(work_dir / f"piano_{seconds:g}s.wav", seconds, seed=seed, lead_in=lead_in)
+            for transcriber, density in cases:
+                rows.extend(_run_e2e_case(audio, seconds + 2 * lead_in, transcriber, density, repeat, seed, work_dir))
+    return rows
+
+
+def note_match_rate(notes: List[Dict[str, Any]], reference: List[Dict[str, Any]], tolerance: float = 0.05) -> float:
+    """notes 中能在 reference 找到同音高、起音相差不超過 tolerance 秒的音符比例"""
+    import numpy as np
+
+    if not notes:
+        return 1.0 if not reference else 0.0
+    by_pitch: Dict[int, np.ndarray] = {}
+    for note in reference:
+        by_pitch.setdefault(note["pitch"], []).append(note["start_time"])
+    by_pitch = {pitch: np.sort(starts) for pitch, starts in by_pitch.items()}
+    matched = 0
+    for note in notes:
+        starts = by_pitch.get(note["pitch"])
+        if starts is None:
+            continue
+        i = np.searchsorted(starts, note["start_time"])
+        nearest = [abs(starts[j] - note["start_time"]) for j in (i - 1, i) if 0 <= j < len(starts)]
+        matched += min(nearest) <= tolerance
+    return matched / len(notes)
+
+
+def run_parallel_scaling(seconds: float, workers_list: List[int], real_model: bool = False,
+                         model_cost: float = 0.05, seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    單首歌曲平行轉錄的延遲擴展性：同一首合成鋼琴曲以不同行程數分析，各量一次 (行程池先以同樣的行程數暖機)
+
+    以 StubTranscriber 模擬每秒音訊 model_cost 秒的模型計算；real_model 時改用 basic-pitch，
+    並與第一個行程數的結果比對音符 (同音高、起音相差 50ms 內)。
+    """
+    rows = []
+    baseline_wall = None
+    reference = None
+    with tempfile.TemporaryDirectory() as tmp:
+        work_dir = Path(tmp)
+        audio = synthetic_piano_wav(work_dir / f"piano_{seconds:g}s.wav", seconds, seed=seed)
+        transcriber = "basic-pitch" if real_model else "stub"
+        predictor = nullcontext() if real_model else override_predict(StubTranscriber(20.0, seed, model_cost))
+        with predictor:
+            for workers in workers_list:
+                run_dir = Path(tempfile.mkdtemp(dir=work_dir))
+                if workers > 1:
+                    get_transcribe_pool(workers)
+                    analyze_audio_with_basic_pitch(audio, run_dir, parallel_workers=workers)
+                elif real_model:
+                    warm_up_model()
+                t0 = time.perf_counter()
+                result = analyze_audio_with_basic_pitch(audio, run_dir, parallel_workers=workers)
+                wall = time.perf_counter() - t0
+                baseline_wall = baseline_wall or wall
+                row = {
+                    "suite": "parallel", "transcriber": transcriber, "audio_seconds": seconds, "workers": workers,
+                    "stage": "total", "seconds": round(wall, 4), "speedup": round(baseline_wall / wall, 2),
+                    "inference_chunks": result["metadata"]["statistics"]["inference_chunks"],
+                    "final_notes": len(result["notes"]),
+                }
+                line = (f"[parallel] audio={seconds:.0f}s  {transcriber}  workers={workers}  {wall:.2f} s  "
+                        f"x{row['speedup']:.2f}  {row['inference_chunks']} 段  {row['final_notes']} 個音符")
+                if real_model:
+                    if reference is None:
+                        reference = result["notes"]
+                    row["match_rate"] = round(note_match_rate(result["notes"], reference), 4)
+                    line += f"  符合率 {row['match_rate']:.1%}"
+                rows.append(row)
+                print(line)
+            rows.extend(check_parallel_chunking(work_dir, workers_list, transcriber, seed=seed,
+                                                audio_seconds=(PARALLEL_SHORT_AUDIO_SECONDS, seconds)))
+        shutdown_transcribe_pool()
+    return rows
+
+
+# 平行轉錄的設定組合檢查用的短音訊：短於 2 * MIN_PARALLEL_SEGMENT_SECONDS，不會平行，改走單行程路徑
+PARALLEL_SHORT_AUDIO_SECONDS = 20.0
+
+
+def check_parallel_chunking(work_dir: Path, workers_list: List[int], transcriber: str, seed: int = 0,
+                            audio_seconds: Tuple[float, ...] = (PARALLEL_SHORT_AUDIO_SECONDS,)) -> List[Dict[str, Any]]:
+    """
+    以 chunk_seconds=None (一律整段推論) 搭配各行程數分析，確認每種組合都能完成 (ok)
+
+    音訊短到不平行時會退回單行程路徑，該路徑不可假設 chunk_seconds 有值。
+    """
+    rows = []
+    for seconds in audio_seconds:
+        audio = synthetic_piano_wav(work_dir / f"piano_{seconds:g}s.wav", seconds, seed=seed)
+        for workers in workers_list:
+            run_dir = Path(tempfile.mkdtemp(dir=work_dir))
+            row = {"suite": "parallel", "transcriber": transcriber, "audio_seconds": seconds, "workers": workers,
+                   "stage": "chunk_seconds_none"}
+            try:
+                result = analyze_audio_with_basic_pitch(audio, run_dir, chunk_seconds=None, parallel_workers=workers)
+                row.update(ok=True, inference_chunks=result["metadata"]["statistics"]["inference_chunks"])
+            except Exception as e:
+                row.update(ok=False, error=str(e))
+            rows.append(row)
+            print(f"[parallel] audio={seconds:.0f}s  chunk_seconds=None  workers={workers}  ok={row['ok']}"
+                  + (f"  {row['inference_chunks']} 段" if row['ok'] else f"  {row['error']}"))
+    return rows
+
+
+# ============================================
+# 結果檔與基線比對
+# ============================================
+
+# 識別同一個量測項目的欄位 (其餘為量測值)
+ROW_KEY_FIELDS = ("suite", "transcriber", "density", "audio_seconds", "workers", "notes", "stage",
+                  "onset_threshold", "frame_threshold")
+# 低於此耗時的項目不做基線比對 (計時雜訊)
+BASELINE_MIN_SECONDS = 0.002
+
+
+def row_key(row: Dict[str, Any]) -> Tuple:
+    return tuple(row.get(field) for field in ROW_KEY_FIELDS)
+
+
+def environment() -> Dict[str, Any]:
+    """執行環境 (比對不同機器上的結果時參考)"""
+    import numpy as np
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=Path(__file__).parent, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.TimeoutExpired):
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "orjson": serialization.orjson is not None,
+        "ffmpeg": shutil.which("ffmpeg") is not None,
+        "commit": commit,
+    }
+
+
+def write_report(path: Path, rows: List[Dict[str, Any]], argv: List[str]):
+    """結果寫成 JSON (縮排、固定順序，方便在 review 中比對差異)"""
+    report = {"environment": environment(), "argv": argv, "rows": rows}
+    Path(path).write_text(json.dumps(report, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+    print(f"📍[Benchmark] 結果已寫入 {path} ({len(rows)} 項)")
+
+
+def compare_with_baseline(rows: List[Dict[str, Any]], baseline_path: Path, tolerance: float) -> List[str]:
+    """
+    與基線結果比對耗時
+
+    Returns:
+        變慢超過 tolerance 倍的項目說明
+    """
+    baseline = json.loads(Path(baseline_path).read_text(encoding="utf-8"))
+    previous = {row_key(row): row for row in baseline["rows"] if "seconds" in row}
+    regressions = []
+    for row in rows:
+        before = previous.get(row_key(row))
+        if before is None or "seconds" not in row or before["seconds"] < BASELINE_MIN_SECONDS:
+            continue
+        ratio = row["seconds"] / before["seconds"]
+        name = " ".join(str(value) for value in row_key(row) if value is not None)
+        line = f"{name}: {before['seconds'] * 1000:.2f} → {row['seconds'] * 1000:.2f} ms ({ratio:.2f}x)"
+        if ratio > tolerance:
+            regressions.append(line)
+            print(f"❌ {line}")
+        else:
+            print(f"   {line}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="音符後處理效能基準測試")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--check", action="store_true", help="與舊版實作比對輸出")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--model", action="store_true", help="量測模型冷/熱啟動的單任務延遲")
+    parser.add_argument("--audio-seconds", type=float, default=30.0)
+    parser.add_argument("--audio-pipeline", action="store_true", help="比較音訊前處理流程的耗時與磁碟寫入")
+    parser.add_argument("--serialization", type=int, nargs="?", const=20000, metavar="NOTES",
+                        help="比較結果序列化耗時與大小")
+    parser.add_argument("--threshold-sweep", action="store_true", help="量測由後驗機率以不同門檻重新擷取音符的耗時")
+    parser.add_argument("--e2e", action="store_true", help="端對端：合成鋼琴音訊 + 假轉錄器，量測各階段耗時與記憶體")
+    parser.add_argument("--e2e-seconds", type=float, nargs="+", default=[30.0, 180.0], help="合成音訊長度 (秒)")
+    parser.add_argument("--densities", type=float, nargs="+", default=[5.0, 20.0, 80.0],
+                        help="假轉錄器每秒產生的音符數")
+    parser.add_argument("--real-model", action="store_true", help="端對端測試另外以 basic-pitch 模型跑一次")
+    parser.add_argument("--repeat", type=int, default=3, help="端對端測試的重複次數 (各階段取最短耗時)")
+    parser.add_argument("--lead-in", type=float, default=0.0,
+                        help="端對端測試的合成音訊前後加上的掌聲 / 靜音秒數")
+    parser.add_argument("--parallel", type=int, nargs="+", metavar="WORKERS",
+                        help="以不同行程數平行轉錄同一首歌，量測延遲擴展性 (長度由 --audio-seconds 指定)")
+    parser.add_argument("--stub-cost", type=float, default=0.05,
+                        help="--parallel 時假轉錄器每秒音訊模擬的模型 CPU 秒數")
+    parser.add_argument("--output", type=Path, help="將結果寫成 JSON")
+    parser.add_argument("--baseline", type=Path, help="與先前 --output 的結果比對耗時")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="基線比對容許的變慢倍數")
+    args = parser.parse_args()
+
+    if args.parallel:
+        rows = run_parallel_scaling(args.audio_seconds, args.parallel, args.real_model, args.stub_cost, seed=args.seed)
+    elif args.e2e:
+        rows = run_end_to_end(args.e2e_seconds, args.densities, args.real_model, args.repeat, seed=args.seed,
+                              lead_in=args.lead_in)
+    elif args.threshold_sweep:
+        rows = run_threshold_sweep(args.audio_seconds, seed=args.seed)
+    elif args.audio_pipeline:
+        rows = run_audio_pipeline(args.audio_seconds)
+    elif args.serialization:
+        rows = run_serialization(args.serialization, seed=args.seed)
+    elif args.model:
+        rows = run_model_latency(args.audio_seconds)
+    else:
+        rows = run(args.sizes, check=args.check, seed=args.seed)
+
+    if args.output:
+        write_report(args.output, rows, sys.argv[1:])
+    if any(row.get("identical") is False for row in rows):
+        raise SystemExit("❌ 輸出與舊版實作不一致")
+    if any(row.get("ok") is False for row in rows):
+        raise SystemExit("❌ 有設定組合執行失敗")
+    if args.baseline and compare_with_baseline(rows, args.baseline, args.tolerance):
+        raise SystemExit(f"❌ 有項目比基線慢超過 {args.tolerance:g} 倍")
@@ -0,0 +1,178 @@
+"""
+管線分階段量測
+分析流程中的每個階段以 stage() 包住，記錄耗時與進出的音符數；
+目前的量測對象以 contextvar 傳遞，各函式不需要多一個參數，
+沒有量測對象時 (例如 /api/refine) stage() 不做任何記錄。
+
+    trace = StageTrace()
+    with tracing(trace):
+        with stage('harmonic_filter', notes_in=len(notes)) as span:
+            notes = filter_harmonics_table(notes)
+            span.notes_out = len(notes)
+    trace.to_dict()  # → 結果 metadata['instrumentation']
+
+同名階段 (例如分段推論的每一段 predict) 會累加。
+基準測試可另外以 tracemalloc 記錄各階段的峰值配置量 (StageTrace(memory=True))。
+略過的靜音 / 非樂音片段長度以 add_skipped_seconds() 記錄。
+"""
+
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional, Dict, Any
+
+try:
+    import resource  # POSIX (Docker / Railway)
+except ImportError:  # Windows 本地開發：不記錄峰值記憶體
+    resource = None
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """本行程至今的峰值常駐記憶體 (推論行程為該行程處理過的所有任務中的最大值)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # Linux 以 KB 為單位
+
+
+class StageTrace:
+    """
+    單一任務的各階段耗時、音符數、音訊長度、峰值記憶體與略過推論的秒數
+
+    Args:
+        memory: 記錄各階段的 tracemalloc 峰值配置量 (需先 tracemalloc.start()，
+            會拖慢 Python 物件密集的階段，只用於基準測試)
+    """
+
+    def __init__(self, memory: bool = False):
+        self.memory = memory
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        self.audio_duration: Optional[float] = None
+        self.peak_rss_bytes: Optional[int] = None
+        self.inference_seconds_saved = 0.0
+
+    def add(self, name: str, seconds: float, notes_in: Optional[int] = None, notes_out: Optional[int] = None,
+            calls: int = 1, peak_alloc_bytes: Optional[int] = None):
+        entry = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0})
+        entry['seconds'] += seconds
+        entry['calls'] += calls
+        if notes_in is not None:
+            entry['notes_in'] = entry.get('notes_in', 0) + notes_in
+        if notes_out is not None:
+            entry['notes_out'] = entry.get('notes_out', 0) + notes_out
+        if peak_alloc_bytes is not None:
+            entry['peak_alloc_bytes'] = max(peak_alloc_bytes, entry.get('peak_alloc_bytes', 0))
+
+    def sample_rss(self):
+        peak = peak_rss_bytes()
+        if peak is not None:
+            self.peak_rss_bytes = max(peak, self.peak_rss_bytes or 0)
+
+    def absorb(self, instrumentation: Optional[Dict[str, Any]]):
+        """併入另一個行程 (推論行程) 以 to_dict() 回傳的量測結果"""
+        if not instrumentation:
+            return
+        for name, entry in instrumentation.get('stages', {}).items():
+            self.add(name, entry['seconds'], entry.get('notes_in'), entry.get('notes_out'), entry.get('calls', 1),
+                     entry.get('peak_alloc_bytes'))
+        if self.audio_duration is None:
+            self.audio_duration = instrumentation.get('audio_duration')
+        peak = instrumentation.get('peak_rss_bytes')
+        if peak is not None:
+            self.peak_rss_bytes = max(peak, self.peak_rss_bytes or 0)
+        self.inference_seconds_saved += instrumentation.get('inference_seconds_saved', 0.0)
+
+    def total_seconds(self) -> float:
+        return sum(entry['seconds'] for entry in self.stages.values())
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns:
+            {"stages": {階段: {"seconds", "calls", "notes_in"?, "notes_out"?, "peak_alloc_bytes"?}},
+             "audio_duration", "peak_rss_bytes", "realtime_factor", "inference_seconds_saved"}
+            realtime_factor = 各階段耗時總和 / 音訊長度
+            inference_seconds_saved = 因靜音 / 非樂音而未送進模型的音訊秒數
+        """
+        stages = {
+            name: {**entry, 'seconds': round(entry['seconds'], 4)}
+            for name, entry in self.stages.items()
+        }
+        realtime_factor = None
+        if self.audio_duration:
+            realtime_factor = round(self.total_seconds() / self.audio_duration, 4)
+        return {
+            'stages': stages,
+            'audio_duration': round(self.audio_duration, 3) if self.audio_duration else self.audio_duration,
+            'peak_rss_bytes': self.peak_rss_bytes,
+            'realtime_factor': realtime_factor,
+            'inference_seconds_saved': round(self.inference_seconds_saved, 3),
+        }
+
+    def summary(self) -> str:
+        """日誌用的一行摘要"""
+        return ', '.join(f"{name} {entry['seconds']:.2f}s" for name, entry in self.stages.items())
+
+
+_current: ContextVar[Optional[StageTrace]] = ContextVar('stage_trace', default=None)
+
+
+@contextmanager
+def tracing(trace: Optional[StageTrace]):
+    """在此範圍內 (同一執行緒) 的 stage() 記錄到 trace；trace 為 None 時暫停記錄"""
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+def current_trace() -> Optional[StageTrace]:
+    return _current.get()
+
+
+class _Span:
+    """stage() 產出的物件；在階段結束前設定 notes_out (必要時修正 notes_in)"""
+
+    __slots__ = ('notes_in', 'notes_out')
+
+    def __init__(self, notes_in: Optional[int]):
+        self.notes_in = notes_in
+        self.notes_out: Optional[int] = None
+
+
+@contextmanager
+def stage(name: str, notes_in: Optional[int] = None):
+    """量測一個階段；失敗的階段同樣記錄已花費的時間"""
+    span = _Span(notes_in)
+    trace = _current.get()
+    if trace is None:
+        yield span
+        return
+    memory = trace.memory and tracemalloc.is_tracing()
+    if memory:
+        # 巢狀的階段會重設外層的峰值；管線中的階段彼此不巢狀
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+    t0 = time.perf_counter()
+    try:
+        yield span
+    finally:
+        elapsed = time.perf_counter() - t0
+        peak = tracemalloc.get_traced_memory()[1] - base if memory else None
+        trace.add(name, elapsed, span.notes_in, span.notes_out, peak_alloc_bytes=peak)
+
+
+def set_audio_duration(seconds: Optional[float]):
+    """記錄音訊長度（計算各階段的即時率 real-time factor）"""
+    trace = _current.get()
+    if trace is not None and seconds and trace.audio_duration is None:
+        trace.audio_duration = seconds
+
+
+def add_skipped_seconds(seconds: float):
+    """記錄未送進模型的音訊秒數（推論前偵測到的靜音 / 非樂音片段）"""
+    trace = _current.get()
+    if trace is not None:
+        trace.inference_seconds_saved += seconds
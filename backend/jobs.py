@@ -0,0 +1,456 @@
+"""
+分析任務排程器
+取代 FastAPI BackgroundTasks：下載 (I/O) 與推論 (CPU) 使用各自獨立、大小固定的工作池，
+並以有上限的佇列提供背壓 (backpressure)，避免突發請求拖垮伺服器或撐爆記憶體。
+
+流程：
+    submit → [排隊] → 下載執行緒池 download_audio → [排隊] → 推論行程池 analyze_audio_with_basic_pitch → 完成
+
+上傳的音訊已在本機 (submit 時給 audio)，下載階段直接沿用，進度回報的階段與 YouTube 相同。
+"""
+
+import time
+import logging
+import threading
+import multiprocessing
+from pathlib import Path
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Callable, Dict, Any, Tuple
+
+try:
+    from backend.analyzer import (  # Docker 環境
+        download_audio, analyze_audio_with_basic_pitch, finalize_result, get_basic_pitch_model, warm_up_model,
+        model_status, extract_video_id,
+    )
+    from backend.artifact_cache import ArtifactCache, PosteriorgramCache
+    from backend.instrumentation import StageTrace, tracing
+except ImportError:
+    from analyzer import (  # 本地開發
+        download_audio, analyze_audio_with_basic_pitch, finalize_result, get_basic_pitch_model, warm_up_model,
+        model_status, extract_video_id,
+    )
+    from artifact_cache import ArtifactCache, PosteriorgramCache
+    from instrumentation import StageTrace, tracing
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """佇列已滿，呼叫端應回應 HTTP 429"""
+
+    def __init__(self, pending: int, limit: int):
+        super().__init__(f"任務佇列已滿 ({pending}/{limit})")
+        self.pending = pending
+        self.limit = limit
+
+
+class JobCancelledError(Exception):
+    """任務已被取消"""
+
+
+# 任務狀態
+QUEUED_DOWNLOAD = 'queued_download'
+DOWNLOADING = 'downloading'
+QUEUED_INFERENCE = 'queued_inference'
+ANALYZING = 'analyzing'
+
+
+@dataclass
+class Job:
+    task_id: str
+    url: str
+    params: Dict[str, Any]
+    on_progress: Callable[[str, float], None]
+    on_done: Callable[[Optional[Dict[str, Any]], Optional[BaseException], Dict[str, float]], None]
+    on_partial: Optional[Callable[[Dict[str, Any]], None]] = None
+    audio: Optional[Tuple[Path, str]] = None  # 已在本機的音訊 (路徑, 標題)，不需下載
+    state: str = QUEUED_DOWNLOAD
+    submitted_at: float = field(default_factory=time.monotonic)
+    state_since: float = field(default_factory=time.monotonic)
+    timings: Dict[str, float] = field(default_factory=dict)
+    trace: StageTrace = field(default_factory=StageTrace)  # 下載階段的量測（推論行程的量測隨結果回傳）
+    cancelled: threading.Event = field(default_factory=threading.Event)
+    future: Optional[Future] = None
+    pinned: Optional[Path] = None  # 存放區中標記為使用中的音訊（任務結束時釋放）
+
+    def enter(self, state: str):
+        """切換狀態並記錄上一個狀態的耗時(秒)"""
+        now = time.monotonic()
+        self.timings[self.state] = round(now - self.state_since, 3)
+        self.state = state
+        self.state_since = now
+
+
+# ============================================
+# 推論行程 (在子行程中執行)
+# ============================================
+
+_progress_queue = None
+
+# 行程事件（非任務進度）使用的 task_id
+MODEL_EVENT = '__model__'
+# 分段推論中途定案的音符批次
+PARTIAL_EVENT = 'partial'
+
+
+# 推論行程內的中間產物快取 (原始 note_events 與模型後驗機率)
+_artifact_cache: Optional[ArtifactCache] = None
+_posterior_cache: Optional[PosteriorgramCache] = None
+
+
+def _init_inference_worker(progress_queue, warm_up: bool, artifact_cache_dir: Optional[Path] = None,
+                           artifact_cache_max_bytes: int = 0, posterior_cache_dir: Optional[Path] = None,
+                           posterior_cache_max_bytes: int = 0):
+    """推論行程啟動時執行一次：模型在此載入，之後所有任務共用"""
+    global _progress_queue, _artifact_cache, _posterior_cache
+    _progress_queue = progress_queue
+    if artifact_cache_dir is not None:
+        _artifact_cache = ArtifactCache(artifact_cache_dir, artifact_cache_max_bytes)
+    if posterior_cache_dir is not None:
+        _posterior_cache = PosteriorgramCache(posterior_cache_dir, posterior_cache_max_bytes)
+    try:
+        status = warm_up_model() if warm_up else (get_basic_pitch_model() and model_status())
+        _progress_queue.put((MODEL_EVENT, 'ready', status))
+    except Exception as e:
+        # 載入失敗時讓第一個任務回報實際錯誤
+        logger.error(f"📍[Jobs] 推論行程模型載入失敗: {e}")
+
+
+def _ping() -> int:
+    return 0
+
+
+def _run_inference(task_id: str, audio_path: Path, output_dir: Path, params: Dict[str, Any]) -> Dict[str, Any]:
+    def report(stage: str, percent: float):
+        _progress_queue.put((task_id, stage, percent))
+
+    def report_partial(start: float, end: float, notes: list):
+        _progress_queue.put((task_id, PARTIAL_EVENT, {"from": start, "to": end, "notes": notes}))
+
+    return analyze_audio_with_basic_pitch(
+        audio_path,
+        output_dir,
+        report,
+        enable_preprocessing=params['enable_preprocessing'],
+        chord_mode=params['chord_mode'],
+        partial_callback=report_partial,
+        artifact_cache=_artifact_cache,
+        posterior_cache=_posterior_cache
+    )
+
+
+# ============================================
+# 排程器
+# ============================================
+
+class JobScheduler:
+    """
+    兩段式工作池排程器
+
+    Args:
+        output_dir: 音訊與結果輸出目錄
+        download_workers: 同時下載數 (執行緒)
+        inference_workers: 同時推論數 (行程，每個約佔一顆 CPU 與一份模型記憶體)
+        max_pending: 尚未完成的任務上限（含執行中），超過時拒絕新任務
+        warm_up: 推論行程啟動時是否先以靜音跑一次推論
+        artifact_cache_dir: 原始 note_events 快取目錄 (None 則不快取)
+        artifact_cache_max_bytes: 原始 note_events 快取容量上限
+        posterior_cache_dir: 模型後驗機率快取目錄 (None 則不快取)
+        posterior_cache_max_bytes: 模型後驗機率快取容量上限
+        audio_store: AudioStore；下載的音訊存入其中 (None 則直接寫入 output_dir)
+    """
+
+    def __init__(self, output_dir: Path, download_workers: int = 2, inference_workers: int = 1,
+                 max_pending: int = 16, warm_up: bool = True, artifact_cache_dir: Optional[Path] = None,
+                 artifact_cache_max_bytes: int = 0, posterior_cache_dir: Optional[Path] = None,
+                 posterior_cache_max_bytes: int = 0, audio_store=None):
+        self.output_dir = Path(output_dir)
+        self.audio_store = audio_store
+        self.artifact_cache_dir = artifact_cache_dir
+        self.artifact_cache_max_bytes = artifact_cache_max_bytes
+        self.posterior_cache_dir = posterior_cache_dir
+        self.posterior_cache_max_bytes = posterior_cache_max_bytes
+        self.download_workers = download_workers
+        self.inference_workers = inference_workers
+        self.max_pending = max_pending
+        self.warm_up = warm_up
+        self._model_workers: Dict[int, Dict[str, Any]] = {}
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.RLock()
+        # 工作池延遲到第一次提交時才建立，避免 spawn 子行程 import 本模組時連鎖建立
+        self._download_pool: Optional[ThreadPoolExecutor] = None
+        self._inference_pool: Optional[ProcessPoolExecutor] = None
+        self._progress_queue = None
+        self._listener: Optional[threading.Thread] = None
+
+    def _ensure_started(self):
+        if self._download_pool is not None:
+            return
+        # TensorFlow 不是 fork-safe，推論行程一律使用 spawn
+        ctx = multiprocessing.get_context('spawn')
+        self._progress_queue = ctx.Queue()
+        self._download_pool = ThreadPoolExecutor(
+            max_workers=self.download_workers, thread_name_prefix='download'
+        )
+        self._inference_pool = self._new_inference_pool()
+        self._listener = threading.Thread(target=self._relay_progress, name='progress-relay', daemon=True)
+        self._listener.start()
+
+    def _new_inference_pool(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self.inference_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_inference_worker,
+            initargs=(self._progress_queue, self.warm_up, self.artifact_cache_dir, self.artifact_cache_max_bytes,
+                      self.posterior_cache_dir, self.posterior_cache_max_bytes)
+        )
+
+    def _relay_progress(self):
+        """
+        把推論行程回報的進度轉交給對應任務的回調
+
+        佇列中可能還有任務結束前送出的進度；檢查任務仍在執行與呼叫回調在同一個鎖內進行，
+        _finish 移除任務後才送達的進度一律丟棄，不會蓋掉完成狀態。
+        """
+        while True:
+            item = self._progress_queue.get()
+            if item is None:
+                break
+            task_id, stage, percent = item
+            if task_id == MODEL_EVENT:
+                self._model_workers[percent['pid']] = percent
+                continue
+            with self._lock:
+                job = self._jobs.get(task_id)
+                if job is None or job.cancelled.is_set():
+                    continue
+                if stage == PARTIAL_EVENT:
+                    if job.on_partial:
+                        job.on_partial(percent)
+                else:
+                    job.on_progress(stage, percent)
+
+    # ---------- 對外介面 ----------
+
+    def start(self):
+        """
+        預先建立工作池並啟動所有推論行程（在 FastAPI lifespan 啟動時呼叫）
+
+        不會等待模型載入完成，進度可由 model_status() 查詢。
+        """
+        with self._lock:
+            self._ensure_started()
+            for _ in range(self.inference_workers):
+                self._inference_pool.submit(_ping)
+
+    def model_status(self) -> Dict[str, Any]:
+        """各推論行程的模型狀態"""
+        workers = list(self._model_workers.values())
+        return {
+            "warm": any(w.get('warm') for w in workers),
+            "ready_workers": len(workers),
+            "inference_workers": self.inference_workers,
+            "workers": workers,
+        }
+
+    def submit(self, task_id: str, url: str, params: Dict[str, Any],
+               on_progress: Callable[[str, float], None],
+               on_done: Callable[[Optional[Dict[str, Any]], Optional[BaseException], Dict[str, float]], None],
+               on_partial: Optional[Callable[[Dict[str, Any]], None]] = None,
+               audio: Optional[Tuple[Path, str]] = None) -> int:
+        """
+        提交任務
+
+        on_partial 會收到分段推論中途定案的音符批次 {"from", "to", "notes"}。
+        audio 為已在本機的音訊 (路徑, 標題)，例如上傳的檔案：不經 yt-dlp 下載，
+        結果的 video_id 為音訊檔名 (存放區中即內容雜湊)。
+
+        Returns:
+            佇列位置 (1 = 下一個執行)
+
+        Raises:
+            QueueFullError: 尚未完成的任務已達上限
+        """
+        with self._lock:
+            if len(self._jobs) >= self.max_pending:
+                raise QueueFullError(len(self._jobs), self.max_pending)
+            self._ensure_started()
+            job = Job(task_id=task_id, url=url, params=params, on_progress=on_progress, on_done=on_done,
+                      on_partial=on_partial, audio=audio)
+            if audio is not None:
+                # 已在本機的音訊排隊期間就不可淘汰
+                self._pin(job, audio[0])
+            self._jobs[task_id] = job
+            job.future = self._download_pool.submit(self._download_stage, job)
+        return self.queue_position(task_id) or 0
+
+    def cancel(self, task_id: str) -> bool:
+        """
+        取消任務
+
+        排隊中的任務立即移除；下載中的任務在下一次進度回報時中止；
+        推論已開始的任務無法中斷子行程，但結果會被丟棄。
+        """
+        with self._lock:
+            job = self._jobs.get(task_id)
+            if job is None:
+                return False
+            job.cancelled.set()
+            if job.future is not None and job.future.cancel():
+                self._finish(job, None, JobCancelledError("任務已取消"))
+        return True
+
+    def queue_position(self, task_id: str) -> Optional[int]:
+        """排隊中任務在同一階段佇列中的位置 (1 起算)；執行中為 0；不存在為 None"""
+        with self._lock:
+            job = self._jobs.get(task_id)
+            if job is None:
+                return None
+            if job.state not in (QUEUED_DOWNLOAD, QUEUED_INFERENCE):
+                return 0
+            ahead = sum(
+                1 for other in self._jobs.values()
+                if other.state == job.state and other.state_since < job.state_since
+            )
+            return ahead + 1
+
+    def timings(self, task_id: str) -> Optional[Dict[str, float]]:
+        """各階段耗時(秒)，含目前階段已經過的時間"""
+        job = self._jobs.get(task_id)
+        if job is None:
+            return None
+        timings = dict(job.timings)
+        timings[job.state] = round(time.monotonic() - job.state_since, 3)
+        return timings
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            states: Dict[str, int] = {}
+            for job in self._jobs.values():
+                states[job.state] = states.get(job.state, 0) + 1
+        return {
+            "pending": sum(states.values()),
+            "max_pending": self.max_pending,
+            "download_workers": self.download_workers,
+            "inference_workers": self.inference_workers,
+            "states": states,
+        }
+
+    def shutdown(self):
+        if self._download_pool is None:
+            return
+        for task_id in list(self._jobs):
+            self.cancel(task_id)
+        self._download_pool.shutdown(wait=False, cancel_futures=True)
+        self._inference_pool.shutdown(wait=False, cancel_futures=True)
+        self._progress_queue.put(None)
+
+    # ---------- 各階段 ----------
+
+    def _check_cancelled(self, job: Job):
+        if job.cancelled.is_set():
+            raise JobCancelledError("任務已取消")
+
+    def _download_stage(self, job: Job):
+        try:
+            self._check_cancelled(job)
+            job.enter(DOWNLOADING)
+
+            def report(stage: str, percent: float):
+                self._check_cancelled(job)
+                job.on_progress(stage, percent)
+
+            if job.audio is not None:
+                audio_path, video_title = job.audio
+                report('downloading', 100)
+            else:
+                with tracing(job.trace):
+                    audio_path, video_title = download_audio(
+                        job.url, self.output_dir, report, self.audio_store, pin=True
+                    )
+                if self.audio_store is not None:
+                    # 存放區取得時已標記為使用中，由任務接手到推論完成（於 _finish 釋放）
+                    job.pinned = audio_path
+            self._check_cancelled(job)
+        except BaseException as e:
+            self._finish(job, None, e)
+            return
+
+        # 推論行程開始執行時不會主動通知，以第一筆進度回報視為開始
+        job.on_progress = self._mark_analyzing(job, job.on_progress)
+        try:
+            with self._lock:
+                job.enter(QUEUED_INFERENCE)
+                job.future = self._submit_inference(job, audio_path)
+        except BaseException as e:
+            # 行程池已關閉或重建後仍無法提交：任務結束，釋放音訊與佇列名額
+            self._finish(job, None, e)
+            return
+        job.future.add_done_callback(
+            lambda future: self._inference_done(job, future, audio_path, video_title)
+        )
+
+    def _submit_inference(self, job: Job, audio_path: Path) -> Future:
+        """提交到推論行程池；行程池已損壞時重建並重試一次"""
+        try:
+            return self._inference_pool.submit(_run_inference, job.task_id, audio_path, self.output_dir, job.params)
+        except BrokenProcessPool:
+            self._restart_inference_pool()
+            return self._inference_pool.submit(_run_inference, job.task_id, audio_path, self.output_dir, job.params)
+
+    def _mark_analyzing(self, job: Job, on_progress: Callable[[str, float], None]):
+        def wrapped(stage: str, percent: float):
+            if job.state == QUEUED_INFERENCE:
+                with self._lock:
+                    job.enter(ANALYZING)
+            on_progress(stage, percent)
+        return wrapped
+
+    def _inference_done(self, job: Job, future: Future, audio_path: Path, video_title: str):
+        if future.cancelled():
+            return  # 已在 cancel() 中處理
+        try:
+            self._check_cancelled(job)
+            video_id = None if job.audio is not None else extract_video_id(job.url)
+            result = finalize_result(future.result(), audio_path, video_title, video_id, job.trace)
+        except BaseException as e:
+            if isinstance(e, BrokenProcessPool):
+                self._restart_inference_pool()
+            self._finish(job, None, e)
+            return
+        self._finish(job, result, None)
+
+    def _restart_inference_pool(self):
+        """推論行程異常結束（例如 OOM）後重建行程池，讓後續任務可以繼續"""
+        with self._lock:
+            if not getattr(self._inference_pool, '_broken', False):
+                return
+            logger.warning("📍[Jobs] 推論行程池已損壞，重新建立")
+            self._model_workers.clear()
+            self._inference_pool = self._new_inference_pool()
+
+    def _pin(self, job: Job, audio_path: Path):
+        if self.audio_store is not None:
+            self.audio_store.pin(audio_path)
+            job.pinned = audio_path
+
+    def _finish(self, job: Job, result: Optional[Dict[str, Any]], error: Optional[BaseException]):
+        with self._lock:
+            if self._jobs.get(job.task_id) is not job:
+                return
+            del self._jobs[job.task_id]
+            if job.pinned is not None:
+                # 完成、失敗或取消都在此釋放 (只會執行一次)
+                self.audio_store.unpin(job.pinned)
+                job.pinned = None
+            job.enter('done')
+            job.timings.pop('done', None)
+            job.timings['total'] = round(time.monotonic() - job.submitted_at, 3)
+        if job.cancelled.is_set() and not isinstance(error, JobCancelledError):
+            result, error = None, JobCancelledError("任務已取消")
+        try:
+            job.on_done(result, error, job.timings)
+        except Exception as e:
+            logger.error(f"📍[Jobs] 完成回調失敗 ({job.task_id}): {e}")
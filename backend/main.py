@@ -5,29 +5,141 @@ YouTube Piano Visualizer - FastAPI Backend
 
 import os
 import json
-import asyncio
+import time
+import uuid
+import hashlib
+import threading
 from pathlib import Path
-from typing import Optional
+from collections import OrderedDict
+from typing import Optional, Tuple, List
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Header, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import StreamingResponse, JSONResponse, FileResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse, Response
 from pydantic import BaseModel, HttpUrl
 
 # 內部模組 - 支援本地開發和 Docker 部署
 try:
-    from backend.analyzer import process_youtube  # Docker 環境
+    from backend.analyzer import (  # Docker 環境
+        extract_video_id, canonical_youtube_url, get_analysis_params, list_playlist_video_ids,
+        get_postprocess_params, result_analysis_params, refine_from_events, NoteEventTable,
+        rethreshold_params, posterior_params, events_from_posteriors, THRESHOLD_PARAMS,
+        probe_audio_duration, MAX_VIDEO_SECONDS
+    )
+    from backend.result_cache import ResultCache
+    from backend.artifact_cache import ArtifactCache, PosteriorgramCache
+    from backend.audio_store import AudioStore
+    from backend.jobs import JobScheduler, QueueFullError, JobCancelledError
+    from backend.progress_bus import ProgressBus, STATUS_EVENT, NOTES_EVENT
+    from backend.serialization import dumps
+    from backend.note_codec import BINARY_MEDIA_TYPE, encode_notes_binary, wants_binary, negotiate_encoding, compress
+    from backend.note_index import NoteTimeIndex
+    from backend.task_registry import TaskRegistry
+    from backend.metrics import PipelineMetrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+    from backend.upload import MultipartSpool, UploadError, UploadTooLargeError
 except ImportError:
-    from analyzer import process_youtube  # 本地開發
+    from analyzer import (  # 本地開發
+        extract_video_id, canonical_youtube_url, get_analysis_params, list_playlist_video_ids,
+        get_postprocess_params, result_analysis_params, refine_from_events, NoteEventTable,
+        rethreshold_params, posterior_params, events_from_posteriors, THRESHOLD_PARAMS,
+        probe_audio_duration, MAX_VIDEO_SECONDS
+    )
+    from result_cache import ResultCache
+    from artifact_cache import ArtifactCache, PosteriorgramCache
+    from audio_store import AudioStore
+    from jobs import JobScheduler, QueueFullError, JobCancelledError
+    from progress_bus import ProgressBus, STATUS_EVENT, NOTES_EVENT
+    from serialization import dumps
+    from note_codec import BINARY_MEDIA_TYPE, encode_notes_binary, wants_binary, negotiate_encoding, compress
+    from note_index import NoteTimeIndex
+    from task_registry import TaskRegistry
+    from metrics import PipelineMetrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+    from upload import MultipartSpool, UploadError, UploadTooLargeError
 
 # 配置
 OUTPUT_DIR = Path(__file__).parent / "output"
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
-# 任務狀態追蹤
-task_status = {}
+# 結果快取 - 放在持久化 volume 上即可跨重啟、跨 worker 共用
+RESULT_CACHE_DIR = Path(os.environ.get("RESULT_CACHE_DIR", OUTPUT_DIR / "cache"))
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_MB", "1024")) * 1024 * 1024
+result_cache = ResultCache(RESULT_CACHE_DIR, RESULT_CACHE_MAX_BYTES)
+
+# 中間產物快取 - 原始 note_events，調整後處理參數時不需重新推論
+ARTIFACT_CACHE_DIR = Path(os.environ.get("ARTIFACT_CACHE_DIR", OUTPUT_DIR / "artifacts"))
+ARTIFACT_CACHE_MAX_BYTES = int(os.environ.get("ARTIFACT_CACHE_MAX_MB", "512")) * 1024 * 1024
+artifact_cache = ArtifactCache(ARTIFACT_CACHE_DIR, ARTIFACT_CACHE_MAX_BYTES)
+
+# 模型後驗機率 (float16) - 調整 onset/frame 門檻時重新擷取音符，不需重新推論
+POSTERIOR_CACHE_DIR = Path(os.environ.get("POSTERIOR_CACHE_DIR", ARTIFACT_CACHE_DIR / "posteriors"))
+POSTERIOR_CACHE_MAX_BYTES = int(os.environ.get("POSTERIOR_CACHE_MAX_MB", "1024")) * 1024 * 1024
+posterior_cache = PosteriorgramCache(POSTERIOR_CACHE_DIR, POSTERIOR_CACHE_MAX_BYTES)
+
+# 下載的音訊 - 以內容雜湊存放、依影片 ID 重用，受容量上限與保存期限管理
+AUDIO_STORE_DIR = Path(os.environ.get("AUDIO_STORE_DIR", OUTPUT_DIR / "audio"))
+AUDIO_STORE_MAX_BYTES = int(os.environ.get("AUDIO_STORE_MAX_MB", "2048")) * 1024 * 1024
+AUDIO_STORE_TTL_SECONDS = float(os.environ.get("AUDIO_STORE_TTL_HOURS", "72")) * 3600
+audio_store = AudioStore(AUDIO_STORE_DIR, AUDIO_STORE_MAX_BYTES, AUDIO_STORE_TTL_SECONDS)
+
+# 直接上傳的音訊檔案大小上限 (邊接收邊寫入存放區的暫存目錄，不佔 RAM)
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_MB", "200")) * 1024 * 1024
+# multipart 邊界與欄位標頭的額外長度
+UPLOAD_OVERHEAD_BYTES = 64 * 1024
+
+# 任務排程 - 下載 (執行緒) 與推論 (行程) 分開限流
+scheduler = JobScheduler(
+    OUTPUT_DIR,
+    download_workers=int(os.environ.get("DOWNLOAD_WORKERS", "2")),
+    inference_workers=int(os.environ.get("INFERENCE_WORKERS", "1")),
+    max_pending=int(os.environ.get("MAX_PENDING_JOBS", "16")),
+    warm_up=os.environ.get("MODEL_WARMUP", "1") == "1",
+    artifact_cache_dir=ARTIFACT_CACHE_DIR,
+    artifact_cache_max_bytes=ARTIFACT_CACHE_MAX_BYTES,
+    posterior_cache_dir=POSTERIOR_CACHE_DIR,
+    posterior_cache_max_bytes=POSTERIOR_CACHE_MAX_BYTES,
+    audio_store=audio_store
+)
+
+# 進度事件匯流排 - SSE 連線等待推送，不再輪詢
+progress_bus = ProgressBus(heartbeat_seconds=float(os.environ.get("SSE_HEARTBEAT_SECONDS", "15")))
+
+# 各階段耗時、音符數與峰值記憶體 (GET /metrics)
+pipeline_metrics = PipelineMetrics()
+
+# 任務狀態追蹤：結束超過 TASK_TTL_SECONDS 的任務清除；完成的結果在 RAM 中
+# 最多佔用 TASK_RESULT_MEMORY_MB，其餘需要時由磁碟結果快取讀回
+TASK_TTL_SECONDS = float(os.environ.get("TASK_TTL_SECONDS", "3600"))
+tasks = TaskRegistry(
+    result_cache,
+    ttl_seconds=TASK_TTL_SECONDS,
+    memory_budget_bytes=int(os.environ.get("TASK_RESULT_MEMORY_MB", "128")) * 1024 * 1024,
+    max_finished=int(os.environ.get("TASK_MAX_FINISHED", "10000"))
+)
+task_lock = threading.Lock()
+ACTIVE_STATUSES = ['pending', 'downloading', 'analyzing']
+FINAL_STATUSES = ['completed', 'error', 'cancelled']
+
+# /api/notes 已編碼的回應 (task_id, 二進位?, 壓縮, 時間窗) → (結果物件, ETag, body)
+# 結果完成後不再變動，同一結果物件只編碼、壓縮一次
+encoded_notes = OrderedDict()
+encoded_notes_lock = threading.Lock()
+ENCODED_NOTES_MAX_ENTRIES = 32
+# 批次分析：每個批次的項目清單，項目狀態即時取自任務登錄；
+# 全部提交完成超過 TASK_TTL_SECONDS 的批次於下次建立批次時清除
+batch_status = {}
+batch_lock = threading.Lock()
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "200"))
+# 批次最多同時佔用的排程名額，其餘保留給互動式的 /api/analyze
+BATCH_MAX_PENDING = int(os.environ.get("BATCH_MAX_PENDING", str(max(1, scheduler.max_pending // 2))))
+# 任務結束時通知批次提交執行緒有空出的名額
+batch_capacity = threading.Condition()
+
+# 時間窗查詢用的索引 task_id → (結果物件, NoteTimeIndex)
+note_indexes = OrderedDict()
+NOTE_INDEX_MAX_ENTRIES = 32
 
 
 class AnalyzeRequest(BaseModel):
@@ -35,21 +147,67 @@ class AnalyzeRequest(BaseModel):
     url: str  # YouTube URL
 
 
+class RefineRequest(BaseModel):
+    """重新清洗請求：只需提供要調整的參數，其餘沿用原本的門檻與後處理預設值"""
+    onset_threshold: Optional[float] = None  # 起音門檻 (0-1)，需要後驗機率快取
+    frame_threshold: Optional[float] = None  # 延音門檻 (0-1)，需要後驗機率快取
+    min_note_length_ms: Optional[float] = None  # 最小音符長度(ms)，需要後驗機率快取
+    min_duration: Optional[float] = None  # 最小時長(秒)
+    min_velocity: Optional[int] = None  # 最小力度
+    merge_threshold: Optional[float] = None  # 同音高碎音合併間隔(秒)
+    harmonic_threshold: Optional[float] = None  # 泛音力度比例門檻
+    max_duration: Optional[float] = None  # 最大音符長度(秒)
+    velocity_curve: Optional[str] = None  # piano, linear, soft, hard
+    adaptive_filter: Optional[bool] = None  # 自適應門檻過濾（預設跟隨和弦模式）
+
+
+class BatchRequest(BaseModel):
+    """批次分析請求：網址列表和/或播放清單"""
+    urls: List[str] = []
+    playlist_url: Optional[str] = None
+
+
+class BatchItem(BaseModel):
+    """批次中單一影片的狀態"""
+    url: str
+    task_id: str
+    status: str  # cached, waiting, pending, downloading, analyzing, completed, error, cancelled
+    progress: float
+    message: Optional[str] = None
+
+
+class BatchStatus(BaseModel):
+    """批次狀態模型"""
+    batch_id: str
+    status: str  # running, completed
+    progress: float  # 全部項目的平均進度 0-100
+    counts: dict  # 各狀態的項目數
+    items: List[BatchItem]
+
+
 class TaskStatus(BaseModel):
     """任務狀態模型"""
     task_id: str
-    status: str  # pending, downloading, analyzing, completed, error
+    status: str  # pending, downloading, analyzing, completed, error, cancelled
     progress: float  # 0-100
     message: Optional[str] = None
     result: Optional[dict] = None
+    queue_position: Optional[int] = None  # 排隊位置 (0 = 執行中)
+    timings: Optional[dict] = None  # 各階段耗時(秒)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """應用程式生命週期管理"""
     print("📍[Server] 啟動中...")
+    # 套用目前的容量上限與保存期限（新增檔案時也會再檢查）
+    audio_store.evict()
+    # 預先啟動推論行程並載入模型，避免第一個任務承擔冷啟動延遲
+    if scheduler.warm_up:
+        scheduler.start()
     yield
     print("📍[Server] 關閉中...")
+    scheduler.shutdown()
 
 
 # 建立 FastAPI 應用
@@ -70,10 +228,60 @@ app.add_middleware(
 )
 
 
-def run_analysis(task_id: str, youtube_url: str):
+def make_task_key(url: str) -> Tuple[str, Optional[str], str]:
     """
-    在背景執行音訊分析
+    將網址正規化為任務 key
+    
+    Returns:
+        (task_id, 影片 ID 或 None, 實際用於下載的網址)
     """
+    video_id = extract_video_id(url)
+    if video_id:
+        return hashlib.md5(video_id.encode()).hexdigest()[:12], video_id, canonical_youtube_url(video_id)
+    # 無法解析影片 ID 時退回以原始網址作為 key
+    return hashlib.md5(url.encode()).hexdigest()[:12], None, url
+
+
+def status_event(task_id: str, status: dict) -> dict:
+    """
+    SSE 狀態事件內容
+    
+    完整結果不內嵌在事件中，完成時改以 result_url 指向 /api/notes
+    """
+    event = {key: value for key, value in status.items() if key != 'result'}
+    if status.get('status') == 'completed':
+        event['result_url'] = f"/api/notes/{task_id}"
+    return event
+
+
+def set_status(task_id: str, status: dict, result: Optional[dict] = None, result_key: Optional[tuple] = None,
+               restart: bool = False):
+    """更新任務狀態並推送給 SSE 訂閱者（已結束的任務不再推送執行中的狀態）"""
+    if not tasks.set(task_id, status, result, result_key, restart=restart):
+        return
+    progress_bus.publish(
+        task_id, STATUS_EVENT, status_event(task_id, status),
+        final=status.get('status') in FINAL_STATUSES
+    )
+
+
+def submit_analysis(task_id: str, youtube_url: str, audio: Optional[Tuple[Path, str]] = None) -> int:
+    """
+    將音訊分析交給排程器執行
+    
+    Args:
+        task_id: 任務 ID
+        youtube_url: 下載用的網址
+        audio: 已在音訊存放區的上傳檔案 (路徑, 標題)，不經 yt-dlp 下載
+    
+    Returns:
+        佇列位置
+    
+    Raises:
+        QueueFullError: 佇列已滿
+    """
+    params = get_analysis_params()
+    
     def update_progress(stage: str, percent: float):
         """更新任務進度"""
         status_map = {
@@ -81,80 +289,371 @@ def run_analysis(task_id: str, youtube_url: str):
             'analyzing': ('analyzing', 40 + percent * 0.6)  # 40-100%
         }
         status, overall = status_map.get(stage, (stage, percent))
-        task_status[task_id] = {
+        set_status(task_id, {
             'status': status,
             'progress': overall,
             'message': f'{stage}: {percent:.0f}%'
-        }
+        })
     
-    try:
-        task_status[task_id] = {
+    def on_partial(batch: dict):
+        """收到已定案的音符批次（任務結束後才送達的批次由匯流排捨棄）"""
+        progress_bus.publish(task_id, NOTES_EVENT, batch)
+    
+    def on_done(result: Optional[dict], error: Optional[BaseException], timings: dict):
+        """任務結束（完成、失敗或取消）"""
+        if error is None:
+            # 排程各狀態 (排隊/下載/推論) 的耗時與處理階段的量測一併保存
+            result['metadata'].setdefault('instrumentation', {})['phases'] = timings
+            pipeline_metrics.observe_job('completed', timings, result['metadata']['instrumentation'])
+            result_key = (result['metadata']['video_id'], params)
+            try:
+                result_cache.put(*result_key, result)
+            except OSError as e:
+                print(f"📍[Server] 結果快取寫入失敗: {e}")
+                result_key = None  # 磁碟上沒有這份結果，不可移出 RAM
+            
+            set_status(task_id, {
+                'status': 'completed',
+                'progress': 100,
+                'message': '分析完成',
+                'timings': timings
+            }, result=result, result_key=result_key)
+        elif isinstance(error, JobCancelledError):
+            pipeline_metrics.observe_job('cancelled', timings)
+            set_status(task_id, {
+                'status': 'cancelled',
+                'progress': 0,
+                'message': '任務已取消',
+                'timings': timings
+            })
+        else:
+            pipeline_metrics.observe_job('error', timings)
+            set_status(task_id, {
+                'status': 'error',
+                'progress': 0,
+                'message': str(error),
+                'timings': timings
+            })
+        
+        with batch_capacity:
+            batch_capacity.notify_all()
+    
+    return scheduler.submit(task_id, youtube_url, params, update_progress, on_done, on_partial, audio)
+
+
+def enqueue_task(task_id: str, source_url: str, audio: Optional[Tuple[Path, str]] = None) -> Tuple[bool, Optional[int]]:
+    """
+    Single-flight 提交：在排程前先登記任務，並發的相同請求會附加到進行中的任務
+    
+    Returns:
+        (是否為新提交, 佇列位置)
+    
+    Raises:
+        QueueFullError: 佇列已滿（任務狀態會還原）
+    """
+    with task_lock:
+        existing = tasks.snapshot(task_id)
+        if existing and existing.status.get('status') in ACTIVE_STATUSES:
+            return False, scheduler.queue_position(task_id)
+        progress_bus.open(task_id)
+        set_status(task_id, {
             'status': 'pending',
             'progress': 0,
             'message': '準備中...'
-        }
-        
-        result = process_youtube(
-            youtube_url,
-            OUTPUT_DIR,
-            progress_callback=update_progress
-        )
-        
-        task_status[task_id] = {
-            'status': 'completed',
-            'progress': 100,
-            'message': '分析完成',
-            'result': result
-        }
+        }, restart=True)
         
-    except Exception as e:
-        task_status[task_id] = {
-            'status': 'error',
-            'progress': 0,
-            'message': str(e),
-            'result': None
-        }
+        try:
+            position = submit_analysis(task_id, source_url, audio)
+        except QueueFullError:
+            progress_bus.discard(task_id)
+            tasks.restore(task_id, existing)
+            raise
+    return True, position
 
 
-@app.post("/api/analyze", response_model=TaskStatus)
-async def start_analysis(request: AnalyzeRequest, background_tasks: BackgroundTasks):
+def cached_task_status(task_id: str, video_id: Optional[str]) -> Optional[TaskStatus]:
     """
-    啟動 YouTube 音訊分析任務
+    已完成的相同任務：先查 RAM 中的任務結果，再查磁碟快取（命中時不下載也不推論）
     
-    傳入 YouTube URL，返回任務 ID 用於查詢進度
+    Returns:
+        完成狀態；結果已不在 RAM 與磁碟快取時返回 None (需要重新分析)
     """
-    import hashlib
-    
-    # 生成任務 ID
-    task_id = hashlib.md5(request.url.encode()).hexdigest()[:12]
+    existing = tasks.status(task_id)
+    result = tasks.result(task_id) if existing and existing.get('status') == 'completed' else None
+    if result is not None:
+        return TaskStatus(
+            task_id=task_id,
+            status=existing['status'],
+            progress=existing['progress'],
+            message="使用快取結果",
+            result=result
+        )
     
-    # 檢查是否已有相同任務
-    if task_id in task_status:
-        existing = task_status[task_id]
-        if existing.get('status') == 'completed':
+    if video_id:
+        params = get_analysis_params()
+        cached = result_cache.get(video_id, params)
+        if cached is not None:
+            tasks.set(task_id, {
+                'status': 'completed',
+                'progress': 100,
+                'message': '使用快取結果'
+            }, result=cached, result_key=(video_id, params))
             return TaskStatus(
                 task_id=task_id,
-                status=existing['status'],
-                progress=existing['progress'],
+                status='completed',
+                progress=100,
                 message="使用快取結果",
-                result=existing.get('result')
-            )
-        elif existing.get('status') in ['pending', 'downloading', 'analyzing']:
-            return TaskStatus(
-                task_id=task_id,
-                status=existing['status'],
-                progress=existing['progress'],
-                message=existing.get('message', '處理中...')
+                result=cached
             )
+    return None
+
+
+def submit_task(task_id: str, source_url: str, audio: Optional[Tuple[Path, str]] = None) -> TaskStatus:
+    """
+    交給排程器；佇列已滿時以 429 拒絕，避免拖垮伺服器
+    
+    Returns:
+        新提交任務的排隊狀態，或進行中相同任務的目前狀態
+    """
+    try:
+        submitted, position = enqueue_task(task_id, source_url, audio)
+    except QueueFullError as e:
+        raise HTTPException(
+            status_code=429,
+            detail={
+                "message": "伺服器忙碌中，請稍後再試",
+                "pending": e.pending,
+                "limit": e.limit,
+                "queue_position": e.pending + 1
+            },
+            headers={"Retry-After": "30"}
+        )
     
-    # 添加背景任務
-    background_tasks.add_task(run_analysis, task_id, request.url)
+    if not submitted:
+        existing = tasks.status(task_id) or {'status': 'pending', 'progress': 0}
+        return TaskStatus(
+            task_id=task_id,
+            status=existing['status'],
+            progress=existing['progress'],
+            message=existing.get('message', '處理中...'),
+            queue_position=position
+        )
     
     return TaskStatus(
         task_id=task_id,
         status='pending',
         progress=0,
-        message='任務已提交'
+        message=f'任務已提交，排隊第 {position} 位' if position else '任務已提交',
+        queue_position=position
+    )
+
+
+@app.post("/api/analyze", response_model=TaskStatus)
+async def start_analysis(request: AnalyzeRequest):
+    """
+    啟動 YouTube 音訊分析任務
+    
+    傳入 YouTube URL，返回任務 ID 用於查詢進度
+    """
+    # 生成任務 ID：同一部影片的各種網址變體 (youtu.be / watch?v=&t= / m.youtube.com)
+    # 都對應到同一個任務
+    task_id, video_id, source_url = make_task_key(request.url)
+    
+    # 檢查是否已有完成的相同任務（結果已不在 RAM 與磁碟快取時重新分析）
+    # 讀取快取檔案與取得鎖都在執行緒池中進行，不阻塞事件迴圈
+    cached = await run_in_threadpool(cached_task_status, task_id, video_id)
+    if cached is not None:
+        return cached
+    
+    return await run_in_threadpool(submit_task, task_id, source_url)
+
+
+@app.post("/api/upload", response_model=TaskStatus)
+async def upload_audio(request: Request):
+    """
+    上傳本機音訊檔案並分析（不經 YouTube 下載與轉檔）
+    
+    multipart/form-data：`file` 為音訊檔案，可另附 `title`。
+    請求本體邊接收邊寫入磁碟並計算內容雜湊，整個檔案不會放進 RAM；
+    內容相同的檔案對應到同一個任務，已有結果時直接返回。
+    之後與 /api/analyze 相同，以 task_id 查詢進度 (downloading → analyzing → completed)。
+    """
+    declared = request.headers.get('content-length')
+    if declared and declared.isdigit() and int(declared) > MAX_UPLOAD_BYTES + UPLOAD_OVERHEAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"檔案超過 {MAX_UPLOAD_BYTES // (1024 * 1024)} MB 上限")
+    
+    with audio_store.staging() as staging_dir:
+        spool = None
+        try:
+            spool = MultipartSpool(request.headers.get('content-type', ''), staging_dir, MAX_UPLOAD_BYTES)
+            async for chunk in request.stream():
+                await run_in_threadpool(spool.feed, chunk)
+            upload = spool.finish()
+        except UploadTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except UploadError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        finally:
+            if spool is not None:
+                spool.close()
+        
+        # 以內容雜湊作為影片 ID：同一個檔案重複上傳時命中結果快取
+        video_id = upload.content_hash
+        task_id = hashlib.md5(video_id.encode()).hexdigest()[:12]
+        cached = await run_in_threadpool(cached_task_status, task_id, video_id)
+        if cached is not None:
+            print(f"📍[Server] 上傳 {upload.filename} ({upload.size / 1e6:.1f} MB) 已有分析結果")
+            return cached
+        
+        duration = await run_in_threadpool(probe_audio_duration, upload.path)
+        if duration is None:
+            raise HTTPException(status_code=400, detail="無法讀取音訊檔案")
+        if duration > MAX_VIDEO_SECONDS:
+            raise HTTPException(
+                status_code=400, detail=f"音訊長度 {duration:.0f} 秒，超過 {MAX_VIDEO_SECONDS} 秒上限"
+            )
+        
+        # 存入即標記為使用中，直到排程器接手 (任務本身另外標記，結束或取消時釋放)
+        audio_path = await run_in_threadpool(
+            audio_store.add, video_id, upload.path, upload.title, video_id, pin=True
+        )
+    
+    print(f"📍[Server] 已接收上傳 {upload.filename} ({upload.size / 1e6:.1f} MB, {duration:.0f}s) → {task_id}")
+    try:
+        return await run_in_threadpool(submit_task, task_id, f"upload:{upload.filename}", (audio_path, upload.title))
+    finally:
+        audio_store.unpin(audio_path)
+
+
+def run_batch(batch_id: str):
+    """
+    依序提交批次項目（背景執行緒）
+    
+    批次佔用的名額達到 BATCH_MAX_PENDING 或佇列已滿時，等待任務結束空出名額再繼續。
+    已完成或進行中的相同任務直接沿用，不重複提交。
+    """
+    items = batch_status[batch_id]['items']
+    for item in items:
+        if item['cached']:
+            continue
+        while True:
+            existing = tasks.status(item['task_id'])
+            if existing and existing.get('status') in ACTIVE_STATUSES + ['completed']:
+                break
+            in_flight = sum(
+                1 for other in items
+                if other['submitted'] and (tasks.status(other['task_id']) or {}).get('status') in ACTIVE_STATUSES
+            )
+            if in_flight < BATCH_MAX_PENDING:
+                try:
+                    enqueue_task(item['task_id'], item['source_url'])
+                    break
+                except QueueFullError:
+                    pass
+            with batch_capacity:
+                batch_capacity.wait(timeout=5)
+        item['submitted'] = True
+    batch_status[batch_id]['submitted_at'] = time.monotonic()
+    print(f"📍[Server] 批次 {batch_id} 已全部提交 ({len(items)} 項)")
+
+
+def expire_batches():
+    """清除全部提交完成超過 TASK_TTL_SECONDS 的批次（其任務也已隨之過期）"""
+    deadline = time.monotonic() - TASK_TTL_SECONDS
+    with batch_lock:
+        expired = [batch_id for batch_id, batch in batch_status.items()
+                   if batch.get('submitted_at') is not None and batch['submitted_at'] < deadline]
+        for batch_id in expired:
+            del batch_status[batch_id]
+
+
+def batch_item_status(item: dict) -> BatchItem:
+    current = tasks.status(item['task_id']) if item['submitted'] else None
+    if item['cached']:
+        status, progress, message = 'cached', 100, '使用快取結果'
+    elif current is None:
+        status, progress, message = 'waiting', 0, '等待提交'
+    else:
+        status, progress, message = current.get('status'), current.get('progress', 0), current.get('message')
+        if status in FINAL_STATUSES:
+            progress = 100
+    return BatchItem(url=item['url'], task_id=item['task_id'], status=status, progress=progress, message=message)
+
+
+@app.post("/api/batch", response_model=BatchStatus)
+async def start_batch(request: BatchRequest):
+    """
+    批次分析多個 YouTube 網址或整個播放清單
+    
+    已有快取結果的影片直接跳過 (不下載、不推論)；其餘項目在背景依序提交，
+    下載與推論沿用同一組排程器 (推論行程的模型常駐，不會逐首重新載入)。
+    以 GET /api/batch/{batch_id} 查詢整體進度與各項目狀態。
+    """
+    urls = list(request.urls)
+    if request.playlist_url:
+        try:
+            video_ids = await run_in_threadpool(list_playlist_video_ids, request.playlist_url, BATCH_MAX_ITEMS)
+        except RuntimeError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        urls.extend(canonical_youtube_url(video_id) for video_id in video_ids)
+    
+    if not urls:
+        raise HTTPException(status_code=400, detail="未提供任何網址")
+    if len(urls) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"批次最多 {BATCH_MAX_ITEMS} 個網址")
+    
+    params = get_analysis_params()
+    
+    def build_items() -> List[dict]:
+        """批次項目（逐一檢查磁碟快取，在執行緒池中執行）"""
+        items = []
+        seen = set()
+        for url in urls:
+            task_id, video_id, source_url = make_task_key(url)
+            if task_id in seen:
+                continue
+            seen.add(task_id)
+            items.append({
+                'url': url,
+                'task_id': task_id,
+                'source_url': source_url,
+                'cached': bool(video_id) and result_cache.contains(video_id, params),
+                'submitted': False
+            })
+        return items
+    
+    items = await run_in_threadpool(build_items)
+    expire_batches()
+    batch_id = uuid.uuid4().hex[:12]
+    with batch_lock:
+        batch_status[batch_id] = {'items': items}
+    threading.Thread(target=run_batch, args=(batch_id,), name=f"batch-{batch_id}", daemon=True).start()
+    
+    print(f"📍[Server] 批次 {batch_id}: {len(items)} 項，其中 {sum(i['cached'] for i in items)} 項已有快取")
+    return await get_batch_status(batch_id)
+
+
+@app.get("/api/batch/{batch_id}", response_model=BatchStatus)
+async def get_batch_status(batch_id: str):
+    """
+    查詢批次整體進度與各項目狀態
+    """
+    batch = batch_status.get(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="批次不存在")
+    
+    items = [batch_item_status(item) for item in batch['items']]
+    counts = {}
+    for item in items:
+        counts[item.status] = counts.get(item.status, 0) + 1
+    done = all(item.status == 'cached' or item.status in FINAL_STATUSES for item in items)
+    
+    return BatchStatus(
+        batch_id=batch_id,
+        status='completed' if done else 'running',
+        progress=sum(item.progress for item in items) / len(items),
+        counts=counts,
+        items=items
     )
 
 
@@ -163,37 +662,71 @@ async def get_status(task_id: str):
     """
     查詢分析任務狀態
     """
-    if task_id not in task_status:
+    status = tasks.status(task_id)
+    if status is None:
         raise HTTPException(status_code=404, detail="任務不存在")
     
-    status = task_status[task_id]
+    result = await run_in_threadpool(tasks.result, task_id) if status.get('status') == 'completed' else None
     return TaskStatus(
         task_id=task_id,
         status=status.get('status', 'unknown'),
         progress=status.get('progress', 0),
         message=status.get('message'),
-        result=status.get('result')
+        result=result,
+        queue_position=scheduler.queue_position(task_id),
+        timings=status.get('timings') or scheduler.timings(task_id)
     )
 
 
+@app.post("/api/cancel/{task_id}", response_model=TaskStatus)
+async def cancel_analysis(task_id: str):
+    """
+    取消排隊中或執行中的分析任務
+    """
+    if task_id not in tasks:
+        raise HTTPException(status_code=404, detail="任務不存在")
+    if not scheduler.cancel(task_id):
+        raise HTTPException(status_code=400, detail="任務已結束，無法取消")
+    
+    return await get_status(task_id)
+
+
 @app.get("/api/status/{task_id}/stream")
-async def stream_status(task_id: str):
+async def stream_status(task_id: str, last_event_id: Optional[str] = Header(None)):
     """
     SSE 串流任務狀態 (Server-Sent Events)
+    
+    狀態變化時才推送 (預設事件)，閒置時送出心跳註解維持連線。
+    長音訊分段推論時會以 `event: notes` 推送已定案時間範圍內的音符批次
+    {"from", "to", "notes"}，前端可先開始播放前段。
+    完成事件不內嵌結果，而是帶 result_url，由前端另外取得完整結果。
+    斷線重連時瀏覽器會帶上 Last-Event-ID，只補送之後的事件。
     """
+    try:
+        resume_from = int(last_event_id) if last_event_id else 0
+    except ValueError:
+        resume_from = 0
+    
     async def event_generator():
-        while True:
-            if task_id not in task_status:
-                yield f"data: {json.dumps({'error': '任務不存在'})}\n\n"
-                break
-            
-            status = task_status[task_id]
-            yield f"data: {json.dumps(status)}\n\n"
-            
-            if status.get('status') in ['completed', 'error']:
-                break
-            
-            await asyncio.sleep(0.5)  # 每 500ms 更新一次
+        status = tasks.status(task_id)
+        if status is None:
+            yield f"data: {json.dumps({'error': '任務不存在'})}\n\n"
+            return
+        
+        if not progress_bus.has_topic(task_id):
+            # 快取命中或事件已過保留期：直接送出目前狀態
+            yield f"data: {json.dumps(status_event(task_id, status), ensure_ascii=False)}\n\n"
+            return
+        
+        async for item in progress_bus.subscribe(task_id, resume_from):
+            if item is None:
+                yield ": heartbeat\n\n"
+                continue
+            event_id, event, data = item
+            if event == STATUS_EVENT:
+                yield f"id: {event_id}\ndata: {data}\n\n"
+            else:
+                yield f"id: {event_id}\nevent: {event}\ndata: {data}\n\n"
     
     return StreamingResponse(
         event_generator(),
@@ -205,25 +738,214 @@ async def stream_status(task_id: str):
     )
 
 
-@app.get("/api/notes/{task_id}")
-async def get_notes(task_id: str):
+def completed_result(task_id: str) -> dict:
     """
-    獲取分析完成的 notes.json
+    已完成任務的結果（可能需由磁碟快取讀回）
+    
+    Raises:
+        HTTPException: 任務不存在 (404)、尚未完成 (400) 或結果已被淘汰 (410)
     """
-    if task_id not in task_status:
+    status = tasks.status(task_id)
+    if status is None:
         raise HTTPException(status_code=404, detail="任務不存在")
-    
-    status = task_status[task_id]
     if status.get('status') != 'completed':
         raise HTTPException(status_code=400, detail="任務尚未完成")
     
-    return JSONResponse(content=status.get('result'))
+    result = tasks.result(task_id)
+    if result is None:
+        raise HTTPException(status_code=410, detail="分析結果已過期，請重新分析")
+    return result
+
+
+def get_note_index(task_id: str, result: dict) -> NoteTimeIndex:
+    """取得 (必要時建立) 結果的時間索引"""
+    with encoded_notes_lock:
+        cached = note_indexes.get(task_id)
+        if cached and cached[0] is result:
+            note_indexes.move_to_end(task_id)
+            return cached[1]
+    
+    index = NoteTimeIndex(result.get('notes') or [])
+    with encoded_notes_lock:
+        note_indexes[task_id] = (result, index)
+        note_indexes.move_to_end(task_id)
+        while len(note_indexes) > NOTE_INDEX_MAX_ENTRIES:
+            note_indexes.popitem(last=False)
+    return index
+
+
+def window_result(task_id: str, result: dict, window: Tuple[float, float]) -> dict:
+    """只包含與時間窗 [from, to) 重疊的音符"""
+    start, end = window
+    notes = get_note_index(task_id, result).query(start, end)
+    metadata = dict(result.get('metadata') or {})
+    metadata['window'] = {
+        'from': start,
+        'to': end if end != float('inf') else None,
+        'note_count': len(notes)
+    }
+    return {'metadata': metadata, 'notes': notes}
+
+
+def encode_notes(task_id: str, result: dict, binary: bool, encoding: Optional[str],
+                 window: Optional[Tuple[float, float]] = None) -> Tuple[str, bytes]:
+    """
+    編碼並壓縮結果，返回 (ETag, body)
+    
+    ETag 取自未壓縮內容的雜湊，不同格式/壓縮方式/時間窗各自有不同的 ETag
+    """
+    key = (task_id, binary, encoding, window)
+    with encoded_notes_lock:
+        cached = encoded_notes.get(key)
+        if cached and cached[0] is result:
+            encoded_notes.move_to_end(key)
+            return cached[1], cached[2]
+    
+    payload = window_result(task_id, result, window) if window else result
+    body = encode_notes_binary(payload) if binary else dumps(payload)
+    digest = hashlib.sha256(body).hexdigest()[:16]
+    etag = f'"{digest}-{encoding}"' if encoding else f'"{digest}"'
+    body = compress(body, encoding)
+    
+    with encoded_notes_lock:
+        encoded_notes[key] = (result, etag, body)
+        encoded_notes.move_to_end(key)
+        while len(encoded_notes) > ENCODED_NOTES_MAX_ENTRIES:
+            encoded_notes.popitem(last=False)
+    return etag, body
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+    return '*' in candidates or etag in candidates
+
+
+@app.get("/api/notes/{task_id}")
+async def get_notes(
+    task_id: str,
+    time_from: Optional[float] = Query(None, alias="from", ge=0),
+    time_to: Optional[float] = Query(None, alias="to", ge=0),
+    accept: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    獲取分析完成的 notes.json
+    
+    - ?from=120&to=150 只返回與該時間窗 (秒) 重疊的音符，可分頁、跳轉或延遲載入；
+      metadata.window 記錄查詢範圍與音符數
+    - Accept 包含 application/vnd.piano-notes 時返回緊湊二進位格式 (見 note_codec.py)
+    - 依 Accept-Encoding 以 br / gzip 壓縮
+    - 支援 ETag / If-None-Match，內容未變時返回 304
+    """
+    result = await run_in_threadpool(completed_result, task_id)
+    
+    window = None
+    if time_from is not None or time_to is not None:
+        window = (time_from or 0.0, time_to if time_to is not None else float('inf'))
+        if window[1] <= window[0]:
+            raise HTTPException(status_code=400, detail="時間窗的 to 必須大於 from")
+    
+    binary = wants_binary(accept)
+    encoding = negotiate_encoding(accept_encoding)
+    etag, body = await run_in_threadpool(encode_notes, task_id, result, binary, encoding, window)
+    
+    headers = {
+        "ETag": etag,
+        "Vary": "Accept, Accept-Encoding",
+        "Cache-Control": "no-cache",
+    }
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(
+        content=body,
+        media_type=BINARY_MEDIA_TYPE if binary else "application/json",
+        headers=headers
+    )
+
+
+def cached_note_events(audio_hash: Optional[str], params: dict, rethreshold: bool) -> Optional[NoteEventTable]:
+    """
+    由快取取得 refine 所需的原始 note_events（讀檔與擷取都在此完成，於執行緒池呼叫）
+    
+    Args:
+        rethreshold: True 時由模型後驗機率以 params 的門檻重新擷取，否則讀取中間產物快取
+    
+    Returns:
+        快取已過期時返回 None
+    """
+    if not audio_hash:
+        return None
+    if rethreshold:
+        posteriors = posterior_cache.get(audio_hash, posterior_params(params))
+        return events_from_posteriors(posteriors, params) if posteriors is not None else None
+    arrays = artifact_cache.get(audio_hash, params)
+    return NoteEventTable.from_arrays(arrays) if arrays is not None else None
+
+
+@app.post("/api/refine/{task_id}")
+async def refine_analysis(task_id: str, request: RefineRequest):
+    """
+    以新的後處理參數重新清洗已完成的分析結果
+    
+    只重跑階段 3-6（基礎過濾、自適應門檻、泛音過濾、碎音合併與力度曲線），
+    使用中間產物快取的原始 note_events，不下載也不推論，通常在毫秒內完成。
+    有指定 onset/frame 門檻或最小音符長度時，改由快取的模型後驗機率重新擷取
+    note_events（一首歌不到一秒）。原本的分析結果不會被覆寫。
+    """
+    result = await run_in_threadpool(completed_result, task_id)
+    
+    params = result_analysis_params(result)
+    overrides = request.dict()
+    thresholds = {key: overrides.pop(key) for key in THRESHOLD_PARAMS}
+    thresholds = {key: value for key, value in thresholds.items() if value is not None}
+    try:
+        post_params = get_postprocess_params(params['chord_mode'], **overrides)
+        params = rethreshold_params(params, **thresholds)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    audio_hash = result['metadata'].get('audio_sha256')
+    events = await run_in_threadpool(cached_note_events, audio_hash, params, bool(thresholds))
+    if events is None:
+        detail = "模型後驗機率已過期，請重新分析" if thresholds else "中間產物已過期，請重新分析"
+        raise HTTPException(status_code=409, detail=detail)
+    
+    refined = await run_in_threadpool(refine_from_events, events, result, post_params, params)
+    return Response(content=dumps(refined), media_type="application/json")
 
 
 @app.get("/health")
-async def health_check():
-    """健康檢查端點"""
-    return {"status": "ok", "service": "youtube-piano-visualizer"}
+def health_check():
+    """健康檢查端點（各快取統計會走訪目錄，以一般函式定義，由 FastAPI 在執行緒池執行）"""
+    return {
+        "status": "ok",
+        "service": "youtube-piano-visualizer",
+        "cache": result_cache.stats(),
+        "artifacts": artifact_cache.stats(),
+        "posteriors": posterior_cache.stats(),
+        "audio": audio_store.stats(),
+        "tasks": tasks.stats(),
+        "jobs": scheduler.stats(),
+        "progress": progress_bus.stats(),
+        "model": scheduler.model_status()
+    }
+
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus 格式的指標
+    
+    各處理階段 (download / preprocess / predict / 各過濾階段...) 的耗時、即時率與進出音符數，
+    任務在排程各狀態停留的時間、推論行程峰值記憶體。各 worker 行程分別統計。
+    """
+    pipeline_metrics.set_pending(scheduler.stats()['states'])
+    return Response(content=pipeline_metrics.render(), media_type=METRICS_CONTENT_TYPE)
 
 
 # 靜態檔案服務 (前端)
@@ -0,0 +1,182 @@
+"""
+Prometheus 文字格式的指標
+不引入 prometheus_client：只需要 counter / gauge / histogram 與文字輸出。
+指標為各 uvicorn worker 行程各自統計（與 /health 的快取計數相同），
+推論行程量測的階段耗時隨結果 metadata 回到主行程後才計入。
+
+格式: https://prometheus.io/docs/instrumenting/exposition_formats/
+"""
+
+import math
+import threading
+from typing import Optional, Dict, Any, List, Tuple
+
+# 階段耗時 (秒)：從毫秒級的過濾到數分鐘的下載/推論
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# 即時率 (階段耗時 / 音訊長度)
+REALTIME_FACTOR_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2)
+# 任務結果
+OUTCOMES = ('completed', 'error', 'cancelled')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ''
+    pairs = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class _Metric:
+    TYPE = ''
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._series: Dict[Tuple[Tuple[str, str], ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.TYPE}"]
+
+
+class Counter(_Metric):
+    TYPE = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = sorted(self._series.items())
+        return self._header() + [f"{self.name}{_format_labels(k)} {_format_value(v)}" for k, v in series]
+
+
+class Gauge(Counter):
+    TYPE = 'gauge'
+
+    def set(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._series[key] = value
+
+    def set_max(self, value: float, **labels):
+        """只在新值較大時更新（峰值）"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._series[key] = max(value, self._series.get(key, value))
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+
+class Histogram(_Metric):
+    TYPE = 'histogram'
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = DURATION_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items())
+        lines = self._header()
+        for key, (counts, total, count) in series:
+            for bound, bucket_count in zip(self.buckets, counts):
+                labels = key + (('le', _format_value(bound)),)
+                lines.append(f"{self.name}_bucket{_format_labels(labels)} {bucket_count}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class PipelineMetrics:
+    """分析管線的指標：各階段耗時/即時率/音符數、任務各排程階段耗時、峰值記憶體"""
+
+    def __init__(self, prefix: str = 'piano'):
+        self.stage_seconds = Histogram(f'{prefix}_stage_duration_seconds', '各處理階段耗時 (秒)')
+        self.stage_realtime_factor = Histogram(
+            f'{prefix}_stage_realtime_factor', '各處理階段耗時 / 音訊長度', REALTIME_FACTOR_BUCKETS
+        )
+        self.stage_notes_in = Counter(f'{prefix}_stage_notes_in_total', '進入各處理階段的音符數')
+        self.stage_notes_out = Counter(f'{prefix}_stage_notes_out_total', '各處理階段輸出的音符數')
+        self.job_phase_seconds = Histogram(f'{prefix}_job_phase_seconds', '任務在排程各狀態停留的時間 (秒)')
+        self.jobs = Counter(f'{prefix}_jobs_total', '結束的分析任務數')
+        self.audio_seconds = Counter(f'{prefix}_audio_seconds_total', '完成分析的音訊總長度 (秒)')
+        self.seconds_saved = Counter(f'{prefix}_inference_seconds_saved_total', '因靜音 / 非樂音而未推論的音訊長度 (秒)')
+        self.peak_rss = Gauge(f'{prefix}_inference_peak_rss_bytes', '推論行程的峰值常駐記憶體 (bytes)')
+        self.pending = Gauge(f'{prefix}_jobs_pending', '排程中的任務數 (依狀態)')
+        self._metrics = [
+            self.stage_seconds, self.stage_realtime_factor, self.stage_notes_in, self.stage_notes_out,
+            self.job_phase_seconds, self.jobs, self.audio_seconds, self.seconds_saved, self.peak_rss, self.pending,
+        ]
+
+    def observe_job(self, outcome: str, phases: Dict[str, float], instrumentation: Optional[Dict[str, Any]] = None):
+        """
+        記錄結束的任務
+
+        Args:
+            outcome: OUTCOMES 之一
+            phases: JobScheduler 的各狀態耗時 (含 total)
+            instrumentation: 結果 metadata['instrumentation'] (StageTrace.to_dict())
+        """
+        self.jobs.inc(outcome=outcome)
+        for phase, seconds in phases.items():
+            self.job_phase_seconds.observe(seconds, phase=phase)
+        if not instrumentation:
+            return
+
+        audio_duration = instrumentation.get('audio_duration')
+        if audio_duration:
+            self.audio_seconds.inc(audio_duration)
+        if instrumentation.get('inference_seconds_saved'):
+            self.seconds_saved.inc(instrumentation['inference_seconds_saved'])
+        if instrumentation.get('peak_rss_bytes'):
+            self.peak_rss.set_max(instrumentation['peak_rss_bytes'])
+        for name, entry in instrumentation.get('stages', {}).items():
+            self.stage_seconds.observe(entry['seconds'], stage=name)
+            if audio_duration:
+                self.stage_realtime_factor.observe(entry['seconds'] / audio_duration, stage=name)
+            if 'notes_in' in entry:
+                self.stage_notes_in.inc(entry['notes_in'], stage=name)
+            if 'notes_out' in entry:
+                self.stage_notes_out.inc(entry['notes_out'], stage=name)
+
+    def set_pending(self, states: Dict[str, int]):
+        """以排程器目前的狀態計數更新 (每次抓取時呼叫)"""
+        self.pending.clear()
+        for state, count in states.items():
+            self.pending.set(count, state=state)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
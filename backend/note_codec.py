@@ -0,0 +1,141 @@
+"""
+音符結果的緊湊二進位格式與 HTTP 壓縮
+
+JSON 每個音符都重複 5 個 key，長曲目動輒數 MB。
+二進位格式以毫秒量化時間、onset 差分編碼，並以固定寬度陣列排列，
+前端可直接以 TypedArray 視圖讀取，不需要逐字元解析。
+
+格式 (little-endian，陣列皆 4-byte 對齊):
+
+    偏移  型別               內容
+    0     char[4]            magic "PNB1"
+    4     uint32             音符數 N
+    8     uint32             metadata JSON 長度 M (UTF-8)
+    12    byte[M]            metadata JSON，補 0 至 4 的倍數
+    ...   uint32[N]          onset 差分 (毫秒，依開始時間排序，首個為絕對值)
+    ...   uint32[N]          時長 (毫秒)
+    ...   uint8[N]           音高 (MIDI)
+    ...   uint8[N]           力度
+
+還原：start = cumsum(onset 差分) / 1000，end = start + 時長 / 1000。
+時長取自音符的 duration（前端播放與繪製所用的值）；合併或截斷過的音符 end_time 不一定等於 start + duration。
+"""
+
+import gzip
+import json
+import struct
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+try:
+    import brotli  # 選用：有安裝時優先使用 br 壓縮
+except ImportError:
+    brotli = None
+
+BINARY_MEDIA_TYPE = "application/vnd.piano-notes"
+MAGIC = b"PNB1"
+_HEADER = struct.Struct("<4sII")
+
+
+def encode_notes_binary(result: Dict[str, Any]) -> bytes:
+    """將 {"metadata", "notes"} 結果編碼為二進位格式"""
+    notes: List[Dict[str, Any]] = result.get("notes") or []
+    count = len(notes)
+
+    start_ms = np.rint(np.fromiter((n["start_time"] for n in notes), dtype=np.float64, count=count) * 1000)
+    duration_ms = np.rint(np.fromiter((n["duration"] for n in notes), dtype=np.float64, count=count) * 1000)
+    pitch = np.fromiter((n["pitch"] for n in notes), dtype=np.int64, count=count)
+    velocity = np.fromiter((n["velocity"] for n in notes), dtype=np.int64, count=count)
+
+    order = np.argsort(start_ms, kind="stable")
+    start_ms = np.clip(start_ms[order], 0, None).astype(np.int64)
+    duration_ms = np.clip(duration_ms[order], 0, np.iinfo(np.uint32).max).astype(np.uint32)
+    onset_delta = np.diff(start_ms, prepend=0).astype(np.uint32)
+
+    metadata = json.dumps(result.get("metadata") or {}, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    padding = b"\0" * (-len(metadata) % 4)
+
+    return b"".join((
+        _HEADER.pack(MAGIC, count, len(metadata)),
+        metadata,
+        padding,
+        onset_delta.astype("<u4").tobytes(),
+        duration_ms.astype("<u4").tobytes(),
+        np.clip(pitch[order], 0, 255).astype(np.uint8).tobytes(),
+        np.clip(velocity[order], 0, 255).astype(np.uint8).tobytes(),
+    ))
+
+
+def decode_notes_binary(blob: bytes) -> Dict[str, Any]:
+    """還原為 {"metadata", "notes"}（時間為毫秒精度）"""
+    magic, count, meta_len = _HEADER.unpack_from(blob, 0)
+    if magic != MAGIC:
+        raise ValueError("不是有效的音符二進位格式")
+
+    offset = _HEADER.size
+    metadata = json.loads(blob[offset:offset + meta_len].decode("utf-8"))
+    offset += meta_len + (-meta_len % 4)
+
+    onset_delta = np.frombuffer(blob, dtype="<u4", count=count, offset=offset)
+    offset += 4 * count
+    duration_ms = np.frombuffer(blob, dtype="<u4", count=count, offset=offset)
+    offset += 4 * count
+    pitch = np.frombuffer(blob, dtype=np.uint8, count=count, offset=offset)
+    offset += count
+    velocity = np.frombuffer(blob, dtype=np.uint8, count=count, offset=offset)
+
+    start_ms = np.cumsum(onset_delta, dtype=np.int64)
+    notes = [
+        {
+            "pitch": p,
+            "start_time": s / 1000,
+            "end_time": (s + d) / 1000,
+            "duration": d / 1000,
+            "velocity": v,
+        }
+        for p, s, d, v in zip(pitch.tolist(), start_ms.tolist(), duration_ms.tolist(), velocity.tolist())
+    ]
+    return {"metadata": metadata, "notes": notes}
+
+
+def wants_binary(accept: Optional[str]) -> bool:
+    """Accept 標頭是否要求二進位格式"""
+    return _accepts(accept, BINARY_MEDIA_TYPE)
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """依 Accept-Encoding 選擇壓縮方式：br (有安裝時) > gzip > 不壓縮"""
+    if brotli is not None and _accepts(accept_encoding, "br"):
+        return "br"
+    if _accepts(accept_encoding, "gzip"):
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: Optional[str]) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=6)
+    return body
+
+
+def _accepts(header: Optional[str], token: str) -> bool:
+    """標頭中是否列出 token 且 q 值不為 0"""
+    if not header:
+        return False
+    for part in header.split(","):
+        name, *params = part.split(";")
+        if name.strip().lower() != token:
+            continue
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        return quality > 0
+    return False
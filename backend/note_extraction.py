@@ -0,0 +1,176 @@
+"""
+由模型後驗機率 (posteriorgram) 重新擷取音符
+basic-pitch 的 predict 每次都要重跑神經網路；onset/frame 後驗機率與門檻無關，
+保存下來後即可用任意門檻重新擷取 note_events，不需重新推論。
+
+擷取規則與 basic-pitch 的 output_to_notes_polyphonic 相同（推斷 onset、
+onset 峰值起音、能量低於 frame 門檻持續 energy_tol 幀即結束、melodia 補音），
+差別在於：
+- 延伸音符時以 NumPy 分段掃描，不逐幀迴圈
+- melodia 補音先將候選幀依機率排序一次，不在每次迭代重新對整個矩陣取 argmax
+"""
+
+from typing import Dict
+
+import numpy as np
+
+# basic-pitch 的模型常數 (basic_pitch/constants.py)
+AUDIO_SAMPLE_RATE = 22050
+FFT_HOP = 256
+ANNOT_N_FRAMES = (AUDIO_SAMPLE_RATE // FFT_HOP) * 2
+AUDIO_N_SAMPLES = AUDIO_SAMPLE_RATE * 2 - FFT_HOP
+MIDI_OFFSET = 21
+ENERGY_TOLERANCE = 11
+
+# 後驗機率的存放精度
+POSTERIOR_DTYPE = np.float16
+
+_INDEX = np.arange(4096)
+
+
+def model_frames_to_time(n_frames: int) -> np.ndarray:
+    """模型輸出幀 → 秒（含 basic-pitch 每個 2 秒視窗的對齊修正）"""
+    frames = np.arange(n_frames)
+    window_offset = (FFT_HOP / AUDIO_SAMPLE_RATE) * (ANNOT_N_FRAMES - AUDIO_N_SAMPLES / FFT_HOP) + 0.0018
+    return frames * FFT_HOP / AUDIO_SAMPLE_RATE - window_offset * np.floor(frames / ANNOT_N_FRAMES)
+
+
+def min_note_length_frames(min_note_length_ms: float) -> int:
+    """最小音符長度 (毫秒) → 模型幀數（與 predict 的換算相同）"""
+    return int(np.round(min_note_length_ms / 1000 * (AUDIO_SAMPLE_RATE / FFT_HOP)))
+
+
+def _infer_onsets(onsets: np.ndarray, frames: np.ndarray, n_diff: int = 2) -> np.ndarray:
+    """以 frame 機率的大幅上升補充 onset"""
+    frame_diff = np.min([
+        frames - np.concatenate([np.zeros((n, frames.shape[1]), frames.dtype), frames[:-n]])
+        for n in range(1, n_diff + 1)
+    ], axis=0)
+    frame_diff[frame_diff < 0] = 0
+    frame_diff[:n_diff, :] = 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        frame_diff = np.max(onsets) * frame_diff / np.max(frame_diff)
+    return np.max([onsets, frame_diff], axis=0)
+
+
+def _extent(column: np.ndarray, start: int, limit: int, threshold: float) -> tuple:
+    """
+    由 start 往後掃描，直到連續 ENERGY_TOLERANCE 幀低於門檻或到達 limit
+
+    等同於 basic-pitch 的逐幀迴圈:
+        i = start; k = 0
+        while i < limit and k < tol: k = k + 1 if column[i] < threshold else 0; i += 1
+
+    Returns:
+        (迴圈結束時的 i, k)
+    """
+    i, k, step = start, 0, 32
+    while i < limit:
+        below = column[i:min(limit, i + step)] < threshold
+        idx = _INDEX[:len(below)]
+        last_above = np.maximum.accumulate(np.where(below, -1, idx))
+        run = np.where(last_above >= 0, idx - last_above, idx + (k + 1))
+        reached = run >= ENERGY_TOLERANCE
+        j = int(reached.argmax())
+        if reached[j]:
+            return i + j + 1, ENERGY_TOLERANCE
+        k = int(run[-1])
+        i += len(below)
+        step = min(step * 2, len(_INDEX))
+    return i, k
+
+
+def extract_note_events(
+    onsets: np.ndarray,
+    frames: np.ndarray,
+    times: np.ndarray,
+    onset_threshold: float,
+    frame_threshold: float,
+    min_note_length_ms: float,
+    infer_onsets: bool = True,
+    melodia_trick: bool = True
+) -> Dict[str, np.ndarray]:
+    """
+    由 onset/frame 後驗機率擷取 note_events
+
+    Args:
+        onsets: onset 機率 (幀數, 88)，可為唯讀的 memmap
+        frames: frame 機率 (幀數, 88)
+        times: 每一幀的秒數
+        onset_threshold / frame_threshold / min_note_length_ms: 與 predict 相同的門檻
+
+    Returns:
+        欄名 → 陣列 (start, end, pitch, amplitude)，可直接給 NoteEventTable.from_arrays
+    """
+    frames = np.asarray(frames, dtype=np.float32)
+    onsets = np.asarray(onsets, dtype=np.float32)
+    n_frames, n_pitches = frames.shape
+    min_len = min_note_length_frames(min_note_length_ms)
+    notes = []
+
+    if infer_onsets and n_frames:
+        onsets = _infer_onsets(onsets, frames)
+
+    # onset 峰值 (時間軸上嚴格大於前後幀) 且超過門檻者起音，由後往前處理
+    peaks = np.zeros(onsets.shape, dtype=bool)
+    if n_frames > 2:
+        middle = onsets[1:-1]
+        peaks[1:-1] = (middle > onsets[:-2]) & (middle > onsets[2:]) & (middle >= onset_threshold)
+    onset_time, onset_pitch = np.nonzero(peaks)
+
+    remaining = frames.copy()
+    remaining_t = remaining.T  # remaining_t[pitch]：單一音高沿時間軸的視圖
+    for start, pitch in zip(onset_time[::-1].tolist(), onset_pitch[::-1].tolist()):
+        if start >= n_frames - 1:
+            continue
+        end, k = _extent(remaining_t[pitch], start + 1, n_frames - 1, frame_threshold)
+        end -= k
+        if end - start <= min_len:
+            continue
+        remaining[start:end, max(0, pitch - 1):pitch + 2] = 0
+        notes.append((start, end, pitch))
+
+    if melodia_trick:
+        # 剩餘能量只會被清為 0，因此依機率由大到小走訪一次候選幀，
+        # 跳過已被清除者，順序即等同於每次取整個矩陣的 argmax
+        candidates = np.flatnonzero(remaining > frame_threshold)
+        candidates = candidates[np.argsort(-remaining.ravel()[candidates], kind='stable')]
+        flat = remaining.ravel()
+        reversed_t = remaining_t[:, ::-1]
+        for index in candidates.tolist():
+            if flat[index] <= frame_threshold:
+                continue
+            mid, pitch = divmod(index, n_pitches)
+            flat[index] = 0
+            band = slice(max(0, pitch - 1), pitch + 2)
+
+            stop, k = _extent(remaining_t[pitch], mid + 1, n_frames - 1, frame_threshold)
+            remaining[mid + 1:stop, band] = 0
+            end = stop - 1 - k
+
+            # 往前掃描：在反轉的時間軸上用同一個函式 (i > 0 ⇔ 反轉索引 < n_frames - 1)
+            stop_r, k = _extent(reversed_t[pitch], n_frames - mid, n_frames - 1, frame_threshold)
+            stop = n_frames - 1 - stop_r
+            remaining[stop + 1:mid, band] = 0
+            start = stop + 1 + k
+
+            if end - start <= min_len:
+                continue
+            notes.append((start, end, pitch))
+
+    if not notes:
+        return {
+            "start": np.zeros(0), "end": np.zeros(0),
+            "pitch": np.zeros(0, dtype=np.int16), "amplitude": np.zeros(0),
+        }
+
+    start_idx, end_idx, pitch_idx = (np.array(col, dtype=np.int64) for col in zip(*notes))
+    # 振幅 = 音符範圍內 frame 機率的平均（以累積和一次算完）
+    cumulative = np.vstack([np.zeros((1, n_pitches)), np.cumsum(frames, axis=0, dtype=np.float64)])
+    amplitude = (cumulative[end_idx, pitch_idx] - cumulative[start_idx, pitch_idx]) / (end_idx - start_idx)
+    return {
+        "start": np.asarray(times, dtype=np.float64)[start_idx],
+        "end": np.asarray(times, dtype=np.float64)[end_idx],
+        "pitch": (pitch_idx + MIDI_OFFSET).astype(np.int16),
+        "amplitude": amplitude,
+    }
@@ -0,0 +1,43 @@
+"""
+音符時間索引
+依開始時間排序並記錄最長時長，查詢時間窗時以二分搜尋定位候選範圍，
+只檢查可能與時間窗重疊的音符，不需要掃描整首曲子。
+"""
+
+import math
+from typing import Any, Dict, List
+
+import numpy as np
+
+
+class NoteTimeIndex:
+    """
+    與 [start, end) 時間窗重疊的音符查詢
+
+    音符 i 與時間窗重疊 ⇔ start_i < end 且 end_i > start。
+    由於 end_i ≤ start_i + max_duration，候選音符的開始時間必定落在
+    (start - max_duration, end)，以兩次 searchsorted 即可取得，
+    之後只需在候選範圍內過濾 end_i > start。
+    """
+
+    def __init__(self, notes: List[Dict[str, Any]]):
+        self.notes = notes
+        starts = np.fromiter((n["start_time"] for n in notes), dtype=np.float64, count=len(notes))
+        # 結束時間以 start_time + duration 計算（與前端播放一致，不依賴 end_time）
+        ends = starts + np.fromiter((n["duration"] for n in notes), dtype=np.float64, count=len(notes))
+        self.order = np.argsort(starts, kind="stable")
+        self.starts = starts[self.order]
+        self.ends = ends[self.order]
+        self.max_duration = float(np.max(self.ends - self.starts)) if len(notes) else 0.0
+
+    def __len__(self):
+        return len(self.notes)
+
+    def query(self, start: float = 0.0, end: float = math.inf) -> List[Dict[str, Any]]:
+        """返回與 [start, end) 重疊的音符（依開始時間排序）"""
+        lo = int(np.searchsorted(self.starts, start - self.max_duration, side="right"))
+        hi = int(np.searchsorted(self.starts, end, side="left"))
+        if hi <= lo:
+            return []
+        overlapping = lo + np.flatnonzero(self.ends[lo:hi] > start)
+        return [self.notes[i] for i in self.order[overlapping].tolist()]
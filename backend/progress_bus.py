@@ -0,0 +1,152 @@
+"""
+任務進度事件匯流排
+排程器的回呼（下載執行緒 / 進度轉送執行緒）發布事件，
+SSE 連線以 asyncio 等待新事件，不再每 500ms 輪詢並重新序列化整個狀態。
+
+- 每個事件在發布時序列化一次，所有訂閱者共用同一份字串
+- 事件 id 全域遞增，斷線重連時以 Last-Event-ID 補送遺漏的事件
+- 進度事件只保留最新一筆；音符批次與結束事件完整保留
+- 任務結束後保留一段時間供重連，之後於下次有任務提交時清除
+"""
+
+import json
+import time
+import asyncio
+import threading
+from dataclasses import dataclass, field
+from typing import Optional, Dict, Any, List, Tuple, AsyncIterator
+
+# 預設事件 (前端 onmessage) 與音符批次事件
+STATUS_EVENT = 'status'
+NOTES_EVENT = 'notes'
+
+
+@dataclass
+class _Topic:
+    """單一任務的事件歷史與等待中的訂閱者"""
+    events: List[Tuple[int, str, str]] = field(default_factory=list)  # (id, 事件類型, 序列化後的 data)
+    waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = field(default_factory=list)
+    closed_at: Optional[float] = None
+
+
+class ProgressBus:
+    """
+    以任務為主題的發布/訂閱匯流排
+
+    publish 可在任意執行緒呼叫；subscribe 必須在事件迴圈中迭代。
+    """
+
+    def __init__(self, heartbeat_seconds: float = 15.0, retention_seconds: float = 300.0):
+        self.heartbeat_seconds = heartbeat_seconds
+        self.retention_seconds = retention_seconds
+        self._topics: Dict[str, _Topic] = {}
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def _expire(self):
+        """清除結束超過保留時間的主題（呼叫端需持有鎖）"""
+        deadline = time.monotonic() - self.retention_seconds
+        expired = [key for key, topic in self._topics.items()
+                   if topic.closed_at is not None and topic.closed_at < deadline]
+        for key in expired:
+            del self._topics[key]
+
+    def open(self, task_id: str):
+        """為新提交的任務建立主題（取代同一任務先前已結束的主題）"""
+        with self._lock:
+            self._expire()
+            self._topics[task_id] = _Topic()
+
+    def discard(self, task_id: str):
+        """移除主題（任務未能提交時）"""
+        with self._lock:
+            topic = self._topics.pop(task_id, None)
+        if topic:
+            self._wake(topic.waiters)
+
+    def has_topic(self, task_id: str) -> bool:
+        with self._lock:
+            return task_id in self._topics
+
+    def publish(self, task_id: str, event: str, data: Dict[str, Any], final: bool = False) -> Optional[int]:
+        """
+        發布事件
+
+        Args:
+            event: STATUS_EVENT 或 NOTES_EVENT
+            final: 任務的最後一個事件，發布後主題不再接受新事件
+
+        Returns:
+            事件 id；主題不存在或已結束時返回 None
+        """
+        payload = json.dumps(data, ensure_ascii=False)
+        with self._lock:
+            topic = self._topics.get(task_id)
+            if topic is None or topic.closed_at is not None:
+                return None
+            event_id = self._next_id
+            self._next_id += 1
+            if event == STATUS_EVENT and not final:
+                # 舊的進度已無意義，重連時只需補送最新一筆
+                topic.events = [e for e in topic.events if e[1] != STATUS_EVENT]
+            topic.events.append((event_id, event, payload))
+            if final:
+                topic.closed_at = time.monotonic()
+            waiters, topic.waiters = topic.waiters, []
+        self._wake(waiters)
+        return event_id
+
+    @staticmethod
+    def _wake(waiters):
+        for loop, ready in waiters:
+            loop.call_soon_threadsafe(ready.set)
+
+    async def subscribe(self, task_id: str, last_event_id: int = 0) -> AsyncIterator[Optional[Tuple[int, str, str]]]:
+        """
+        依序產生 last_event_id 之後的事件 (id, 事件類型, data)
+
+        超過 heartbeat_seconds 沒有新事件時產生 None（由呼叫端送出心跳）；
+        主題結束且事件送完，或主題被移除時停止。
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            ready = asyncio.Event()
+            with self._lock:
+                topic = self._topics.get(task_id)
+                if topic is None:
+                    return
+                pending = [e for e in topic.events if e[0] > last_event_id]
+                closed = topic.closed_at is not None
+                if not pending and not closed:
+                    topic.waiters.append((loop, ready))
+
+            for item in pending:
+                last_event_id = item[0]
+                yield item
+            if closed:
+                return
+            if pending:
+                continue
+
+            try:
+                await asyncio.wait_for(ready.wait(), timeout=self.heartbeat_seconds)
+            except asyncio.TimeoutError:
+                self._remove_waiter(task_id, loop, ready)
+                yield None
+            except BaseException:
+                # 連線中斷 (CancelledError)
+                self._remove_waiter(task_id, loop, ready)
+                raise
+
+    def _remove_waiter(self, task_id: str, loop, ready):
+        with self._lock:
+            topic = self._topics.get(task_id)
+            if topic and (loop, ready) in topic.waiters:
+                topic.waiters.remove((loop, ready))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "topics": len(self._topics),
+                "waiting_subscribers": sum(len(t.waiters) for t in self._topics.values()),
+            }
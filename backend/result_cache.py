@@ -0,0 +1,144 @@
+"""
+分析結果磁碟快取
+以 YouTube 影片 ID + 分析參數雜湊作為 key，將結果 JSON 持久化到磁碟，
+重新部署或重啟後仍可直接命中，不需重新下載與推論。
+
+多個 uvicorn worker 共用同一個 volume 時：
+- 寫入使用暫存檔 + os.replace，讀取端永遠不會看到寫到一半的檔案
+- 淘汰 (eviction) 以檔案鎖序列化；被其他 worker 刪除的檔案視為未命中
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Optional, Dict, Any
+
+try:
+    import fcntl  # POSIX 檔案鎖 (Docker / Railway)
+except ImportError:  # Windows 本地開發：單一 worker，不需要跨行程鎖
+    fcntl = None
+
+try:
+    from backend.serialization import loads, write_json_atomic  # Docker 環境
+except ImportError:
+    from serialization import loads, write_json_atomic  # 本地開發
+
+logger = logging.getLogger(__name__)
+
+
+def params_hash(params: Dict[str, Any]) -> str:
+    """分析參數的穩定雜湊（與 key 順序無關）"""
+    canonical = json.dumps(params, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:16]
+
+
+class ResultCache:
+    """
+    以 LRU 淘汰、總大小受限的結果快取
+
+    每筆結果存成 `<video_id>-<params_hash>.json`；
+    命中時更新檔案 mtime，淘汰時刪除 mtime 最舊的檔案直到低於上限。
+    命中/未命中/淘汰計數為各 worker 行程各自統計。
+    """
+
+    SUFFIX = '.json'
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._counter_lock = threading.Lock()
+
+    def _path(self, video_id: str, params: Dict[str, Any]) -> Path:
+        return self.root / f"{video_id}-{params_hash(params)}{self.SUFFIX}"
+
+    def _count(self, field: str, amount: int = 1):
+        with self._counter_lock:
+            setattr(self, field, getattr(self, field) + amount)
+
+    def get(self, video_id: str, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """讀取快取結果；未命中時返回 None"""
+        path = self._path(video_id, params)
+        try:
+            result = loads(path.read_bytes())
+            os.utime(path)  # 標記為最近使用
+        except (FileNotFoundError, json.JSONDecodeError):
+            self._count('misses')
+            return None
+
+        self._count('hits')
+        logger.info(f"📍[Cache] 命中: {path.name}")
+        return result
+
+    def contains(self, video_id: str, params: Dict[str, Any]) -> bool:
+        """是否已有快取結果（只檢查檔案是否存在，不讀取內容、不計入命中率）"""
+        return self._path(video_id, params).exists()
+
+    def put(self, video_id: str, params: Dict[str, Any], result: Dict[str, Any]):
+        """原子寫入結果，並在超過容量上限時淘汰最舊的項目"""
+        path = self._path(video_id, params)
+        write_json_atomic(path, result)
+
+        logger.info(f"📍[Cache] 已寫入: {path.name}")
+        self.evict()
+
+    @contextmanager
+    def _exclusive(self):
+        """跨 worker 的淘汰鎖"""
+        if fcntl is None:
+            yield
+            return
+        with open(self.root / '.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _entries(self):
+        """(mtime, size, path)，檔案可能同時被其他 worker 刪除"""
+        entries = []
+        for path in self.root.glob(f"*{self.SUFFIX}"):
+            if path.name.startswith('.tmp-'):
+                continue
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def evict(self):
+        """刪除最久未使用的項目，直到總大小不超過 max_bytes"""
+        with self._exclusive():
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            evicted = 0
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                total -= size
+                evicted += 1
+
+        if evicted:
+            self._count('evictions', evicted)
+            logger.info(f"📍[Cache] 淘汰了 {evicted} 筆結果")
+
+    def stats(self) -> Dict[str, Any]:
+        entries = self._entries()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+        }
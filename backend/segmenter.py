@@ -0,0 +1,189 @@
+"""
+推論前的靜音 / 非樂音片段偵測
+很多鋼琴影片開頭有口白或掌聲、結尾有長段靜音，這些片段送進 basic-pitch 只是白花推論時間。
+在預處理後的 PCM 上逐幀計算能量與頻譜平坦度 (spectral flatness)：
+
+- 能量低於門檻 → 靜音
+- 頻譜平坦度高 (能量平均分散在各頻率，例如掌聲、環境噪音) → 非樂音
+- 其餘 (有明顯諧波峰值的聲音) → 送進模型
+
+偵測結果經過平滑 (合併短間隙、丟棄過短的片段) 後前後各補一段邊界，
+讓模型在音符起音前有上下文、延音的尾巴也不會被切掉。
+WAV 以固定大小的區塊串流讀取，記憶體用量與音訊長度無關（只保留每幀兩個特徵值）。
+"""
+
+import math
+import wave
+from pathlib import Path
+from typing import Optional, List, Tuple
+
+import numpy as np
+
+# 分析幀長度 (22.05kHz 下約 93ms)，不重疊
+FRAME_SIZE = 2048
+# 每次從 WAV 讀取的幀數 (約 24 秒)
+READ_FRAMES = 256
+# 計算平坦度的頻帶：鋼琴基頻到主要泛音的範圍
+FLATNESS_BAND_HZ = (27.5, 4200.0)
+
+# 絕對靜音門檻 (dBFS)
+SILENCE_FLOOR_DB = -50.0
+# 比全曲較響片段 (第 95 百分位) 低超過此 dB 數視為靜音
+RELATIVE_SILENCE_DB = 35.0
+# 平坦度高於此值視為噪音 (白噪音約 0.56，鋼琴音 < 0.1)
+FLATNESS_MAX = 0.4
+# 活動片段之間短於此秒數的間隙直接合併 (樂句之間的換氣、休止)
+MIN_GAP_SECONDS = 2.0
+# 短於此秒數的孤立活動片段丟棄 (咳嗽、碰撞聲)
+MIN_ACTIVE_SECONDS = 0.5
+# 每個活動片段前後保留的邊界 (秒)
+PAD_SECONDS = 1.0
+
+Region = Tuple[float, float]
+
+
+def wav_info(audio_path: Path) -> Optional[Tuple[int, int, int]]:
+    """
+    16-bit PCM WAV 的 (聲道數, 取樣率, 取樣數)；不是可直接讀取的 WAV 時返回 None
+    """
+    if Path(audio_path).suffix.lower() != '.wav':
+        return None
+    try:
+        with wave.open(str(audio_path), 'rb') as wav:
+            if wav.getsampwidth() != 2:
+                return None
+            return wav.getnchannels(), wav.getframerate(), wav.getnframes()
+    except (wave.Error, EOFError, OSError):
+        return None
+
+
+def copy_wav_segment(input_path: Path, start: float, duration: float, output_path: Path,
+                     sample_rate: int, block_frames: int = 1 << 18) -> bool:
+    """
+    將單聲道 16-bit WAV 的 [start, start + duration) 直接複製為新的 WAV（不經 FFmpeg 重新解碼）
+
+    Returns:
+        False 表示輸入不是 sample_rate 的單聲道 16-bit WAV，呼叫端需改用 FFmpeg
+    """
+    info = wav_info(input_path)
+    if info is None or info[:2] != (1, sample_rate):
+        return False
+    with wave.open(str(input_path), 'rb') as src, wave.open(str(output_path), 'wb') as dst:
+        dst.setnchannels(1)
+        dst.setsampwidth(2)
+        dst.setframerate(sample_rate)
+        first = min(info[2], max(0, round(start * sample_rate)))
+        remaining = min(info[2] - first, round(duration * sample_rate))
+        src.setpos(first)
+        while remaining > 0:
+            data = src.readframes(min(block_frames, remaining))
+            if not data:
+                break
+            dst.writeframes(data)
+            remaining -= len(data) // 2
+    return True
+
+
+def frame_features(audio_path: Path) -> Optional[Tuple[np.ndarray, np.ndarray, float]]:
+    """
+    逐幀的能量 (dBFS) 與頻譜平坦度
+
+    Returns:
+        (能量, 平坦度, 每幀秒數)；不是 16-bit PCM WAV 時返回 None
+    """
+    info = wav_info(audio_path)
+    if info is None:
+        return None
+    channels, sample_rate, _ = info
+
+    window = np.hanning(FRAME_SIZE).astype(np.float32)
+    freqs = np.fft.rfftfreq(FRAME_SIZE, 1 / sample_rate)
+    band = (freqs >= FLATNESS_BAND_HZ[0]) & (freqs <= FLATNESS_BAND_HZ[1])
+    energies: List[np.ndarray] = []
+    flatness: List[np.ndarray] = []
+    leftover = np.zeros(0, dtype=np.float32)
+
+    with wave.open(str(audio_path), 'rb') as wav:
+        while True:
+            data = wav.readframes(FRAME_SIZE * READ_FRAMES)
+            if not data:
+                break
+            samples = np.frombuffer(data, dtype='<i2').astype(np.float32) / 32768.0
+            if channels > 1:
+                samples = samples[:len(samples) // channels * channels].reshape(-1, channels).mean(axis=1)
+            samples = np.concatenate([leftover, samples])
+            n_frames = len(samples) // FRAME_SIZE
+            leftover = samples[n_frames * FRAME_SIZE:]
+            if not n_frames:
+                continue
+            frames = samples[:n_frames * FRAME_SIZE].reshape(n_frames, FRAME_SIZE)
+
+            rms = np.sqrt(np.mean(frames * frames, axis=1))
+            energies.append(20 * np.log10(rms + 1e-10))
+            power = np.abs(np.fft.rfft(frames * window, axis=1))[:, band] ** 2 + 1e-12
+            flatness.append(np.exp(np.mean(np.log(power), axis=1)) / np.mean(power, axis=1))
+
+    if not energies:
+        return np.zeros(0), np.zeros(0), FRAME_SIZE / sample_rate
+    return np.concatenate(energies), np.concatenate(flatness), FRAME_SIZE / sample_rate
+
+
+def _runs(mask: np.ndarray) -> List[Tuple[int, int]]:
+    """連續為 True 的 [起點, 終點) 幀索引"""
+    edges = np.diff(np.concatenate([[0], mask.astype(np.int8), [0]]))
+    return list(zip(np.flatnonzero(edges == 1).tolist(), np.flatnonzero(edges == -1).tolist()))
+
+
+def active_regions(energy: np.ndarray, flatness: np.ndarray, frame_seconds: float, duration: float) -> List[Region]:
+    """
+    由逐幀特徵決定要送進模型的時間範圍
+
+    Returns:
+        依時間排序、互不重疊的 [(起點秒數, 終點秒數)]；整段都不活躍時為空列表
+    """
+    if not len(energy):
+        return []
+    threshold = max(SILENCE_FLOOR_DB, float(np.percentile(energy, 95)) - RELATIVE_SILENCE_DB)
+    active = (energy > threshold) & (flatness < FLATNESS_MAX)
+
+    # 合併短間隙 (開頭與結尾的靜音不算間隙)，再丟棄過短的孤立片段
+    runs = _runs(active)
+    merged: List[List[int]] = []
+    max_gap = math.ceil(MIN_GAP_SECONDS / frame_seconds)
+    for start, end in runs:
+        if merged and start - merged[-1][1] <= max_gap:
+            merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    min_frames = math.ceil(MIN_ACTIVE_SECONDS / frame_seconds)
+
+    regions: List[Region] = []
+    for start, end in merged:
+        if end - start < min_frames:
+            continue
+        region_start = max(0.0, start * frame_seconds - PAD_SECONDS)
+        region_end = min(duration, end * frame_seconds + PAD_SECONDS)
+        if regions and region_start <= regions[-1][1]:
+            regions[-1] = (regions[-1][0], region_end)
+        else:
+            regions.append((region_start, region_end))
+    return regions
+
+
+def find_active_regions(audio_path: Path) -> Optional[Tuple[List[Region], float]]:
+    """
+    偵測預處理後音訊中需要推論的範圍
+
+    Returns:
+        (活動範圍列表, 音訊總長度秒數)；無法讀取 (不是 16-bit PCM WAV) 時返回 None
+    """
+    info = wav_info(audio_path)
+    if info is None:
+        return None
+    duration = info[2] / info[1]
+    return active_regions(*frame_features(audio_path), duration), duration
+
+
+def skipped_seconds(regions: List[Region], duration: float) -> float:
+    """不推論的總秒數"""
+    return max(0.0, duration - sum(end - start for start, end in regions))
@@ -0,0 +1,43 @@
+"""
+分析結果序列化
+有安裝 orjson 時使用 orjson (比標準庫快數倍)，否則退回標準庫 json。
+一律輸出緊湊格式的 UTF-8 bytes，不做縮排。
+"""
+
+import os
+import json
+import tempfile
+from pathlib import Path
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:  # 本地開發未安裝時使用標準庫
+    orjson = None
+
+
+def dumps(obj: Any) -> bytes:
+    """序列化為緊湊 JSON (UTF-8 bytes)"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    """解析 JSON"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def write_json_atomic(path: Path, obj: Any):
+    """序列化一次並以暫存檔 + os.replace 原子寫入"""
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix='.tmp-', suffix=path.suffix)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(dumps(obj))
+        os.replace(tmp_path, path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
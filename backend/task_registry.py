@@ -0,0 +1,210 @@
+"""
+任務狀態登錄
+取代原本只增不減的 task_status dict：
+
+- RAM 中只保留輕量狀態 (status / progress / message / timings)
+- 完成的結果放在以記憶體預算限制的 LRU；超出預算時只從 RAM 移除，
+  之後需要時再由磁碟結果快取 (ResultCache) 讀回
+- 結束 (完成/失敗/取消) 超過保存期限的任務整筆清除；數量另有上限
+- 所有操作以鎖保護，可由排程器的下載執行緒 / 進度轉送執行緒直接更新
+"""
+
+import time
+import threading
+from dataclasses import dataclass
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+
+FINAL_STATUSES = ('completed', 'error', 'cancelled')
+
+# 結果的記憶體估計：每個音符 dict 約 350 bytes，加上 metadata
+NOTE_BYTES = 350
+RESULT_BASE_BYTES = 4096
+
+
+def estimate_result_bytes(result: Dict[str, Any]) -> int:
+    """結果在 RAM 中的大約大小（不逐一量測，避免完成時多走訪一次所有音符）"""
+    return RESULT_BASE_BYTES + len(result.get('notes') or []) * NOTE_BYTES
+
+
+@dataclass
+class _Task:
+    """單一任務的輕量狀態；result_key 為 (影片 ID, 分析參數)，用於由磁碟快取讀回結果"""
+    status: Dict[str, Any]
+    result_key: Optional[Tuple[str, Dict[str, Any]]] = None
+    finished_at: Optional[float] = None
+
+
+class TaskRegistry:
+    """
+    以 TTL + 數量上限清除、結果受記憶體預算限制的任務登錄
+
+    status() 返回的 dict 不含 result；完整結果以 result() 取得。
+    """
+
+    def __init__(self, result_cache, ttl_seconds: float = 3600, memory_budget_bytes: int = 128 * 1024 * 1024,
+                 max_finished: int = 10000):
+        self.result_cache = result_cache
+        self.ttl_seconds = ttl_seconds
+        self.memory_budget_bytes = memory_budget_bytes
+        self.max_finished = max_finished
+        self.spills = 0
+        self.reloads = 0
+        self.expirations = 0
+        self._tasks: Dict[str, _Task] = {}
+        self._finished: OrderedDict = OrderedDict()  # task_id → 結束時間（依結束先後排序）
+        self._results: OrderedDict = OrderedDict()  # task_id → (結果, 估計大小)，LRU
+        self._result_bytes = 0
+        self._lock = threading.Lock()
+
+    def __contains__(self, task_id: str) -> bool:
+        with self._lock:
+            self._expire()
+            return task_id in self._tasks
+
+    def _expire(self):
+        """清除結束超過保存期限或超出數量上限的任務（呼叫端需持有鎖）"""
+        deadline = time.monotonic() - self.ttl_seconds
+        while self._finished:
+            task_id, finished_at = next(iter(self._finished.items()))
+            if finished_at >= deadline and len(self._finished) <= self.max_finished:
+                break
+            del self._finished[task_id]
+            del self._tasks[task_id]
+            self._drop_result(task_id)
+            self.expirations += 1
+
+    def _drop_result(self, task_id: str):
+        entry = self._results.pop(task_id, None)
+        if entry:
+            self._result_bytes -= entry[1]
+
+    def _keep_result(self, task_id: str, result: Dict[str, Any]):
+        """放入結果 LRU，超出預算時移出最久未使用且可由磁碟讀回的結果（呼叫端需持有鎖）"""
+        self._drop_result(task_id)
+        size = estimate_result_bytes(result)
+        self._results[task_id] = (result, size)
+        self._result_bytes += size
+
+        for other in list(self._results):
+            if self._result_bytes <= self.memory_budget_bytes:
+                break
+            if other == task_id or self._tasks[other].result_key is None:
+                continue  # 磁碟快取寫入失敗的結果只能留在 RAM，直到任務過期
+            self._drop_result(other)
+            self.spills += 1
+
+    def set(self, task_id: str, status: Dict[str, Any], result: Optional[Dict[str, Any]] = None,
+            result_key: Optional[Tuple[str, Dict[str, Any]]] = None, restart: bool = False) -> bool:
+        """
+        更新任務狀態
+
+        已結束的任務不會再回到執行中的狀態（例如任務結束後才送達的進度回報），
+        也不會因之後的狀態更新而失去已保存的結果；重新提交時以 restart=True 開始新的一輪。
+
+        Args:
+            status: 輕量狀態（其中的 'result' 會被忽略）
+            result: 完成的結果
+            result_key: (影片 ID, 分析參數)，結果已寫入磁碟快取時提供，超出記憶體預算時可移出 RAM
+            restart: 重新提交：清除上一輪的結束狀態與結果
+
+        Returns:
+            False 表示更新被忽略（任務已結束而新狀態不是結束狀態）
+        """
+        status = {key: value for key, value in status.items() if key != 'result'}
+        final = status.get('status') in FINAL_STATUSES
+        with self._lock:
+            previous = self._tasks.get(task_id)
+            if previous is not None and not restart:
+                if previous.finished_at is not None and not final:
+                    return False
+                if result is None:
+                    # 沒有新結果時沿用已保存的結果
+                    result_key = result_key or previous.result_key
+                    entry = self._results.get(task_id)
+                    result = entry[0] if entry else None
+
+            self._tasks[task_id] = _Task(status, result_key)
+            self._finished.pop(task_id, None)
+            self._drop_result(task_id)
+            if final:
+                self._tasks[task_id].finished_at = self._finished[task_id] = time.monotonic()
+            if result is not None:
+                self._keep_result(task_id, result)
+            self._expire()
+            return True
+
+    def status(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """任務的輕量狀態；不存在或已過期時返回 None"""
+        with self._lock:
+            self._expire()
+            task = self._tasks.get(task_id)
+            return dict(task.status) if task else None
+
+    def result(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """
+        完成的結果；不在 RAM 時由磁碟快取讀回
+
+        Returns:
+            結果 dict；任務未完成、不存在或磁碟快取也已淘汰時返回 None
+        """
+        with self._lock:
+            entry = self._results.get(task_id)
+            if entry:
+                self._results.move_to_end(task_id)
+                return entry[0]
+            task = self._tasks.get(task_id)
+            if task is None or task.result_key is None:
+                return None
+            result_key = task.result_key
+
+        result = self.result_cache.get(*result_key)
+        if result is None:
+            return None
+
+        with self._lock:
+            if self._tasks.get(task_id) is not task:
+                return result  # 讀取期間任務被重新提交或過期
+            entry = self._results.get(task_id)
+            if entry:
+                return entry[0]  # 並發讀回：沿用先放入的物件，讓已編碼回應的快取繼續命中
+            self.reloads += 1
+            self._keep_result(task_id, result)
+            return result
+
+    def snapshot(self, task_id: str) -> Optional[_Task]:
+        """目前的登錄項目（提交失敗時以 restore 還原）"""
+        with self._lock:
+            return self._tasks.get(task_id)
+
+    def restore(self, task_id: str, snapshot: Optional[_Task]):
+        """還原為 snapshot 時的狀態；snapshot 為 None 時移除任務（RAM 中的結果不還原，需要時由磁碟讀回）"""
+        with self._lock:
+            self._finished.pop(task_id, None)
+            self._drop_result(task_id)
+            if snapshot is None:
+                self._tasks.pop(task_id, None)
+                return
+            self._tasks[task_id] = snapshot
+            if snapshot.finished_at is not None:
+                self._finished[task_id] = snapshot.finished_at
+                # 維持依結束時間排序，_expire 才能只檢查開頭
+                for other, finished_at in list(self._finished.items()):
+                    if finished_at > snapshot.finished_at:
+                        self._finished.move_to_end(other)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._expire()
+            return {
+                "tasks": len(self._tasks),
+                "active": len(self._tasks) - len(self._finished),
+                "finished": len(self._finished),
+                "results_in_memory": len(self._results),
+                "result_bytes": self._result_bytes,
+                "memory_budget_bytes": self.memory_budget_bytes,
+                "spills": self.spills,
+                "reloads": self.reloads,
+                "expirations": self.expirations,
+                "ttl_seconds": self.ttl_seconds,
+            }
@@ -0,0 +1,209 @@
+"""
+上傳音訊的串流接收
+老師手上已有錄音時不必繞經 YouTube：multipart 請求本體一邊到達一邊解析，
+檔案欄位分塊寫進暫存檔並同時計算內容雜湊，整個檔案不會放進 RAM。
+雜湊與 audio_store.hash_file 相同 (sha256 前 32 碼)，接收完即可查詢結果快取。
+
+    spool = MultipartSpool(content_type, staging_dir, max_bytes)
+    async for chunk in request.stream():
+        spool.feed(chunk)
+    upload = spool.finish()  # → 暫存檔路徑、原始檔名、內容雜湊
+"""
+
+import hashlib
+from pathlib import Path
+from dataclasses import dataclass, field
+from typing import Optional, Dict, List
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header  # python-multipart >= 0.0.13
+except ImportError:
+    from multipart.multipart import MultipartParser, parse_options_header
+
+# ffmpeg 能解碼的常見音訊 / 影片容器
+AUDIO_SUFFIXES = ('.mp3', '.wav', '.m4a', '.aac', '.flac', '.ogg', '.oga', '.opus', '.webm', '.mp4', '.wma', '.aiff')
+# 檔案以外的文字欄位 (例如 title) 合計的長度上限
+MAX_FIELD_BYTES = 4096
+
+
+class UploadError(Exception):
+    """上傳內容無法接受，呼叫端應回應 HTTP 400"""
+
+
+class UploadTooLargeError(UploadError):
+    """檔案超過大小上限，呼叫端應回應 HTTP 413"""
+
+    def __init__(self, limit: int):
+        super().__init__(f"檔案超過 {limit // (1024 * 1024)} MB 上限")
+        self.limit = limit
+
+
+@dataclass
+class SpooledUpload:
+    """接收完成的上傳檔案"""
+    path: Path  # 暫存檔 (副檔名沿用原始檔名)
+    filename: str  # 原始檔名
+    content_hash: str  # sha256 前 32 碼
+    size: int
+    fields: Dict[str, str] = field(default_factory=dict)  # 其他文字欄位
+
+    @property
+    def title(self) -> str:
+        """顯示用標題：title 欄位，否則為不含副檔名的檔名"""
+        return self.fields.get('title', '').strip() or Path(self.filename).stem or 'Upload'
+
+
+def _header_params(value: bytes) -> Dict[str, str]:
+    _, params = parse_options_header(value)
+    return {key.decode('latin-1').lower(): val.decode('utf-8', 'replace') for key, val in params.items()}
+
+
+class MultipartSpool:
+    """
+    multipart/form-data 的增量解析器：file_field 欄位寫入 directory 下的暫存檔
+
+    Args:
+        content_type: 請求的 Content-Type 標頭 (含 boundary)
+        directory: 暫存檔目錄 (與音訊存放區同一個檔案系統，之後可直接換名)
+        max_bytes: 檔案大小上限
+        file_field: 檔案欄位名稱
+
+    Raises:
+        UploadError: 不是 multipart/form-data 請求
+    """
+
+    def __init__(self, content_type: str, directory: Path, max_bytes: int, file_field: str = 'file'):
+        mime, params = parse_options_header(content_type.encode('latin-1', 'replace'))
+        boundary = params.get(b'boundary')
+        if mime != b'multipart/form-data' or not boundary:
+            raise UploadError("請以 multipart/form-data 上傳音訊檔案")
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.file_field = file_field
+        self.fields: Dict[str, str] = {}
+        self._digest = hashlib.sha256()
+        self._size = 0
+        self._field_bytes = 0
+        self._file = None
+        self._path: Optional[Path] = None
+        self._filename: Optional[str] = None
+        self._done = False
+        self._error: Optional[UploadError] = None
+
+        # 目前這個部分的標頭與內容
+        self._header_name = b''
+        self._header_value = b''
+        self._headers: Dict[str, bytes] = {}
+        self._field: Optional[str] = None
+        self._value: List[bytes] = []
+
+        self._parser = MultipartParser(boundary, {
+            'on_part_begin': self._on_part_begin,
+            'on_header_field': self._on_header_field,
+            'on_header_value': self._on_header_value,
+            'on_header_end': self._on_header_end,
+            'on_headers_finished': self._on_headers_finished,
+            'on_part_data': self._on_part_data,
+            'on_part_end': self._on_part_end,
+            'on_end': self._on_end,
+        })
+
+    # ---------- 解析器回呼 ----------
+
+    def _on_part_begin(self):
+        self._headers = {}
+        self._field = None
+        self._value = []
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_name += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_name.decode('latin-1').lower()] = self._header_value
+        self._header_name = b''
+        self._header_value = b''
+
+    def _on_headers_finished(self):
+        disposition = _header_params(self._headers.get('content-disposition', b''))
+        self._field = disposition.get('name')
+        if self._field != self.file_field or self._file is not None:
+            return
+        filename = Path(disposition.get('filename', '').replace('\\', '/')).name
+        suffix = Path(filename).suffix.lower()
+        if suffix not in AUDIO_SUFFIXES:
+            self._error = UploadError(f"不支援的檔案類型: {suffix or filename or '未命名'}")
+            return
+        self._filename = filename
+        self._path = self.directory / f"upload{suffix}"
+        self._file = open(self._path, 'wb')
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self._error is not None:
+            return
+        if self._field == self.file_field and self._file is not None and not self._file.closed:
+            chunk = data[start:end]
+            self._size += len(chunk)
+            if self._size > self.max_bytes:
+                self._error = UploadTooLargeError(self.max_bytes)
+                return
+            self._digest.update(chunk)
+            self._file.write(chunk)
+        elif self._field and self._field != self.file_field:
+            self._field_bytes += end - start
+            if self._field_bytes > MAX_FIELD_BYTES:
+                self._error = UploadError("文字欄位過長")
+                return
+            self._value.append(data[start:end])
+
+    def _on_part_end(self):
+        if self._field == self.file_field and self._file is not None:
+            self._file.close()
+        elif self._field and self._field != self.file_field:
+            self.fields[self._field] = b''.join(self._value).decode('utf-8', 'replace')
+
+    def _on_end(self):
+        self._done = True
+
+    # ---------- 對外介面 ----------
+
+    def feed(self, chunk: bytes):
+        """
+        處理請求本體的下一個區塊
+
+        Raises:
+            UploadError: 檔案類型不支援、超過大小上限或格式錯誤（之後的區塊不應再送入）
+        """
+        if self._error is None and chunk:
+            try:
+                self._parser.write(chunk)
+            except Exception as e:  # python-multipart 各版本的解析錯誤類別不同
+                self._error = UploadError(f"multipart 格式錯誤: {e}")
+        if self._error is not None:
+            self.close()
+            raise self._error
+
+    def finish(self) -> SpooledUpload:
+        """
+        請求本體接收完畢
+
+        Raises:
+            UploadError: 沒有檔案欄位、檔案為空或請求本體不完整
+        """
+        self.close()
+        if self._error is not None:
+            raise self._error
+        if self._path is None:
+            raise UploadError(f"缺少檔案欄位 {self.file_field}")
+        if not self._done:
+            raise UploadError("上傳未完成 (請求本體不完整)")
+        if self._size == 0:
+            raise UploadError("上傳的檔案是空的")
+        return SpooledUpload(self._path, self._filename, self._digest.hexdigest()[:32], self._size, self.fields)
+
+    def close(self):
+        """關閉暫存檔（暫存檔本身由暫存目錄負責刪除）"""
+        if self._file is not None and not self._file.closed:
+            self._file.close()
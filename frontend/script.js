@@ -325,6 +325,12 @@ async function startAnalysis() {
             body: JSON.stringify({ url })
         });
 
+        if (response.status === 429) {
+            // 伺服器佇列已滿
+            const data = await response.json();
+            throw new Error(data.detail?.message || '伺服器忙碌中，請稍後再試');
+        }
+
         if (!response.ok) {
             throw new Error(`API 錯誤: ${response.status}`);
         }
@@ -370,7 +376,7 @@ async function pollStatus(taskId) {
 
             if (data.status === 'completed') {
                 handleAnalysisComplete(data.result);
-            } else if (data.status === 'error') {
+            } else if (data.status === 'error' || data.status === 'cancelled') {
                 showToast(`分析失敗: ${data.message}`, 'error');
                 resetUI();
             } else {
@@ -399,7 +405,8 @@ function updateProgress(percent, status, message) {
         'downloading': '下載音訊中',
         'analyzing': '分析音訊中',
         'completed': '分析完成',
-        'error': '發生錯誤'
+        'error': '發生錯誤',
+        'cancelled': '已取消'
     };
 
     elements.progressTitle.textContent = statusMap[status] || status;